@@ -0,0 +1,96 @@
+# Context assembly (context_assembly.py) on a synthetic request with overlapping attachments:
+#   an uploaded ZIP of a generated repository, with --generated-files pretty-printed JSON files and lockfiles,
+#   a second repository dump that vendors --shared-share of the first one's files under vendor/,
+#   and --attached files uploaded on their own as well as inside the ZIP.
+# For standard and compact framing it reports the bytes and estimated tokens before and after, the savings
+# by technique and the time the stage takes. That nothing unique is lost is checked by
+# tests/test_context_assembly.py.
+#
+#   cd backend && python benchmarks/bench_assembly.py --files 3000 --shared-share 0.3 --out assembly.json
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from common import latency_summary, write_results  # noqa: E402
+from synthetic import tree_files  # noqa: E402
+
+from context_assembly import assemble_context  # noqa: E402
+from context_packer import ContextSource, estimate_tokens  # noqa: E402
+from ingest import render_content  # noqa: E402
+
+def generated_files(count: int, seed: int) -> list:
+    # Pretty-printed JSON (fixtures, API dumps) and yarn-style lockfiles: whitespace-heavy and tool-written
+    rng = random.Random(seed)
+    files = []
+    for i in range(count):
+        if i % 2:
+            records = [{"id": rng.getrandbits(32), "name": f"item_{j}", "tags": [f"t{rng.randrange(50)}" for _ in range(4)],
+                        "nested": {"enabled": bool(rng.getrandbits(1)), "weight": rng.random()}} for j in range(rng.randint(40, 200))]
+            files.append((f"fixtures/data_{i}.json", json.dumps(records, indent=4)))
+        else:
+            entries = [f'"pkg-{j}@^{rng.randrange(9)}.{rng.randrange(20)}.0":\n  version "{rng.randrange(9)}.{rng.randrange(20)}.1"\n'
+                       f'  resolved "https://registry.example/pkg-{j}"\n  integrity sha512-{rng.getrandbits(128):x}\n\n\n'
+                       for j in range(rng.randint(40, 200))]
+            files.append((f"deps/yarn_{i}.lock", "".join(entries)))
+    return files
+
+
+def build_sources(args) -> list:
+    shape = {"depth": args.depth, "fanout": args.fanout, "file_kb": args.file_kb, "ignored_share": 0, "binary_share": 0}
+    project = [(path, render_content(data)) for path, data in tree_files(args.files, seed=args.seed, **shape)]
+    project += generated_files(args.generated_files, args.seed)
+    other = [(path, render_content(data)) for path, data in tree_files(args.files // 2, seed=args.seed + 1, **shape)]
+    rng = random.Random(args.seed)
+    other += [(f"vendor/project/{path}", content) for path, content in project if rng.random() < args.shared_share]
+    attached = rng.sample(project, min(args.attached, len(project)))
+    return [
+        ContextSource("project.zip", 'zip', project),
+        ContextSource("gh_repo:::example/other", 'repo', other),
+        *(ContextSource(path.rsplit('/', 1)[-1], 'file', [(path.rsplit('/', 1)[-1], content)]) for path, content in attached),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=3000, help="source files in the uploaded project")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fanout", type=int, default=8)
+    parser.add_argument("--file-kb", type=float, default=4, help="median source file size")
+    parser.add_argument("--generated-files", type=int, default=40)
+    parser.add_argument("--shared-share", type=float, default=0.3, help="share of the project vendored by the second repository")
+    parser.add_argument("--attached", type=int, default=5, help="project files also uploaded on their own")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="also write the JSON results to this file")
+    args = parser.parse_args()
+
+    sources = build_sources(args)
+    tokens_before = sum(estimate_tokens(source.render()) for source in sources)
+    results = []
+    for compact in (False, True):
+        durations = []
+        for _ in range(args.repeat):
+            started_at = time.perf_counter()
+            assembled, report = assemble_context(sources, compact)
+            durations.append(time.perf_counter() - started_at)
+        tokens_after = sum(estimate_tokens(source.render()) for source in assembled)
+        results.append({
+            "framing": "compact" if compact else "standard",
+            "bytes_before": sum(len(source.render().encode('utf-8')) for source in sources),
+            "bytes_after": sum(len(source.render().encode('utf-8')) for source in assembled),
+            "tokens_before": tokens_before, "tokens_after": tokens_after,
+            "tokens_saved_share": round(1 - tokens_after / tokens_before, 3) if tokens_before else 0,
+            **report.as_dict(), "assembly": latency_summary(durations),
+        })
+
+    write_results("assembly", args, {"results": results}, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# Per-worker in-memory caches (a plain dict of dumps in each process, as the in-process caches kept
+# them) vs the shared SQLite cache store. Several worker processes serve the same set of repository
+# dumps one after another, like repeat requests that nginx sends to a different gunicorn worker.
+# Reports misses (dumps that had to be rebuilt), hit latency, and the memory the workers hold for the cache.
+#
+#   cd backend && python benchmarks/bench_cache_store.py --workers 3 --dumps 20 --dump-mb 4
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from cache_store import SqliteCacheStore  # noqa: E402
+
+
+def rss_bytes() -> int:
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def make_dump(index: int, size: int) -> str:
+    rng = random.Random(index)
+    parts, total = [], 0
+    while total < size:
+        body = "\n".join(f"    value_{j} = compute_{rng.randint(0, 500)}(x, y)  # step {j}" for j in range(rng.randint(20, 200)))
+        section = f"---\nFile: src/pkg_{index}/module_{len(parts)}.py\nContent:\n```\ndef handler_{len(parts)}(x, y):\n{body}\n```"
+        parts.append(section)
+        total += len(section)
+    return "\n".join(parts)
+
+
+def worker(mode: str, store_path: str, dumps: int, dump_size: int, rounds: int, queue) -> None:
+    store = SqliteCacheStore(store_path) if mode == "sqlite" else None
+    local_cache = {}
+    baseline = rss_bytes()
+    misses, hit_latencies = 0, []
+    for _ in range(rounds):
+        for index in range(dumps):
+            key = f"repo-{index}"
+            start = time.perf_counter()
+            text = store.get_text("repo", key) if store else local_cache.get(key)
+            elapsed = time.perf_counter() - start
+            if text is None:
+                misses += 1
+                text = make_dump(index, dump_size)
+                if store:
+                    store.put_text("repo", key, text)
+                else:
+                    local_cache[key] = text
+            else:
+                hit_latencies.append(elapsed)
+            del text
+    queue.put({"misses": misses, "hit_latencies": hit_latencies, "cache_rss_bytes": max(0, rss_bytes() - baseline)})
+
+
+def run(mode: str, args, store_path: str) -> dict:
+    queue = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=worker, args=(mode, store_path, args.dumps, args.dump_mb * 1024 * 1024, args.rounds, queue))
+        for _ in range(args.workers)
+    ]
+    start = time.perf_counter()
+    results = []
+    for process in processes:
+        process.start()
+        results.append(queue.get())
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+    latencies = sorted(latency for result in results for latency in result["hit_latencies"])
+    summary = {
+        "mode": mode, "seconds": round(elapsed, 3),
+        "misses": sum(result["misses"] for result in results),
+        "hits": len(latencies),
+        "hit_p50_ms": round(statistics.median(latencies) * 1000, 3) if latencies else None,
+        "hit_p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 3) if latencies else None,
+        "cache_rss_mb_all_workers": round(sum(result["cache_rss_bytes"] for result in results) / 1e6, 1),
+    }
+    if mode == "sqlite":
+        summary["store_file_mb"] = round(sum(p.stat().st_size for p in Path(store_path).parent.glob('*')) / 1e6, 1)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--dumps", type=int, default=20)
+    parser.add_argument("--dump-mb", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        memory = run("per_worker_dict", args, os.path.join(tmp, "unused"))
+        shared = run("sqlite", args, os.path.join(tmp, "store", "cache.sqlite3"))
+    print(json.dumps({
+        "workers": args.workers, "dumps": args.dumps, "dump_mb": args.dump_mb, "rounds": args.rounds,
+        "results": [memory, shared],
+        "memory_saved_mb": round(memory["cache_rss_mb_all_workers"] - shared["cache_rss_mb_all_workers"], 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+# Micro-benchmarks of the CPU-bound steps of a request, on synthetic inputs of configurable size and shape:
+#   mirror_refresh   RepoMirror.refresh of a generated bare repository (with ignored dirs and binaries) over
+#                    file:// into an empty mirror: fetch, ls-tree, cat-file and rendering every blob
+#   mirror_render    RepoMirror.render of the same commit again, from the per-blob render cache
+#   walker_baseline  baseline only, not on any request path: the disk walker in tree_walker.py over the
+#                    checkout of the same repository
+#   zip_sections     zip_file_sections over a generated upload, spooled like Starlette's UploadFile
+#   normalize_function_call  turning the proto args of a large generate_structured_response call into blocks
+#   blocks_from_response  the whole post-processing of such a response (conversion, validation, filtering)
+# Each case runs in its own subprocess, so its peak RSS is measured on its own.
+#
+#   cd backend && python benchmarks/bench_micro.py --files 3000 --file-kb 4 --blocks 400 --out micro.json
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from common import latency_summary, peak_rss_mb, write_results  # noqa: E402
+from synthetic import structured_blocks, write_git_repo, write_zip  # noqa: E402
+
+CASES = ["mirror_refresh", "mirror_render", "walker_baseline", "zip_sections", "normalize_function_call", "blocks_from_response"]
+
+
+def structured_response(blocks: list):
+    # A real SDK response object, as generate_content_async returns it
+    from google.generativeai import protos
+    from google.generativeai.types import GenerateContentResponse
+
+    return GenerateContentResponse.from_response(protos.GenerateContentResponse(candidates=[{
+        "content": {"role": "model", "parts": [{"function_call": {"name": "generate_structured_response", "args": {"parts": blocks}}}]},
+        "finish_reason": 1,
+    }]))
+
+
+def run_case(case: str, input_path: str, args) -> dict:
+    # Runs one case `repeat` times in this process and returns its timings
+    if case in ("mirror_refresh", "mirror_render"):
+        from repo_mirror import RepoMirror
+        clone_url = Path(input_path).as_uri()
+        mirrors = Path(input_path).parent / f"mirrors-{case}"  # removed with the parent's temporary directory
+        runs = iter(range(args.warmup + args.repeat))
+        if case == "mirror_refresh":
+            # A new mirror directory per run, so every run fetches and renders from scratch
+            step = lambda: asyncio.run(RepoMirror(str(mirrors / str(next(runs)))).refresh(clone_url))[1]  # noqa: E731
+        else:
+            mirror = RepoMirror(str(mirrors / "warm"))
+            commit_sha, _ = asyncio.run(mirror.refresh(clone_url))
+            git_dir = mirror._paths(clone_url)[0]
+            step = lambda: asyncio.run(mirror.render(git_dir, commit_sha))  # noqa: E731
+        size = lambda output: len(output.encode('utf-8'))  # noqa: E731
+    elif case == "walker_baseline":
+        from tree_walker import process_repository_to_text
+        step = lambda: process_repository_to_text(input_path)  # noqa: E731
+        size = lambda output: len(output.encode('utf-8'))  # noqa: E731
+    elif case == "zip_sections":
+        from ingest import zip_file_sections
+
+        def step():
+            upload = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+            with open(input_path, 'rb') as f:
+                shutil.copyfileobj(f, upload)
+            upload.seek(0)
+            return zip_file_sections(upload)
+        size = lambda output: sum(len(content.encode('utf-8')) for _, content in output)  # noqa: E731
+    else:
+        from block_normalizer import normalize_function_call
+        from response_blocks import blocks_from_response
+        with open(input_path, 'r', encoding='utf-8') as f:
+            response = structured_response(json.load(f))
+        function_call = response.candidates[0].content.parts[0].function_call
+        if case == "normalize_function_call":
+            step = lambda: [block.as_dict() for block in normalize_function_call(function_call)[0]]  # noqa: E731
+        else:
+            step = lambda: blocks_from_response(response)  # noqa: E731
+        size = lambda output: len(json.dumps(output).encode('utf-8'))  # noqa: E731
+
+    durations, output_bytes = [], 0
+    for _ in range(args.warmup + args.repeat):
+        started_at = time.perf_counter()
+        output = step()
+        durations.append(time.perf_counter() - started_at)
+        output_bytes = size(output)
+    durations = durations[args.warmup:]
+    best = min(durations)
+    return {
+        "case": case, "repeat": args.repeat, "output_bytes": output_bytes,
+        "throughput_mb_per_s": round(output_bytes / best / 1e6, 1),
+        "runs_per_s": round(1 / best, 1),
+        **latency_summary(durations), "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", default=",".join(CASES))
+    parser.add_argument("--files", type=int, default=3000, help="source files in the generated tree and archive")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fanout", type=int, default=8)
+    parser.add_argument("--file-kb", type=float, default=4, help="median source file size")
+    parser.add_argument("--ignored-share", type=float, default=0.3)
+    parser.add_argument("--binary-share", type=float, default=0.02)
+    parser.add_argument("--blocks", type=int, default=400, help="blocks in the structured response payload")
+    parser.add_argument("--block-chars", type=int, default=400)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="also write the JSON results to this file")
+    parser.add_argument("--child", choices=CASES, help=argparse.SUPPRESS)
+    parser.add_argument("--input", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_case(args.child, args.input, args)))
+        return
+
+    shape = {"files": args.files, "depth": args.depth, "fanout": args.fanout, "file_kb": args.file_kb,
+             "ignored_share": args.ignored_share, "binary_share": args.binary_share, "seed": args.seed}
+    cases = [case for case in args.cases.split(",") if case]
+    results, inputs = [], {}
+    with tempfile.TemporaryDirectory() as root:
+        root = Path(root)
+        if {"mirror_refresh", "mirror_render", "walker_baseline"} & set(cases):
+            # write_git_repo leaves the checkout next to the bare repository: the walker baseline reads that
+            summary = write_git_repo(root / "repo.git", **shape)
+            for case in ("mirror_refresh", "mirror_render"):
+                inputs[case] = {"path": root / "repo.git", "summary": summary}
+            inputs["walker_baseline"] = {"path": root / "repo.git.work", "summary": summary}
+        if "zip_sections" in cases:
+            inputs["zip_sections"] = {"path": root / "upload.zip", "summary": write_zip(root / "upload.zip", **shape)}
+            inputs["zip_sections"]["summary"]["zip_bytes"] = (root / "upload.zip").stat().st_size
+        payload_path = root / "blocks.json"
+        payload_path.write_text(json.dumps(structured_blocks(args.blocks, args.block_chars, args.seed)))
+        for case in ("normalize_function_call", "blocks_from_response"):
+            inputs[case] = {"path": payload_path, "summary": {"blocks": args.blocks, "payload_bytes": payload_path.stat().st_size}}
+
+        child_args = [f"--repeat={args.repeat}", f"--warmup={args.warmup}"]
+        for case in cases:
+            out = subprocess.run(
+                [sys.executable, __file__, "--child", case, "--input", str(inputs[case]["path"]), *child_args],
+                check=True, capture_output=True, text=True, env={**os.environ, "PYTHONWARNINGS": "ignore"},
+            )
+            results.append({**json.loads(out.stdout.strip().splitlines()[-1]), "input": inputs[case]["summary"]})
+
+    write_results("micro", args, {"results": results}, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# Per-request model setup with the global genai.configure() vs the per-key ModelClientPool, under
+# concurrency with many API keys. The SDK clients are real (so their setup cost is measured), but
+# generate_content is replaced by a fake transport that answers with the key the client was built for,
+# which makes a request sent with the wrong key visible (tests/test_model_pool.py asserts the pool never does).
+#
+#   cd backend && python benchmarks/bench_model_pool.py --keys 50 --requests 2000
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import google.generativeai as genai  # noqa: E402
+from google.ai import generativelanguage as glm  # noqa: E402
+from google.generativeai import client as genai_client  # noqa: E402
+from google.generativeai import protos  # noqa: E402
+
+from model_pool import ModelClientPool  # noqa: E402
+from tools import response_tools  # noqa: E402
+
+clients_created = 0
+
+
+def install_fake_transport():
+    original_make_client = genai_client._ClientManager.make_client
+
+    def make_client(manager, name):
+        global clients_created
+        clients_created += 1
+        client = original_make_client(manager, name)
+        client.bench_api_key = manager.client_config["client_options"].api_key
+        return client
+
+    async def generate_content(client, request, **kwargs):
+        await asyncio.sleep(0.001)
+        return protos.GenerateContentResponse(candidates=[{
+            "content": {"role": "model", "parts": [{"text": client.bench_api_key}]}, "finish_reason": 1,
+        }])
+
+    genai_client._ClientManager.make_client = make_client
+    glm.GenerativeServiceAsyncClient.generate_content = generate_content
+
+
+async def legacy_request(api_key: str, model_name: str) -> str:
+    # What /api/generate did before the pool: configure the process, build the model, and
+    # await something else (refinement, context caching) before the first call resolves the client
+    genai.configure(api_key=api_key)
+    model = genai.GenerativeModel(model_name=model_name, tools=[response_tools])
+    await asyncio.sleep(0)
+    return (await model.generate_content_async("ping")).text
+
+
+async def pooled_request(pool: ModelClientPool, api_key: str, model_name: str) -> str:
+    model = pool.model(api_key, model_name, tools=[response_tools])
+    await asyncio.sleep(0)
+    return (await model.generate_content_async("ping")).text
+
+
+async def run(label, request, keys, requests, concurrency):
+    global clients_created
+    clients_created = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    leaked = 0
+
+    async def one(i):
+        nonlocal leaked
+        api_key = keys[i % len(keys)]
+        async with semaphore:
+            if await request(api_key) != api_key:
+                leaked += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - start
+    return {
+        "mode": label, "requests": requests, "seconds": round(elapsed, 3),
+        "ms_per_request": round(elapsed * 1000 / requests, 3),
+        "clients_created": clients_created, "wrong_key_requests": leaked,
+    }
+
+
+async def main_async(args):
+    install_fake_transport()
+    keys = [f"bench-key-{i:04d}" for i in range(args.keys)]
+    pool = ModelClientPool()
+    legacy = await run("global_configure", lambda k: legacy_request(k, args.model), keys, args.requests, args.concurrency)
+    pooled = await run("model_pool", lambda k: pooled_request(pool, k, args.model), keys, args.requests, args.concurrency)
+    return {
+        "keys": args.keys, "concurrency": args.concurrency, "results": [legacy, pooled],
+        "speedup": round(legacy["seconds"] / pooled["seconds"], 2), "pool": pool.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--keys", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--model", default="gemini-2.5-flash")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(main_async(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+# Compares the schema-driven normalizer (block_normalizer.py) with the generic path it replaced
+# (recursive_to_dict over the proto args, then parts_from_function_call and filter_supported_parts,
+# kept below as the baseline). Both are run on the same real SDK responses:
+#   structured        a generate_structured_response call of --blocks blocks
+#   structured_mixed  the same with --unsupported-share of the parts using an undeclared type
+#   simple_tools      one response per make_* tool, called with valid arguments, plus make_code and
+#                     make_annotated_heading without their optional language and tag
+# Before timing, every payload is checked to give identical blocks on both paths, except for make_list:
+# the baseline fell through to its 'content' check and rejected every make_list call.
+#
+#   cd backend && python benchmarks/bench_normalizer.py --blocks 400 --repeat 20 --out normalizer.json
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Any, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_micro import structured_response  # noqa: E402
+from common import latency_summary, write_results  # noqa: E402
+from synthetic import structured_blocks  # noqa: E402
+
+from response_blocks import blocks_from_response, response_text  # noqa: E402
+from tools import ALL_TOOL_NAMES  # noqa: E402
+
+KNOWN_DIFFERENCES = {'make_list'}
+LEGACY_SUPPORTED_TYPES = {'title', 'heading', 'subheading', 'annotated_heading', 'quote_heading', 'text', 'code', 'math', 'list'}
+
+
+# --- Baseline: the generic conversion and validation used before block_normalizer.py ---
+
+def legacy_recursive_to_dict(obj: Any) -> Any:
+    if obj is None:
+        return None
+    if hasattr(obj, 'items'):
+        return {key: legacy_recursive_to_dict(value) for key, value in obj.items()}
+    elif isinstance(obj, (list, tuple)) or (hasattr(obj, '__iter__') and not isinstance(obj, (str, bytes))):
+        return [legacy_recursive_to_dict(item) for item in obj]
+    else:
+        return obj
+
+
+def legacy_parts_from_function_call(function_name: str, function_args: dict) -> List[dict]:
+    final_parts = []
+    if function_name == "generate_structured_response":
+        raw_parts = function_args.get('parts', [])
+        if isinstance(raw_parts, list):
+            for p in raw_parts:
+                if isinstance(p, dict) and 'type' in p:
+                    final_parts.append(p)
+                else:
+                    print(f"Warning: Skipping malformed part in structured response: {p}")
+        else:
+            print(f"Warning: 'parts' in structured response is not a list: {raw_parts}")
+    elif function_name in ALL_TOOL_NAMES:
+        block_type = function_name.replace('make_', '')
+        is_valid = True
+        if block_type == 'list' and not isinstance(function_args.get('items'), list):
+            is_valid = False
+        elif 'content' not in function_args:
+            is_valid = False
+        if is_valid:
+            final_parts.append({"type": block_type, **function_args})
+        else:
+            print(f"Warning: AI called function '{function_name}' with invalid args: {function_args}")
+    else:
+        return [{"type": "code", "language": "error", "content": f"AI called an unexpected function: {function_name}\n\nArguments: {json.dumps(function_args, indent=2)}"}]
+    return final_parts
+
+
+def legacy_filter_supported_parts(final_parts: List[dict], fallback_text: str) -> List[dict]:
+    if not final_parts:
+        if fallback_text:
+            return [{"type": "text", "content": f"[Fallback Content]\n{fallback_text}"}]
+        return [{"type": "text", "content": "AI response was empty or malformed after processing the function call."}]
+    filtered_parts = [p for p in final_parts if isinstance(p, dict) and p.get('type') in LEGACY_SUPPORTED_TYPES]
+    if not filtered_parts and final_parts:
+        if fallback_text:
+            return [{"type": "text", "content": f"[Fallback Content]\n{fallback_text}"}]
+        return [{"type": "text", "content": "AI returned content in an unsupported format that cannot be displayed."}]
+    return filtered_parts
+
+
+def legacy_blocks_from_response(model_response: Any) -> List[dict]:
+    part = model_response.candidates[0].content.parts[0]
+    function_args = legacy_recursive_to_dict(part.function_call.args)
+    final_parts = legacy_parts_from_function_call(part.function_call.name, function_args)
+    return legacy_filter_supported_parts(final_parts, response_text(model_response))
+
+
+# --- Payloads ---
+
+def tool_response(name: str, args: dict):
+    from google.generativeai import protos
+    from google.generativeai.types import GenerateContentResponse
+
+    return GenerateContentResponse.from_response(protos.GenerateContentResponse(candidates=[{
+        "content": {"role": "model", "parts": [{"function_call": {"name": name, "args": args}}]},
+        "finish_reason": 1,
+    }]))
+
+
+def simple_tool_responses() -> list:
+    # One call per make_* tool with every declared field, then the tools whose extra fields are optional
+    # with their content only
+    args = {
+        "make_code": {"language": "python", "content": "print('hello')"},
+        "make_annotated_heading": {"content": "Setup", "tag": "Step 1"},
+        "make_quote_heading": {"content": "Simple is better than complex.", "source": "PEP 20"},
+        "make_list": {"items": ["first", "second", "third"]},
+    }
+    responses = [tool_response(name, args.get(name, {"content": f"Content for {name}"})) for name in ALL_TOOL_NAMES]
+    return responses + [tool_response(name, {"content": f"Content for {name}"}) for name in ("make_code", "make_annotated_heading")]
+
+
+def mixed_blocks(blocks: int, block_chars: int, unsupported_share: float, seed: int) -> list:
+    rng = random.Random(seed)
+    parts = structured_blocks(blocks, block_chars, seed)
+    for part in parts:
+        if rng.random() < unsupported_share:
+            part["type"] = rng.choice(["table", "image", "diagram"])
+    return parts
+
+
+def time_path(function, responses: list, repeat: int, warmup: int) -> dict:
+    durations = []
+    for _ in range(warmup + repeat):
+        started_at = time.perf_counter()
+        for response in responses:
+            function(response)
+        durations.append(time.perf_counter() - started_at)
+    return latency_summary(durations[warmup:])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--blocks", type=int, default=400, help="blocks in the structured response payload")
+    parser.add_argument("--block-chars", type=int, default=400)
+    parser.add_argument("--unsupported-share", type=float, default=0.1)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="also write the JSON results to this file")
+    args = parser.parse_args()
+
+    payloads = {
+        "structured": [structured_response(structured_blocks(args.blocks, args.block_chars, args.seed))],
+        "structured_mixed": [structured_response(mixed_blocks(args.blocks, args.block_chars, args.unsupported_share, args.seed))],
+        "simple_tools": simple_tool_responses(),
+    }
+
+    results = []
+    for name, responses in payloads.items():
+        for response in responses:
+            if response.candidates[0].content.parts[0].function_call.name in KNOWN_DIFFERENCES:
+                continue
+            expected, actual = legacy_blocks_from_response(response), blocks_from_response(response)
+            if expected != actual:
+                sys.exit(f"{name}: the normalizer output differs from the baseline")
+        legacy = time_path(legacy_blocks_from_response, responses, args.repeat, args.warmup)
+        normalizer = time_path(blocks_from_response, responses, args.repeat, args.warmup)
+        results.append({
+            "payload": name, "responses": len(responses),
+            "blocks": sum(len(blocks_from_response(response)) for response in responses),
+            "legacy": legacy, "normalizer": normalizer,
+            "speedup_p50": round(legacy["p50_ms"] / normalizer["p50_ms"], 2) if normalizer["p50_ms"] else None,
+        })
+
+    write_results("normalizer", args, {"results": results}, args.out)
+
+
+if __name__ == "__main__":
+    main()
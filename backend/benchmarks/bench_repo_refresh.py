@@ -0,0 +1,112 @@
+# Cold vs incremental repository ingestion on a synthetic local repo.
+#
+#   cd backend && python benchmarks/bench_repo_refresh.py --files 3000 --changed 5
+#
+# Compares the old path (fresh `git clone --depth 1` + process_repository_to_text) with
+# RepoMirror.refresh, first on an empty mirror and then after a few files changed upstream.
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from repo_mirror import RepoMirror  # noqa: E402
+from tree_walker import process_repository_to_text  # noqa: E402
+
+GIT_ENV = {**os.environ, "GIT_AUTHOR_NAME": "bench", "GIT_AUTHOR_EMAIL": "bench@localhost",
+           "GIT_COMMITTER_NAME": "bench", "GIT_COMMITTER_EMAIL": "bench@localhost"}
+
+
+def git(cwd, *args):
+    subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True, env=GIT_ENV)
+
+
+def make_source_file(rng, i):
+    lines = [f"# module {i}"]
+    for j in range(rng.randint(20, 200)):
+        lines.append(f"def func_{i}_{j}(x):\n    return x * {rng.randint(1, 1000)}\n")
+    return "\n".join(lines)
+
+
+def generate_repo(root: Path, n_files: int, seed: int = 0) -> Path:
+    rng = random.Random(seed)
+    work = root / "work"
+    work.mkdir()
+    git(work, "init", "-q", "-b", "main")
+    for i in range(n_files):
+        path = work / f"pkg{i % 50}" / f"sub{i % 7}" / f"module_{i}.py"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(make_source_file(rng, i))
+    (work / ".gitignore").write_text("*.tmp\n")
+    git(work, "add", "-A")
+    git(work, "commit", "-q", "-m", "initial")
+    bare = root / "origin.git"
+    git(root, "clone", "-q", "--bare", str(work), str(bare))
+    git(work, "remote", "add", "origin", str(bare))
+    return work
+
+
+def push_changes(work: Path, n_changed: int, seed: int = 1):
+    rng = random.Random(seed)
+    files = sorted(work.rglob("module_*.py"))
+    for path in rng.sample(files, n_changed):
+        path.write_text(path.read_text() + f"\n# edited {rng.random()}\n")
+    git(work, "commit", "-q", "-am", "update")
+    git(work, "push", "-q", "origin", "main")
+
+
+def clone_and_process(clone_url: str) -> str:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        subprocess.run(["git", "clone", "--depth", "1", clone_url, temp_dir], check=True, capture_output=True)
+        return process_repository_to_text(temp_dir)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=3000)
+    parser.add_argument("--changed", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        root = Path(root)
+        work = generate_repo(root, args.files)
+        clone_url = (root / "origin.git").as_uri()
+        mirror = RepoMirror(str(root / "mirrors"))
+
+        cold_clone_s, clone_text = timed(clone_and_process, clone_url)
+        cold_mirror_s, (_, mirror_text) = timed(lambda: asyncio.run(mirror.refresh(clone_url)))
+        assert clone_text == mirror_text, "mirror dump differs from clone dump"
+
+        push_changes(work, args.changed)
+        reclone_s, clone_text = timed(clone_and_process, clone_url)
+        mirror.blobs_read = 0
+        incremental_s, (_, mirror_text) = timed(lambda: asyncio.run(mirror.refresh(clone_url)))
+        assert clone_text == mirror_text, "mirror dump differs from clone dump after update"
+
+        print(json.dumps({
+            "files": args.files,
+            "changed_files": args.changed,
+            "dump_bytes": len(mirror_text.encode("utf-8")),
+            "clone_and_process_cold_s": round(cold_clone_s, 4),
+            "mirror_cold_s": round(cold_mirror_s, 4),
+            "clone_and_process_after_update_s": round(reclone_s, 4),
+            "mirror_incremental_s": round(incremental_s, 4),
+            "blobs_read_incremental": mirror.blobs_read,
+        }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
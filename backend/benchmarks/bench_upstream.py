@@ -0,0 +1,126 @@
+# Direct model calls vs the UpstreamScheduler against a local fake Gemini backend that enforces a
+# per-key rate limit (429 ResourceExhausted), fails a share of calls with 503, and has a slow tail.
+# By default requests arrive faster than the limit allows; reports success rate and p50/p99 latency per mode.
+#
+#   cd backend && python benchmarks/bench_upstream.py --requests 300 --arrival-rps 40 --limit-rps 15
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from google.api_core import exceptions as google_exceptions  # noqa: E402
+
+from upstream import UpstreamScheduler  # noqa: E402
+
+
+class FakeGemini:
+    # Server side: token bucket per key, random 503s, lognormal latency with a slow tail
+    def __init__(self, limit_rps: float, burst: int, error_rate: float, slow_rate: float, seed: int):
+        self.limit_rps = limit_rps
+        self.burst = burst
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.rng = random.Random(seed)
+        self.buckets = {}
+
+    def _admit(self, api_key: str) -> bool:
+        now = time.monotonic()
+        tokens, updated = self.buckets.get(api_key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.limit_rps)
+        if tokens < 1:
+            self.buckets[api_key] = (tokens, now)
+            return False
+        self.buckets[api_key] = (tokens - 1, now)
+        return True
+
+    async def generate(self, api_key: str, model_name: str) -> str:
+        if not self._admit(api_key):
+            await asyncio.sleep(0.01)
+            raise google_exceptions.ResourceExhausted("Resource has been exhausted (e.g. check quota).")
+        latency = self.rng.lognormvariate(-1.6, 0.3)  # median ~0.2s
+        if self.rng.random() < self.slow_rate:
+            latency += 2.0
+        await asyncio.sleep(latency)
+        if self.rng.random() < self.error_rate:
+            raise google_exceptions.ServiceUnavailable("The model is overloaded. Please try again later.")
+        return model_name
+
+
+async def run_mode(mode: str, args) -> dict:
+    backend = FakeGemini(args.limit_rps, args.limit_burst, args.error_rate, args.slow_rate, args.seed)
+    scheduler = UpstreamScheduler(
+        rate=args.limit_rps * 0.9, burst=args.limit_burst, max_wait=args.max_wait, max_queue=10_000,
+        backoff_base=0.25, backoff_max=4, fallback_models=[],
+        hedge_after=args.hedge_after if mode == "scheduler_hedged" else 0,
+    )
+    rng = random.Random(args.seed)
+    keys = [f"key-{i}" for i in range(args.keys)]
+    latencies, failures = [], {}
+
+    async def one(i: int) -> None:
+        api_key = keys[i % len(keys)]
+        started_at = time.perf_counter()
+        try:
+            if mode == "direct":
+                await backend.generate(api_key, "gemini-2.5-flash")
+            else:
+                await scheduler.call(api_key, "gemini-2.5-flash", lambda name: backend.generate(api_key, name))
+            latencies.append(time.perf_counter() - started_at)
+        except Exception as e:
+            failures[type(e).__name__] = failures.get(type(e).__name__, 0) + 1
+
+    tasks = []
+    for i in range(args.requests):
+        tasks.append(asyncio.ensure_future(one(i)))
+        await asyncio.sleep(rng.expovariate(args.arrival_rps))
+    await asyncio.gather(*tasks)
+
+    latencies.sort()
+    result = {
+        "mode": mode, "requests": args.requests, "succeeded": len(latencies),
+        "success_rate": round(len(latencies) / args.requests, 3), "failures": failures,
+        "p50_ms": round(statistics.median(latencies) * 1000, 1) if latencies else None,
+        "p99_ms": round(latencies[max(0, int(len(latencies) * 0.99) - 1)] * 1000, 1) if latencies else None,
+    }
+    if mode != "direct":
+        result["scheduler"] = scheduler.stats()
+    return result
+
+
+async def main_async(args) -> dict:
+    results = []
+    for mode in ("direct", "scheduler", "scheduler_hedged"):
+        with contextlib.redirect_stdout(io.StringIO()):  # the scheduler logs every retry
+            results.append(await run_mode(mode, args))
+    return {
+        "arrival_rps": args.arrival_rps, "limit_rps_per_key": args.limit_rps, "keys": args.keys,
+        "error_rate": args.error_rate, "slow_rate": args.slow_rate, "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--arrival-rps", type=float, default=40)
+    parser.add_argument("--keys", type=int, default=2)
+    parser.add_argument("--limit-rps", type=float, default=15)
+    parser.add_argument("--limit-burst", type=int, default=10)
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--slow-rate", type=float, default=0.05)
+    parser.add_argument("--hedge-after", type=float, default=0.6)
+    parser.add_argument("--max-wait", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(main_async(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# process_repository_to_text vs the previous rglob-based implementation, on a generated tree
+# with a large node_modules/ (plus .git/ and build/ noise) next to the actual sources.
+#
+#   cd backend && python benchmarks/bench_walker.py --src-files 2000 --node-modules-files 30000
+import argparse
+import json
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pathspec
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from ingest import DEFAULT_IGNORE, MAX_FILE_SIZE  # noqa: E402
+from tree_walker import process_repository_to_text  # noqa: E402
+
+
+def legacy_process_repository_to_text(repo_path_str: str) -> str:
+    # The implementation before the pruning walker, kept here as the baseline
+    repo_path = Path(repo_path_str)
+    output_parts = []
+    patterns = list(DEFAULT_IGNORE)
+    gitignore_path = repo_path / '.gitignore'
+    if gitignore_path.is_file():
+        with open(gitignore_path, 'r', encoding='utf-8') as f:
+            patterns.extend(f.read().splitlines())
+    spec = pathspec.PathSpec.from_lines('gitwildmatch', patterns)
+    for file_path in sorted(repo_path.rglob('*'), key=lambda p: p.relative_to(repo_path).as_posix().encode('utf-8')):
+        if not file_path.is_file(): continue
+        relative_path = file_path.relative_to(repo_path)
+        if spec.match_file(str(relative_path).replace('\\', '/')): continue
+        if file_path.stat().st_size > MAX_FILE_SIZE: continue
+        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+            content = f.read()
+        output_parts.append(f"---\nFile: {relative_path.as_posix()}\nContent:\n```\n{content}\n```")
+    return "\n".join(output_parts)
+
+
+def write_files(root: Path, prefix: str, count: int, rng: random.Random, fanout: int = 40):
+    for i in range(count):
+        path = root / prefix / f"pkg{i % fanout}" / f"lib{i % 5}" / f"file_{i}.js"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("\n".join(f"export const v{j} = {rng.randint(0, 10**6)};" for j in range(rng.randint(5, 80))))
+
+
+def generate_tree(root: Path, src_files: int, node_modules_files: int, seed: int = 0):
+    rng = random.Random(seed)
+    write_files(root, "src", src_files, rng)
+    write_files(root, "node_modules", node_modules_files, rng, fanout=400)
+    write_files(root, ".git/objects", node_modules_files // 4, rng)
+    write_files(root, "build", node_modules_files // 4, rng)
+    (root / ".gitignore").write_text("*.tmp\ncoverage/\n")
+    (root / "README.md").write_text("# bench\r\nline two\r\n")
+
+
+def best_of(fn, arg, repeat):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(arg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--src-files", type=int, default=2000)
+    parser.add_argument("--node-modules-files", type=int, default=30000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        generate_tree(Path(root), args.src_files, args.node_modules_files)
+        legacy_s, legacy_text = best_of(legacy_process_repository_to_text, root, args.repeat)
+        walker_s, walker_text = best_of(process_repository_to_text, root, args.repeat)
+        assert legacy_text == walker_text, "walker output differs from the legacy implementation"
+
+        print(json.dumps({
+            "src_files": args.src_files,
+            "node_modules_files": args.node_modules_files,
+            "dump_bytes": len(walker_text.encode("utf-8")),
+            "legacy_rglob_s": round(legacy_s, 4),
+            "pruning_walker_s": round(walker_s, 4),
+            "speedup": round(legacy_s / walker_s, 2),
+        }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
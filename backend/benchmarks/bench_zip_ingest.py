@@ -0,0 +1,117 @@
+# Streaming ZIP ingestion vs the previous read-write-extract-walk path.
+#
+#   cd backend && python benchmarks/bench_zip_ingest.py --mb 80
+#
+# Each path runs in its own subprocess so peak RSS is measured separately. The upload is
+# staged in a SpooledTemporaryFile with a 1 MB threshold, like Starlette's UploadFile.
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tree_walker import process_repository_to_text, process_zip_to_text  # noqa: E402
+
+WORDS = ["const", "return", "function", "value", "import", "export", "class", "self", "data", "items"]
+
+
+def generate_zip(path: Path, target_mb: int, seed: int = 0):
+    rng = random.Random(seed)
+    written = 0
+    i = 0
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        while written < target_mb * 1024 * 1024:
+            # Random identifiers keep the archive from compressing too well, like real code
+            text = "\n".join(
+                f"{rng.choice(WORDS)} v{rng.getrandbits(48):x} = {rng.getrandbits(64):x};" for _ in range(rng.randint(200, 2000))
+            )
+            zf.writestr(f"project/src/pkg{i % 30}/file_{i}.js", text)
+            if i % 10 == 0:
+                zf.writestr(f"project/node_modules/dep{i}/index.js", text)
+            written += len(text)
+            i += 1
+        zf.writestr("project/.gitignore", "*.tmp\n")
+
+
+def spooled_upload(zip_path: str):
+    upload = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    with open(zip_path, 'rb') as f:
+        shutil.copyfileobj(f, upload)
+    upload.seek(0)
+    return upload
+
+
+def legacy_ingest(upload) -> str:
+    contents = upload.read()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        zip_path = os.path.join(temp_dir, "upload.zip")
+        with open(zip_path, 'wb') as f:
+            f.write(contents)
+        unzip_dir = os.path.join(temp_dir, 'unzipped')
+        os.makedirs(unzip_dir, exist_ok=True)
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            zip_ref.extractall(unzip_dir)
+        all_paths = [os.path.join(unzip_dir, f) for f in zip_ref.namelist() if not f.startswith('__MACOSX')]
+        common_prefix = os.path.commonpath(all_paths)
+        repo_content_path = common_prefix if os.path.isdir(common_prefix) else unzip_dir
+        return process_repository_to_text(repo_content_path)
+
+
+def run_child(mode: str, zip_path: str):
+    upload = spooled_upload(zip_path)
+    start = time.perf_counter()
+    text = legacy_ingest(upload) if mode == "legacy" else process_zip_to_text(upload)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({
+        "seconds": elapsed,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "output_bytes": len(text.encode("utf-8")),
+        "output_hash": hash(text),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mb", type=int, default=80, help="uncompressed size of the generated archive")
+    parser.add_argument("--child", choices=["legacy", "stream"])
+    parser.add_argument("--zip")
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.zip)
+        return
+
+    with tempfile.TemporaryDirectory() as root:
+        zip_path = Path(root) / "upload.zip"
+        generate_zip(zip_path, args.mb)
+        results = {}
+        for mode in ("legacy", "stream"):
+            out = subprocess.run(
+                [sys.executable, __file__, "--child", mode, "--zip", str(zip_path)],
+                check=True, capture_output=True, text=True, env={**os.environ, "PYTHONHASHSEED": "0"}
+            )
+            results[mode] = json.loads(out.stdout.strip().splitlines()[-1])
+        assert results["legacy"]["output_hash"] == results["stream"]["output_hash"], "outputs differ"
+
+        uncompressed_mb = args.mb
+        print(json.dumps({
+            "zip_mb": round(zip_path.stat().st_size / (1024 * 1024), 1),
+            "uncompressed_mb": uncompressed_mb,
+            **{f"{mode}_{key}": round(value, 3) for mode, r in results.items() for key, value in r.items()
+               if key in ("seconds", "peak_rss_mb")},
+            "legacy_mb_per_s": round(uncompressed_mb / results["legacy"]["seconds"], 1),
+            "stream_mb_per_s": round(uncompressed_mb / results["stream"]["seconds"], 1),
+        }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
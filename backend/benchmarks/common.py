@@ -0,0 +1,82 @@
+# Result helpers shared by the benchmark scripts: latency summaries, RSS readings and the JSON
+# envelope (with enough metadata to tell two result files apart when comparing runs).
+import json
+import math
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def latency_summary(seconds: List[float]) -> dict:
+    values = sorted(seconds)
+    ms = lambda value: round(value * 1000, 2) if value is not None else None  # noqa: E731
+    return {
+        "count": len(values),
+        "min_ms": ms(values[0] if values else None),
+        "mean_ms": ms(statistics.fmean(values) if values else None),
+        "p50_ms": ms(percentile(values, 50)),
+        "p95_ms": ms(percentile(values, 95)),
+        "p99_ms": ms(percentile(values, 99)),
+        "max_ms": ms(values[-1] if values else None),
+    }
+
+
+def peak_rss_mb() -> float:
+    # Peak RSS of this process (Linux reports ru_maxrss in KB)
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def process_tree_rss_bytes(pid: int) -> int:
+    # Current RSS of a process and all of its descendants, e.g. a gunicorn master and its workers
+    total, pending = 0, [pid]
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f'/proc/{current}/statm') as f:
+                total += int(f.read().split()[1]) * page_size
+            with open(f'/proc/{current}/task/{current}/children') as f:
+                pending.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+    return total
+
+
+def git_revision() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(benchmark: str, args, results: dict, out: Optional[str]) -> None:
+    document = {
+        "benchmark": benchmark,
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "git_revision": git_revision(),
+            "python": sys.version.split()[0], "platform": platform.platform(), "cpus": os.cpu_count(),
+            "args": vars(args),
+        },
+        **results,
+    }
+    text = json.dumps(document, indent=2)
+    if out:
+        Path(out).write_text(text + "\n")
+    print(text)
@@ -0,0 +1,246 @@
+# Local stand-in for the Gemini API, for load tests. It speaks the same gRPC services the SDK uses
+# (GenerativeService and CacheService) over TLS with a self-signed certificate, so the backend runs
+# unmodified with
+#
+#   GEMINI_API_ENDPOINT=localhost:<port> GRPC_DEFAULT_SSL_ROOTS_FILE_PATH=<cert-dir>/cert.pem
+#
+# Requests with tools (or a cached context) are answered with --blocks blocks: one generate_structured_response
+# call, or one make_* call per block (one per streamed chunk) when the tool config's allowed_function_names
+# leaves out generate_structured_response, as streams do. Others (refiner, shard notes) get plain text. Latency, errors and a per-key rate limit
+# are injected as configured. Prints "READY <port>" once listening, and its counters as JSON on exit.
+#
+#   cd backend && python benchmarks/fake_gemini.py --port 50551 --latency-ms 800 --error-rate 0.02
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import signal
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import grpc
+from google.generativeai import protos
+from google.protobuf import empty_pb2
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from synthetic import structured_blocks  # noqa: E402
+
+ERROR_CODES = {
+    "429": grpc.StatusCode.RESOURCE_EXHAUSTED,
+    "500": grpc.StatusCode.INTERNAL,
+    "503": grpc.StatusCode.UNAVAILABLE,
+    "504": grpc.StatusCode.DEADLINE_EXCEEDED,
+}
+
+
+def write_certificate(cert_dir: Path) -> tuple:
+    # Self-signed certificate for localhost/127.0.0.1; clients trust it through GRPC_DEFAULT_SSL_ROOTS_FILE_PATH
+    import ipaddress
+
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    cert_dir.mkdir(parents=True, exist_ok=True)
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=5)).not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName("localhost"), x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    cert_pem = cert.public_bytes(serialization.Encoding.PEM)
+    key_pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    (cert_dir / "cert.pem").write_bytes(cert_pem)
+    (cert_dir / "key.pem").write_bytes(key_pem)
+    return cert_pem, key_pem
+
+
+class FakeGemini:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.cached_contents = {}
+        self.buckets = {}
+        self.counts = {}
+
+    def _count(self, method: str, outcome: str) -> None:
+        key = f"{method}:{outcome}"
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+    def _admit(self, context) -> bool:
+        # Per-key token bucket, like the real API's requests-per-minute quota
+        if not self.args.rate_per_key:
+            return True
+        api_key = dict(context.invocation_metadata()).get("x-goog-api-key", "")
+        now = time.monotonic()
+        tokens, updated = self.buckets.get(api_key, (self.args.burst, now))
+        tokens = min(self.args.burst, tokens + (now - updated) * self.args.rate_per_key)
+        admitted = tokens >= 1
+        self.buckets[api_key] = (tokens - 1 if admitted else tokens, now)
+        return admitted
+
+    def _latency(self) -> float:
+        latency = self.rng.lognormvariate(0, self.args.latency_sigma) * self.args.latency_ms / 1000
+        if self.rng.random() < self.args.slow_rate:
+            latency += self.args.slow_ms / 1000
+        return latency
+
+    async def _before_answer(self, method: str, request, context) -> None:
+        # Rate limit, latency and injected errors; aborts the call the way the real service would
+        if not self._admit(context):
+            self._count(method, "429_rate_limited")
+            await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, "Resource has been exhausted (e.g. check quota).")
+        await asyncio.sleep(self._latency())
+        if request.cached_content and request.cached_content not in self.cached_contents:
+            self._count(method, "404_cache")
+            await context.abort(grpc.StatusCode.NOT_FOUND, f"CachedContent not found: {request.cached_content}")
+        if self.rng.random() < self.args.error_rate:
+            code = self.rng.choice(self.args.error_codes.split(","))
+            self._count(method, f"{code}_injected")
+            await context.abort(ERROR_CODES[code], f"Injected error {code}.")
+
+    def _structured(self, request) -> bool:
+        return bool(request.tools) or bool(request.cached_content)
+
+    def _blocks(self) -> list:
+        return structured_blocks(self.args.blocks, self.args.block_chars, self.rng.randrange(1 << 30))
+
+    def _allowed_functions(self, request) -> list:
+        # A cached context carries the tool config it was created with
+        tool_config = request.tool_config
+        if not tool_config.function_calling_config.allowed_function_names and request.cached_content in self.cached_contents:
+            tool_config = self.cached_contents[request.cached_content].tool_config
+        return list(tool_config.function_calling_config.allowed_function_names)
+
+    def _calls(self, request, blocks: list) -> list:
+        # Function call parts answering with blocks, within what the request allows
+        allowed = self._allowed_functions(request)
+        if not allowed or "generate_structured_response" in allowed:
+            return [{"function_call": {"name": "generate_structured_response", "args": {"parts": blocks}}}]
+        calls = []
+        for block in blocks:
+            name = f"make_{block['type']}"
+            if name in allowed:
+                calls.append({"function_call": {"name": name, "args": {k: v for k, v in block.items() if k != "type"}}})
+        return calls
+
+    def _response(self, parts: list) -> protos.GenerateContentResponse:
+        return protos.GenerateContentResponse(candidates=[{"content": {"role": "model", "parts": parts}, "finish_reason": 1}])
+
+    async def generate_content(self, request, context):
+        await self._before_answer("GenerateContent", request, context)
+        self._count("GenerateContent", "ok")
+        if self._structured(request):
+            return self._response(self._calls(request, self._blocks()))
+        return self._response([{"text": "Refined request: explain the attached code and point out problems."}])
+
+    async def stream_generate_content(self, request, context):
+        await self._before_answer("StreamGenerateContent", request, context)
+        if not self._structured(request):
+            self._count("StreamGenerateContent", "ok")
+            yield self._response([{"text": "Plain text answer."}])
+            return
+        calls = self._calls(request, self._blocks())
+        if calls and calls[0]["function_call"]["name"] == "generate_structured_response":
+            # A generate_structured_response call, split over --stream-chunks chunks
+            blocks = calls[0]["function_call"]["args"]["parts"]
+            chunk_size = max(1, -(-len(blocks) // self.args.stream_chunks))
+            chunks = [[{"function_call": {"name": "generate_structured_response", "args": {"parts": blocks[start:start + chunk_size]}}}]
+                      for start in range(0, len(blocks), chunk_size)]
+        else:
+            chunks = [[call] for call in calls]
+        for index, parts in enumerate(chunks):
+            if index:
+                await asyncio.sleep(self.args.chunk_ms / 1000)
+            yield self._response(parts)
+        self._count("StreamGenerateContent", "ok")
+
+    async def create_cached_content(self, request, context):
+        self._count("CreateCachedContent", "ok")
+        cached = protos.CachedContent(request.cached_content)
+        cached.name = f"cachedContents/{uuid.uuid4().hex}"
+        cached.expire_time = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+        cached.contents = []  # the real service does not echo the contents either
+        self.cached_contents[cached.name] = cached
+        return cached
+
+    async def get_cached_content(self, request, context):
+        if request.name not in self.cached_contents:
+            await context.abort(grpc.StatusCode.NOT_FOUND, f"CachedContent not found: {request.name}")
+        return self.cached_contents[request.name]
+
+    async def delete_cached_content(self, request, context):
+        self._count("DeleteCachedContent", "ok")
+        self.cached_contents.pop(request.name, None)
+        return empty_pb2.Empty()
+
+    def handlers(self) -> list:
+        def unary(method, request_type, response_serializer):
+            return grpc.unary_unary_rpc_method_handler(method, request_deserializer=request_type.deserialize, response_serializer=response_serializer)
+
+        generative = grpc.method_handlers_generic_handler("google.ai.generativelanguage.v1beta.GenerativeService", {
+            "GenerateContent": unary(self.generate_content, protos.GenerateContentRequest, protos.GenerateContentResponse.serialize),
+            "StreamGenerateContent": grpc.unary_stream_rpc_method_handler(
+                self.stream_generate_content, request_deserializer=protos.GenerateContentRequest.deserialize,
+                response_serializer=protos.GenerateContentResponse.serialize,
+            ),
+        })
+        cache = grpc.method_handlers_generic_handler("google.ai.generativelanguage.v1beta.CacheService", {
+            "CreateCachedContent": unary(self.create_cached_content, protos.CreateCachedContentRequest, protos.CachedContent.serialize),
+            "GetCachedContent": unary(self.get_cached_content, protos.GetCachedContentRequest, protos.CachedContent.serialize),
+            "DeleteCachedContent": unary(self.delete_cached_content, protos.DeleteCachedContentRequest, empty_pb2.Empty.SerializeToString),
+        })
+        return [generative, cache]
+
+
+async def serve(args) -> None:
+    fake = FakeGemini(args)
+    cert_pem, key_pem = write_certificate(Path(args.cert_dir))
+    server = grpc.aio.server()
+    server.add_generic_rpc_handlers(fake.handlers())
+    port = server.add_secure_port(f"127.0.0.1:{args.port}", grpc.ssl_server_credentials([(key_pem, cert_pem)]))
+    await server.start()
+    print(f"READY {port}", flush=True)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    await stop.wait()
+    await server.stop(grace=1)
+    print(json.dumps({"requests": fake.counts, "cached_contents": len(fake.cached_contents)}), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=0, help="0 picks a free port (printed in the READY line)")
+    parser.add_argument("--cert-dir", default="fake_gemini_cert")
+    parser.add_argument("--latency-ms", type=float, default=800, help="median time to the first response chunk")
+    parser.add_argument("--latency-sigma", type=float, default=0.3, help="spread of the lognormal latency")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="share of calls that get --slow-ms extra")
+    parser.add_argument("--slow-ms", type=float, default=3000)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls that fail with one of --error-codes")
+    parser.add_argument("--error-codes", default="503,500", help=f"comma-separated, from {','.join(ERROR_CODES)}")
+    parser.add_argument("--rate-per-key", type=float, default=0, help="requests per second per API key (0 = unlimited)")
+    parser.add_argument("--burst", type=int, default=10)
+    parser.add_argument("--blocks", type=int, default=40, help="blocks per structured answer")
+    parser.add_argument("--block-chars", type=int, default=400)
+    parser.add_argument("--stream-chunks", type=int, default=8, help="chunks of a streamed generate_structured_response call")
+    parser.add_argument("--chunk-ms", type=float, default=50, help="delay between streamed chunks")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(serve(args))
+
+
+if __name__ == "__main__":
+    main()
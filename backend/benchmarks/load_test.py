@@ -0,0 +1,312 @@
+# End-to-end load test: runs the backend under gunicorn with gunicorn_conf.py, pointed at the local fake
+# Gemini server (fake_gemini.py), and drives /api/clone_repo and /api/generate with concurrent clients.
+# Clones go to synthetic bare repositories: git's url.<base>.insteadOf maps https://github.com/bench/
+# to them, so the clone path (ls-remote, fetch, render) runs for real without network access.
+#
+# Scenarios (run in this order, each against the same server):
+#   clone_cold       every request clones a different repository
+#   clone_warm       repeated clones of the same repositories (repo cache hits)
+#   generate         /api/generate with a ZIP upload and noCache=true (the full pipeline every time)
+#   generate_cached  identical requests without noCache (response cache hits and coalescing)
+#   generate_stream  SSE responses, noCache=true; also reports time to the first block
+#
+# Needs httpx and cryptography (for the fake server's certificate) on top of requirements.txt.
+#
+#   cd backend && python benchmarks/load_test.py --workers 3 --requests 200 --concurrency 16 \
+#       --latency-ms 800 --error-rate 0.02 --out load.json
+import argparse
+import asyncio
+import json
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from common import BACKEND_DIR, latency_summary, process_tree_rss_bytes, write_results  # noqa: E402
+from synthetic import write_git_repo, zip_bytes  # noqa: E402
+
+SCENARIOS = ["clone_cold", "clone_warm", "generate", "generate_cached", "generate_stream"]
+PROMPT = "Explain what `main()` in the attached project does and list possible bugs with file names."
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class RssSampler:
+    # Samples the RSS of a process tree in a background thread; peak() is the highest total since reset()
+
+    def __init__(self, pid: int, interval: float = 0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak_bytes = 0
+        self.overall_peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            rss = process_tree_rss_bytes(self.pid)
+            self.peak_bytes = max(self.peak_bytes, rss)
+            self.overall_peak_bytes = max(self.overall_peak_bytes, rss)
+            self._stop.wait(self.interval)
+
+    def reset(self) -> None:
+        self.peak_bytes = process_tree_rss_bytes(self.pid)
+
+    def peak_mb(self, overall: bool = False) -> float:
+        return round((self.overall_peak_bytes if overall else self.peak_bytes) / (1024 * 1024), 1)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def start_fake_gemini(args, cert_dir: Path) -> tuple:
+    command = [
+        sys.executable, str(Path(__file__).resolve().parent / "fake_gemini.py"), "--cert-dir", str(cert_dir),
+        "--latency-ms", str(args.latency_ms), "--latency-sigma", str(args.latency_sigma),
+        "--slow-rate", str(args.slow_rate), "--slow-ms", str(args.slow_ms),
+        "--error-rate", str(args.error_rate), "--error-codes", args.error_codes,
+        "--rate-per-key", str(args.fake_rate_per_key), "--blocks", str(args.blocks), "--seed", str(args.seed),
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    line = process.stdout.readline()
+    if not line.startswith("READY"):
+        process.kill()
+        raise RuntimeError(f"fake_gemini.py did not start: {line!r}")
+    return process, int(line.split()[1])
+
+
+def start_gunicorn(args, root: Path, gemini_port: int, port: int) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "PYTHONWARNINGS": "ignore",
+        "GEMINI_API_ENDPOINT": f"localhost:{gemini_port}",
+        "GRPC_DEFAULT_SSL_ROOTS_FILE_PATH": str(root / "cert" / "cert.pem"),
+        # Clones of https://github.com/bench/<name> are served from the synthetic bare repositories
+        "GIT_CONFIG_COUNT": "1",
+        "GIT_CONFIG_KEY_0": f"url.file://{root / 'repos'}/.insteadOf",
+        "GIT_CONFIG_VALUE_0": "https://github.com/",
+        "GIT_TERMINAL_PROMPT": "0",
+        # Fresh state per run, so runs are comparable
+        "CACHE_STORE_PATH": str(root / "state" / "cache.sqlite3"),
+        "CLONE_JOB_DIR": str(root / "state" / "jobs"),
+        "REPO_MIRROR_DIR": str(root / "state" / "mirrors"),
+        "METRICS_DIR": str(root / "state" / "metrics"),
+        # The gateway's own admission control would otherwise be what gets measured
+        "UPSTREAM_RATE_PER_KEY": str(args.upstream_rate),
+        "UPSTREAM_BURST": str(args.upstream_burst),
+    }
+    for assignment in args.app_env:
+        name, _, value = assignment.partition("=")
+        env[name] = value
+    command = [
+        sys.executable, "-m", "gunicorn", "-c", "gunicorn_conf.py",
+        "--bind", f"127.0.0.1:{port}", "--workers", str(args.workers), "main:app",
+    ]
+    return subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL,
+                            stderr=open(root / "gunicorn.log", "w"))
+
+
+async def wait_until_ready(client: httpx.AsyncClient, process: subprocess.Popen, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("gunicorn exited during startup (see gunicorn.log)")
+        try:
+            if (await client.get("/api/generate/upstream")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("gunicorn did not become ready")
+
+
+def generate_form(args, index: int, stream: bool, no_cache: bool) -> dict:
+    return {
+        "apiKey": f"bench-key-{index % args.keys}", "prompt": PROMPT, "model": args.model,
+        "refinerModel": args.refiner_model, "stream": str(stream).lower(), "noCache": str(no_cache).lower(),
+    }
+
+
+async def one_request(client: httpx.AsyncClient, scenario: str, index: int, args, upload: bytes) -> dict:
+    started_at = time.perf_counter()
+    result = {"status": None, "ok": False, "ttfb": None, "cache": None}
+    if scenario.startswith("clone"):
+        repo = index % args.repos
+        response = await client.post("/api/clone_repo", json={"url": f"https://github.com/bench/repo{repo}"})
+        result["status"] = response.status_code
+        result["ok"] = response.status_code == 200 and bool(response.json().get("processed_text"))
+    else:
+        stream = scenario == "generate_stream"
+        form = generate_form(args, index, stream, no_cache=scenario != "generate_cached")
+        files = {"files": ("project.zip", upload, "application/zip")}
+        if stream:
+            async with client.stream("POST", "/api/generate", data=form, files=files) as response:
+                result["status"] = response.status_code
+                error = False
+                async for line in response.aiter_lines():
+                    if line.startswith("data: ") and result["ttfb"] is None:
+                        result["ttfb"] = time.perf_counter() - started_at
+                    error = error or '"language": "error"' in line
+                result["ok"] = response.status_code == 200 and not error
+        else:
+            response = await client.post("/api/generate", data=form, files=files)
+            result["status"] = response.status_code
+            blocks = response.json() if response.status_code == 200 else []
+            result["ok"] = response.status_code == 200 and not any(block.get("language") == "error" for block in blocks)
+        result["cache"] = response.headers.get("x-response-cache")
+    result["seconds"] = time.perf_counter() - started_at
+    if result["status"] == 200 and not result["ok"]:
+        result["status"] = "error_block"
+    return result
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: str, args, upload: bytes, sampler: RssSampler) -> dict:
+    requests = args.repos if scenario == "clone_cold" else args.requests
+    concurrency = min(args.concurrency, requests)
+    results = []
+    next_index = iter(range(requests))
+
+    async def worker():
+        for index in next_index:
+            try:
+                results.append(await one_request(client, scenario, index, args, upload))
+            except httpx.HTTPError as e:
+                results.append({"status": type(e).__name__, "ok": False, "seconds": None, "ttfb": None, "cache": None})
+
+    sampler.reset()
+    started_at = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started_at
+
+    errors, cache = {}, {}
+    for result in results:
+        if not result["ok"]:
+            errors[str(result["status"])] = errors.get(str(result["status"]), 0) + 1
+        if result["cache"]:
+            cache[result["cache"]] = cache.get(result["cache"], 0) + 1
+    summary = {
+        "scenario": scenario, "requests": requests, "concurrency": concurrency,
+        "ok": sum(result["ok"] for result in results), "errors": errors,
+        "seconds": round(elapsed, 3), "throughput_rps": round(sum(result["ok"] for result in results) / elapsed, 2),
+        "latency": latency_summary([result["seconds"] for result in results if result["seconds"] is not None]),
+        "peak_rss_mb": sampler.peak_mb(),
+    }
+    if cache:
+        summary["response_cache"] = cache
+    if scenario == "generate_stream":
+        summary["time_to_first_block"] = latency_summary([result["ttfb"] for result in results if result["ttfb"] is not None])
+    return summary
+
+
+def stage_means(metrics_text: str) -> dict:
+    # Mean duration per (route, stage) from the backend's /metrics, summed over all workers
+    sums, counts = {}, {}
+    pattern = re.compile(r'^gateway_stage_duration_seconds_(sum|count)\{route="([^"]*)",stage="([^"]*)"\} (\S+)$')
+    for line in metrics_text.splitlines():
+        match = pattern.match(line)
+        if match:
+            kind, route, stage, value = match.groups()
+            (sums if kind == "sum" else counts)[f"{route}.{stage}"] = float(value)
+    return {
+        name: {"count": int(counts[name]), "mean_ms": round(sums[name] / counts[name] * 1000, 2)}
+        for name in sorted(counts) if counts[name]
+    }
+
+
+async def run(args, root: Path) -> dict:
+    print("Generating repositories and upload...", file=sys.stderr)
+    shape = {"depth": args.depth, "fanout": args.fanout, "ignored_share": args.ignored_share}
+    for i in range(args.repos):
+        write_git_repo(root / "repos" / "bench" / f"repo{i}.git", files=args.repo_files, file_kb=args.repo_file_kb, seed=args.seed + i, **shape)
+    upload = zip_bytes(files=args.zip_files, file_kb=args.zip_file_kb, seed=args.seed, **shape)
+
+    fake, gemini_port = start_fake_gemini(args, root / "cert")
+    port = free_port()
+    server = start_gunicorn(args, root, gemini_port, port)
+    sampler = RssSampler(server.pid)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=args.timeout,
+                                     limits=httpx.Limits(max_connections=args.concurrency * 2)) as client:
+            await wait_until_ready(client, server)
+            scenarios = []
+            for scenario in [s for s in args.scenarios.split(",") if s]:
+                print(f"Running {scenario}...", file=sys.stderr)
+                scenarios.append(await run_scenario(client, scenario, args, upload, sampler))
+            await asyncio.sleep(0.5)
+            metrics_text = (await client.get("/metrics")).text
+        peak_rss = sampler.peak_mb(overall=True)
+    finally:
+        sampler.stop()
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+        fake.send_signal(signal.SIGTERM)
+        fake_stats = fake.communicate(timeout=30)[0].strip().splitlines()
+
+    return {
+        "inputs": {"upload_zip_bytes": len(upload), "repos": args.repos, "repo_files": args.repo_files},
+        "scenarios": scenarios,
+        "stages": stage_means(metrics_text),
+        "fake_gemini": json.loads(fake_stats[-1]) if fake_stats else None,
+        "peak_rss_mb": peak_rss,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--workers", type=int, default=3, help="gunicorn workers (overrides gunicorn_conf.py)")
+    parser.add_argument("--requests", type=int, default=100, help="requests per scenario (clone_cold: one per repo)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--keys", type=int, default=4, help="distinct API keys the clients rotate through")
+    parser.add_argument("--model", default="gemini-2.5-pro")
+    parser.add_argument("--refiner-model", default="gemini-2.5-flash")
+    parser.add_argument("--timeout", type=float, default=300)
+    # Synthetic inputs
+    parser.add_argument("--repos", type=int, default=8)
+    parser.add_argument("--repo-files", type=int, default=1000)
+    parser.add_argument("--repo-file-kb", type=float, default=4)
+    parser.add_argument("--zip-files", type=int, default=200)
+    parser.add_argument("--zip-file-kb", type=float, default=2)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fanout", type=int, default=8)
+    parser.add_argument("--ignored-share", type=float, default=0.3)
+    # Fake model server
+    parser.add_argument("--latency-ms", type=float, default=800)
+    parser.add_argument("--latency-sigma", type=float, default=0.3)
+    parser.add_argument("--slow-rate", type=float, default=0.0)
+    parser.add_argument("--slow-ms", type=float, default=3000)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-codes", default="503,500")
+    parser.add_argument("--fake-rate-per-key", type=float, default=0, help="upstream quota per key (0 = unlimited)")
+    parser.add_argument("--blocks", type=int, default=40)
+    # Backend settings
+    parser.add_argument("--upstream-rate", type=float, default=1000, help="UPSTREAM_RATE_PER_KEY for the backend")
+    parser.add_argument("--upstream-burst", type=int, default=1000)
+    parser.add_argument("--app-env", action="append", default=[], metavar="NAME=VALUE", help="extra backend setting")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="also write the JSON results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        results = asyncio.run(run(args, Path(root)))
+    write_results("load", args, results, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# Synthetic inputs shared by the benchmark scripts: repository trees, git repositories, ZIP uploads
+# and function-call payloads shaped like the model's structured responses. Everything is seeded,
+# so two runs with the same arguments produce byte-identical inputs.
+import io
+import os
+import random
+import subprocess
+import zipfile
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+GIT_ENV = {**os.environ, "GIT_AUTHOR_NAME": "bench", "GIT_AUTHOR_EMAIL": "bench@localhost",
+           "GIT_COMMITTER_NAME": "bench", "GIT_COMMITTER_EMAIL": "bench@localhost"}
+
+WORDS = ["const", "return", "function", "value", "import", "export", "class", "self", "data", "items",
+         "handler", "request", "response", "config", "result", "index", "buffer", "stream", "cache", "token"]
+EXTENSIONS = [".py", ".js", ".ts", ".go", ".md", ".json", ".yaml", ".css"]
+
+
+def source_text(rng: random.Random, size: int) -> str:
+    # Code-like lines with random identifiers, so the text compresses about as well as real sources
+    lines, total = [], 0
+    while total < size:
+        line = f"{'    ' * rng.randint(0, 3)}{rng.choice(WORDS)} {rng.choice(WORDS)}_{rng.getrandbits(32):x} = {rng.choice(WORDS)}({rng.randint(0, 9999)})"
+        lines.append(line)
+        total += len(line) + 1
+    return "\n".join(lines)
+
+
+def tree_files(files: int, depth: int = 3, fanout: int = 8, file_kb: float = 4, ignored_share: float = 0.3,
+               binary_share: float = 0.02, seed: int = 0) -> Iterator[Tuple[str, bytes]]:
+    # (relative_path, content) for a repository of `files` source files spread over `depth` levels of
+    # `fanout` directories each, plus ignored_share * files files under node_modules/, build/ and *.log
+    # that ingestion must skip, and a few binary files it must replace with a placeholder
+    rng = random.Random(seed)
+    yield ".gitignore", b"*.log\ncoverage/\n"
+    for i in range(files):
+        dirs = [f"pkg{rng.randrange(fanout)}" for _ in range(rng.randint(1, depth))]
+        path = "/".join(["src", *dirs, f"file_{i}{rng.choice(EXTENSIONS)}"])
+        if rng.random() < binary_share:
+            yield path.rsplit('.', 1)[0] + ".bin", bytes(rng.getrandbits(8) for _ in range(512)) + b"\0"
+            continue
+        size = max(64, int(rng.lognormvariate(0, 0.8) * file_kb * 1024))
+        yield path, source_text(rng, size).encode('utf-8')
+    for i in range(int(files * ignored_share)):
+        ignored_dir = rng.choice(["node_modules/dep{}/lib", "build/out{}", "coverage/run{}"]).format(i % 50)
+        yield f"{ignored_dir}/file_{i}.js", source_text(rng, 256).encode('utf-8')
+        if i % 10 == 0:
+            yield f"logs/run_{i}.log", source_text(rng, 256).encode('utf-8')
+
+
+def write_tree(root: Path, **shape) -> dict:
+    # Writes tree_files(**shape) below root and returns its size summary
+    count, total = 0, 0
+    for rel_path, content in tree_files(**shape):
+        path = root / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+        count += 1
+        total += len(content)
+    return {"files": count, "bytes": total}
+
+
+def write_zip(target, top_dir: str = "project", **shape) -> dict:
+    # Same tree as an uploaded archive (with a single top-level directory, as GitHub's "Download ZIP" makes);
+    # target is a path or a binary file object
+    count, total = 0, 0
+    with zipfile.ZipFile(target, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for rel_path, content in tree_files(**shape):
+            archive.writestr(f"{top_dir}/{rel_path}", content)
+            count += 1
+            total += len(content)
+    return {"files": count, "bytes": total}
+
+
+def zip_bytes(**shape) -> bytes:
+    buffer = io.BytesIO()
+    write_zip(buffer, **shape)
+    return buffer.getvalue()
+
+
+def git(cwd, *args: str) -> None:
+    subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True, env=GIT_ENV)
+
+
+def write_git_repo(bare_path: Path, **shape) -> dict:
+    # Bare repository with one commit of tree_files(**shape), for cloning over file://
+    work = bare_path.parent / (bare_path.name + ".work")
+    work.mkdir(parents=True)
+    summary = write_tree(work, **shape)
+    git(work, "init", "-q", "-b", "main")
+    git(work, "add", "-A", "-f")
+    git(work, "commit", "-q", "-m", "initial")
+    git(bare_path.parent, "clone", "-q", "--bare", str(work), str(bare_path))
+    return summary
+
+
+def structured_blocks(blocks: int, block_chars: int = 400, seed: int = 0) -> List[dict]:
+    # Arguments of a generate_structured_response call: a mix of the block types tools.py declares
+    rng = random.Random(seed)
+    parts = [{"type": "title", "content": "Synthetic answer"}]
+    while len(parts) < blocks:
+        kind = rng.choice(["heading", "text", "text", "code", "list", "math"])
+        if kind == "code":
+            parts.append({"type": "code", "language": "python", "content": source_text(rng, block_chars)})
+        elif kind == "list":
+            parts.append({"type": "list", "items": [source_text(rng, block_chars // 8) for _ in range(8)]})
+        elif kind == "math":
+            parts.append({"type": "math", "content": "\\sum_{i=0}^{n} x_i^2"})
+        else:
+            parts.append({"type": kind, "content": source_text(rng, block_chars if kind == "text" else 40)})
+    return parts
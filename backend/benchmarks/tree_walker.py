@@ -0,0 +1,108 @@
+# The disk-tree and whole-archive renderers that /api/clone_repo and /api/generate used before repo
+# mirrors (repo_mirror.py) and per-member ZIP sections (ingest.zip_file_sections). The serving paths
+# no longer touch extracted trees, so these only live on as baselines and reference output for
+# bench_walker.py, bench_zip_ingest.py, bench_repo_refresh.py and bench_micro.py.
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, Optional, Tuple
+
+import pathspec
+
+from ingest import (BINARY_PLACEHOLDER, BINARY_SNIFF_BYTES, MAX_FILE_SIZE, decode_text, ignore_patterns, is_binary,
+                    render_file_section, zip_file_sections)
+
+READ_WORKERS = int(os.environ.get("INGEST_READ_WORKERS", "8"))
+
+
+def can_prune_ignored_dirs(patterns: Iterable[str]) -> bool:
+    # Skipping an ignored directory without looking inside is only exact if no negation pattern
+    # can re-include something below it. Root-anchored single-name negations (like '!/.env.example')
+    # only ever match top-level entries, so they are safe; anything else turns pruning off.
+    for line in patterns:
+        line = line.strip()
+        if not line.startswith('!'):
+            continue
+        negated = line[1:].rstrip('/')
+        if not (negated.startswith('/') and '/' not in negated[1:]):
+            return False
+    return True
+
+
+def _sort_key(entry: os.DirEntry) -> bytes:
+    # Directories sort as "name/" so a depth-first walk yields full paths in byte-wise order,
+    # which is also the order of `git ls-tree -r` (see repo_mirror.py)
+    name = entry.name + '/' if entry.is_dir(follow_symlinks=False) else entry.name
+    return name.encode('utf-8', errors='surrogateescape')
+
+
+def walk_repository(repo_path: str, spec: pathspec.PathSpec, prune: bool = True, rel_dir: str = '') -> Iterator[Tuple[str, str]]:
+    # Yields (relative_posix_path, absolute_path) for every file that is not ignored, depth-first in sorted order.
+    # Uses the d_type data from os.scandir, so no stat() is needed to tell files from directories,
+    # and ignored directories are skipped before we descend into them.
+    try:
+        with os.scandir(repo_path) as it:
+            entries = sorted(it, key=_sort_key)
+    except OSError as e:
+        print(f"Could not read directory {repo_path}: {e}")
+        return
+    for entry in entries:
+        rel_path = rel_dir + entry.name
+        if entry.is_dir(follow_symlinks=False):
+            if prune and spec.match_file(rel_path + '/'):
+                continue
+            yield from walk_repository(entry.path, spec, prune, rel_path + '/')
+        elif entry.is_file():
+            if spec.match_file(rel_path):
+                continue
+            yield rel_path, entry.path
+
+
+def _read_file(abs_path: str) -> Optional[str]:
+    with open(abs_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size > MAX_FILE_SIZE:
+            print(f"Skipping large file {abs_path}")
+            return None
+        head = f.read(BINARY_SNIFF_BYTES)
+        if is_binary(head):
+            return BINARY_PLACEHOLDER
+        return decode_text(head + f.read())
+
+
+def _read_file_safe(abs_path: str) -> Optional[str]:
+    try:
+        return _read_file(abs_path)
+    except Exception as e:
+        print(f"Could not read file {abs_path}: {e}")
+        return None
+
+
+def process_repository_to_text(repo_path_str: str) -> str:
+    repo_path = Path(repo_path_str)
+    gitignore_lines = []
+    gitignore_path = repo_path / '.gitignore'
+    if gitignore_path.is_file():
+        try:
+            with open(gitignore_path, 'r', encoding='utf-8') as f:
+                gitignore_lines = f.read().splitlines()
+        except Exception as e:
+            print(f"Could not read .gitignore file: {e}")
+    patterns = ignore_patterns(gitignore_lines)
+    spec = pathspec.PathSpec.from_lines('gitwildmatch', patterns)
+
+    files = list(walk_repository(str(repo_path), spec, prune=can_prune_ignored_dirs(patterns)))
+    # executor.map keeps the walk order, so the dump stays deterministic
+    with ThreadPoolExecutor(max_workers=READ_WORKERS) as executor:
+        contents = executor.map(_read_file_safe, [abs_path for _, abs_path in files])
+        output_parts = [
+            render_file_section(rel_path, content)
+            for (rel_path, _), content in zip(files, contents)
+            if content is not None
+        ]
+    return "\n".join(output_parts)
+
+
+def process_zip_to_text(zip_file: BinaryIO) -> str:
+    # Renders an uploaded archive the same way process_repository_to_text renders an extracted
+    # tree, but reads members straight from the archive: nothing is extracted to disk.
+    return "\n".join(render_file_section(path, content) for path, content in zip_file_sections(zip_file))
@@ -0,0 +1,157 @@
+import json
+from typing import Any, Dict, List, Tuple
+
+import google.generativeai as genai
+from google.protobuf import struct_pb2
+
+from tools import ALL_TOOL_NAMES, generate_structured_response
+
+# --- Schema (read once from the declarations in tools.py) ---
+STRUCTURED_RESPONSE = generate_structured_response.name
+_PART_SCHEMA = generate_structured_response.parameters.properties['parts'].items
+BLOCK_FIELDS: Tuple[str, ...] = ('type',) + tuple(name for name in _PART_SCHEMA.properties if name != 'type')
+BLOCK_TYPES = frozenset(_PART_SCHEMA.properties['type'].enum)
+ARRAY_FIELDS = frozenset(name for name, schema in _PART_SCHEMA.properties.items() if schema.type_ == genai.protos.Type.ARRAY)
+_FIELD_NAMES = frozenset(BLOCK_FIELDS)
+# Simple tools (make_text, make_code, ...) and the fields a call must have: make_list its items as a list,
+# every other tool a content. The other declared fields (a code block's language, an annotated heading's
+# tag) stay optional, as they always have been for the frontend.
+TOOL_REQUIRED: Dict[str, Tuple[str, ...]] = {
+    name: ('items',) if name == 'make_list' else ('content',) for name in ALL_TOOL_NAMES
+}
+
+_MISSING = object()
+
+
+class Block:
+    # One validated content block. The slots are the properties of a part in generate_structured_response;
+    # fields the model sent that the schema does not declare are kept in `extra`, so as_dict() returns
+    # exactly what the model sent.
+    __slots__ = BLOCK_FIELDS + ('extra',)
+
+    def __init__(self, block_type: str):
+        self.type = block_type
+        self.extra = None
+
+    def set(self, name: str, value: Any) -> None:
+        if name in _FIELD_NAMES:
+            setattr(self, name, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[name] = value
+
+    def get(self, name: str, default: Any = None) -> Any:
+        value = getattr(self, name, _MISSING)
+        if value is _MISSING:
+            return self.extra.get(name, default) if self.extra else default
+        return value
+
+    def as_dict(self) -> dict:
+        block = {}
+        for name in BLOCK_FIELDS:
+            value = getattr(self, name, _MISSING)
+            if value is not _MISSING:
+                block[name] = value
+        if self.extra:
+            block.update(self.extra)
+        return block
+
+
+def error_block(content: str) -> Block:
+    block = Block('code')
+    block.language = 'error'
+    block.content = content
+    return block
+
+
+# --- Conversion of protobuf Struct values ---
+
+def _to_python(value: struct_pb2.Value) -> Any:
+    kind = value.WhichOneof('kind')
+    if kind == 'string_value':
+        return value.string_value
+    if kind == 'number_value':
+        return value.number_value
+    if kind == 'bool_value':
+        return value.bool_value
+    if kind == 'struct_value':
+        return {key: _to_python(item) for key, item in value.struct_value.fields.items()}
+    if kind == 'list_value':
+        return [_to_python(item) for item in value.list_value.values]
+    return None
+
+
+def _to_python_fields(fields: Any) -> dict:
+    return {key: _to_python(value) for key, value in fields.items()}
+
+
+def _args_fields(args: Any) -> Any:
+    # The Struct field map behind a function call's args: proto-plus hands out a MapComposite over it,
+    # raw protobuf messages have it as .fields, and plain dicts (tests, fakes) are packed into one
+    if isinstance(args, struct_pb2.Struct):
+        return args.fields
+    fields = getattr(args, 'pb', None)
+    if fields is not None:
+        return fields
+    struct = struct_pb2.Struct()
+    struct.update(args or {})
+    return struct.fields
+
+
+def _fill(block: Block, fields: Any) -> None:
+    for name, value in fields.items():
+        if name == 'type':
+            continue
+        # Strings are by far the most common value: read them without the generic dispatch
+        if value.WhichOneof('kind') == 'string_value':
+            block.set(name, value.string_value)
+        else:
+            block.set(name, _to_python(value))
+
+
+# --- Normalizer ---
+
+def normalize_function_call(function_call: Any) -> Tuple[List[Block], int]:
+    # Turns one function call from the model into validated blocks in a single pass over its args.
+    # Returns (blocks, unsupported): parts whose type is not one of the declared block types are
+    # counted but not returned, so callers can tell an empty answer from an unsupported one.
+    name = function_call.name
+    fields = _args_fields(function_call.args)
+
+    if name == STRUCTURED_RESPONSE:
+        # Indexing a protobuf map inserts missing keys, so check membership first
+        parts = fields['parts'] if 'parts' in fields else None
+        if parts is None or parts.WhichOneof('kind') != 'list_value':
+            print(f"Warning: 'parts' in structured response is not a list: {_to_python(parts) if parts is not None else []}")
+            return [], 0
+        blocks, unsupported = [], 0
+        for part in parts.list_value.values:
+            if part.WhichOneof('kind') != 'struct_value' or 'type' not in part.struct_value.fields:
+                print(f"Warning: Skipping malformed part in structured response: {_to_python(part)}")
+                continue
+            part_fields = part.struct_value.fields
+            block_type = _to_python(part_fields['type'])
+            if not isinstance(block_type, str) or block_type not in BLOCK_TYPES:
+                unsupported += 1
+                continue
+            block = Block(block_type)
+            _fill(block, part_fields)
+            blocks.append(block)
+        return blocks, unsupported
+
+    required = TOOL_REQUIRED.get(name)
+    if required is not None:
+        block = Block(name.replace('make_', ''))
+        _fill(block, fields)
+        is_valid = all(
+            block.get(field, _MISSING) is not _MISSING and (field not in ARRAY_FIELDS or isinstance(block.get(field), list))
+            for field in required
+        )
+        if not is_valid:
+            print(f"Warning: AI called function '{name}' with invalid args: {_to_python_fields(fields)}")
+            return [], 0
+        return [block], 0
+
+    arguments = json.dumps(_to_python_fields(fields), indent=2)
+    return [error_block(f"AI called an unexpected function: {name}\n\nArguments: {arguments}")], 0
@@ -0,0 +1,231 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Optional
+
+# --- Settings ---
+# "sqlite" is shared by every gunicorn worker on the host; "memory" is per process (local development)
+CACHE_STORE_BACKEND = os.environ.get("CACHE_STORE_BACKEND", "sqlite")
+# The store holds uploaded code and generated answers: its directory is made private to this user (0700)
+# and the database file is created 0600, so it belongs in a directory of its own
+CACHE_STORE_PATH = os.environ.get("CACHE_STORE_PATH", os.path.join(tempfile.gettempdir(), "gemini_gateway_cache", "cache.sqlite3"))
+CACHE_STORE_MAX_BYTES = int(os.environ.get("CACHE_STORE_MAX_BYTES", str(1024 * 1024 * 1024)))
+# Values at least this large are stored zlib-compressed (repository dumps shrink ~4x)
+CACHE_STORE_COMPRESS_MIN_BYTES = 4096
+CACHE_STORE_COMPRESS_LEVEL = 3
+# Reading an entry only rewrites its LRU timestamp if it is older than this, so hits rarely need the write lock
+CACHE_STORE_TOUCH_INTERVAL = 60
+
+
+class CacheStore:
+    # Namespaced byte store with optional per-entry TTL and LRU eviction by total stored bytes.
+    # The methods are blocking; async callers run them with asyncio.to_thread.
+
+    def __init__(self, max_bytes: int = CACHE_STORE_MAX_BYTES, compress_min_bytes: int = CACHE_STORE_COMPRESS_MIN_BYTES):
+        self.max_bytes = max_bytes
+        self.compress_min_bytes = compress_min_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._counter_lock = threading.Lock()
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._counter_lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def _encode(self, value: bytes) -> tuple:
+        if len(value) >= self.compress_min_bytes:
+            return zlib.compress(value, CACHE_STORE_COMPRESS_LEVEL), True
+        return value, False
+
+    def get(self, namespace: str, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def put(self, namespace: str, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        raise NotImplementedError
+
+    def delete(self, namespace: str, key: str) -> None:
+        raise NotImplementedError
+
+    def get_text(self, namespace: str, key: str) -> Optional[str]:
+        value = self.get(namespace, key)
+        return value.decode('utf-8') if value is not None else None
+
+    def put_text(self, namespace: str, key: str, text: str, ttl: Optional[float] = None) -> None:
+        self.put(namespace, key, text.encode('utf-8'), ttl)
+
+    def get_json(self, namespace: str, key: str) -> Any:
+        value = self.get(namespace, key)
+        return json.loads(value) if value is not None else None
+
+    def put_json(self, namespace: str, key: str, data: Any, ttl: Optional[float] = None) -> None:
+        self.put(namespace, key, json.dumps(data).encode('utf-8'), ttl)
+
+    def stats(self) -> dict:
+        with self._counter_lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "max_bytes": self.max_bytes}
+
+
+def _private_file(path: str) -> None:
+    # Refuses a directory another user could have prepared (e.g. under a shared /tmp) instead of using it
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.stat(directory)
+    if info.st_uid != os.getuid():
+        raise PermissionError(f"Cache store directory {directory} belongs to another user")
+    if info.st_mode & 0o077:
+        os.chmod(directory, 0o700)
+    # SQLite creates the -wal and -shm files with the permissions of the database file
+    os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+    os.chmod(path, 0o600)
+
+
+class SqliteCacheStore(CacheStore):
+    # One SQLite file in WAL mode shared by all workers on the host: readers never block each other,
+    # every write is a single transaction (no partial entries), and SQLite's own file locking
+    # serialises writers across processes. Each thread gets its own connection.
+
+    def __init__(self, path: str = CACHE_STORE_PATH, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            _private_file(self.path)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            # Expired and evicted entries are overwritten on disk, not just unlinked from the b-tree
+            conn.execute("PRAGMA secure_delete=ON")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, compressed INTEGER NOT NULL,"
+                " size INTEGER NOT NULL, expires_at REAL, accessed_at REAL NOT NULL, PRIMARY KEY (namespace, key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)")
+            self._local.conn = conn
+        return conn
+
+    def get(self, namespace: str, key: str) -> Optional[bytes]:
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT value, compressed, expires_at, accessed_at FROM entries WHERE namespace = ? AND key = ?",
+            (namespace, key),
+        ).fetchone()
+        now = time.time()
+        if row is None or (row[2] is not None and row[2] <= now):
+            if row is not None:
+                self.delete(namespace, key)
+            self._count('misses')
+            return None
+        value, compressed, _, accessed_at = row
+        if now - accessed_at > CACHE_STORE_TOUCH_INTERVAL:
+            conn.execute("UPDATE entries SET accessed_at = ? WHERE namespace = ? AND key = ?", (now, namespace, key))
+        self._count('hits')
+        return zlib.decompress(value) if compressed else value
+
+    def put(self, namespace: str, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        stored, compressed = self._encode(value)
+        if len(stored) > self.max_bytes:
+            print(f"Not caching {namespace} entry of {len(stored)} bytes: larger than the whole cache")
+            return
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, value, compressed, size, expires_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (namespace, key, stored, int(compressed), len(stored), now + ttl if ttl else None, now),
+            )
+            conn.execute("DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+            self._evict(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        victims = []
+        for namespace, key, size in conn.execute("SELECT namespace, key, size FROM entries ORDER BY accessed_at"):
+            if total <= self.max_bytes:
+                break
+            victims.append((namespace, key))
+            total -= size
+        conn.executemany("DELETE FROM entries WHERE namespace = ? AND key = ?", victims)
+        self._count('evictions', len(victims))
+
+    def delete(self, namespace: str, key: str) -> None:
+        self._conn().execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def stats(self) -> dict:
+        entries, size = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"backend": "sqlite", "entries": entries, "bytes": size, **super().stats()}
+
+
+class MemoryCacheStore(CacheStore):
+    # Same interface, kept in this process only
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.size_bytes = 0
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+            if entry is not None and entry[2] is not None and entry[2] <= time.time():
+                self._drop((namespace, key))
+                entry = None
+            if entry is None:
+                self._count('misses')
+                return None
+            self._entries.move_to_end((namespace, key))
+            self._count('hits')
+        stored, compressed, _ = entry
+        return zlib.decompress(stored) if compressed else stored
+
+    def _drop(self, entry_key: tuple) -> None:
+        stored, _, _ = self._entries.pop(entry_key)
+        self.size_bytes -= len(stored)
+
+    def put(self, namespace: str, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        stored, compressed = self._encode(value)
+        if len(stored) > self.max_bytes:
+            return
+        with self._lock:
+            if (namespace, key) in self._entries:
+                self._drop((namespace, key))
+            self._entries[(namespace, key)] = (stored, compressed, time.time() + ttl if ttl else None)
+            self.size_bytes += len(stored)
+            while self.size_bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self._count('evictions')
+
+    def delete(self, namespace: str, key: str) -> None:
+        with self._lock:
+            if (namespace, key) in self._entries:
+                self._drop((namespace, key))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"backend": "memory", "entries": len(self._entries), "bytes": self.size_bytes, **super().stats()}
+
+
+def open_cache_store(backend: str = CACHE_STORE_BACKEND) -> CacheStore:
+    if backend == "memory":
+        return MemoryCacheStore()
+    if backend == "sqlite":
+        return SqliteCacheStore()
+    raise ValueError(f"Unknown CACHE_STORE_BACKEND: {backend}")
@@ -0,0 +1,191 @@
+import asyncio
+import fcntl
+import json
+import os
+import tempfile
+import time
+import uuid
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from ingest import IGNORE_RULES_VERSION
+from metrics import CLONE_JOBS
+from repo_cache import RepoCache
+from repo_mirror import RepoMirror, RepoMirrorError, resolve_commit
+from stage_timings import StageTimings
+
+# --- Settings ---
+CLONE_JOB_DIR = os.environ.get("CLONE_JOB_DIR", os.path.join(tempfile.gettempdir(), "gemini_gateway_jobs"))
+# Host-wide: the slots are lock files shared by every gunicorn worker
+CLONE_CONCURRENCY = int(os.environ.get("CLONE_CONCURRENCY", "2"))
+CLONE_JOB_TTL = int(os.environ.get("CLONE_JOB_TTL", "600"))
+
+
+class CloneJobs:
+    # Runs clones as background asyncio jobs. The job status lives in a small JSON file, so a
+    # client can poll any worker nginx happens to pick; the finished dump is served from the
+    # repo cache (or from the job itself on the worker that ran it).
+    # Identical in-flight requests (same repo and branch) on a worker share one job.
+
+    def __init__(self, mirror: RepoMirror, cache: RepoCache, job_dir: str = CLONE_JOB_DIR,
+                 concurrency: int = CLONE_CONCURRENCY, ttl: int = CLONE_JOB_TTL):
+        self.mirror = mirror
+        self.cache = cache
+        self.job_dir = Path(job_dir)
+        self.concurrency = max(1, concurrency)
+        self.ttl = ttl
+        self.coalesced = 0
+        self._inflight: Dict[Tuple[str, Optional[str]], str] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    # --- Status files ---
+
+    def _status_path(self, job_id: str) -> Path:
+        return self.job_dir / f"{job_id}.json"
+
+    def _write_status(self, job_id: str, status: dict) -> None:
+        self.job_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.job_dir / f"{job_id}.json.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(status, f)
+        os.replace(tmp_path, self._status_path(job_id))
+
+    def _update(self, job_id: str, **changes) -> None:
+        status = self.status(job_id) or {}
+        status.update(changes, updated_at=time.time())
+        self._write_status(job_id, status)
+
+    def status(self, job_id: str) -> Optional[dict]:
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(self._status_path(job_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _purge(self) -> None:
+        cutoff = time.time() - self.ttl
+        for job_id, task in list(self._tasks.items()):
+            status = self.status(job_id)
+            if task.done() and (status is None or status.get('updated_at', 0) < cutoff):
+                del self._tasks[job_id]
+        if not self.job_dir.is_dir():
+            return
+        for path in self.job_dir.glob('*.json'):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except FileNotFoundError:
+                pass
+
+    # --- Concurrency cap ---
+
+    @asynccontextmanager
+    async def _slot(self):
+        # Takes one of CLONE_CONCURRENCY lock-file slots; waits (without blocking the loop) while all are busy
+        self.job_dir.mkdir(parents=True, exist_ok=True)
+        while True:
+            for i in range(self.concurrency):
+                slot_file = open(self.job_dir / f"slot-{i}.lock", 'w')
+                try:
+                    fcntl.flock(slot_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    slot_file.close()
+                    continue
+                try:
+                    yield
+                finally:
+                    fcntl.flock(slot_file, fcntl.LOCK_UN)
+                    slot_file.close()
+                return
+            await asyncio.sleep(0.2)
+
+    # --- Jobs ---
+
+    def submit(self, repo_path: str, branch: Optional[str], clone_url: str, repo_name: str) -> str:
+        key = (repo_path.lower(), branch)
+        job_id = self._inflight.get(key)
+        if job_id:
+            self.coalesced += 1
+            return job_id
+
+        self._purge()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._write_status(job_id, {
+            "job_id": job_id, "repo_name": repo_name, "branch": branch, "status": "queued",
+            "created_at": now, "updated_at": now,
+        })
+        self._inflight[key] = job_id
+        task = asyncio.create_task(self._run(job_id, key, repo_path, branch, clone_url))
+        # Failures are reported through the status file; mark the exception as retrieved for polled jobs
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._tasks[job_id] = task
+        return job_id
+
+    async def _run(self, job_id: str, key: Tuple[str, Optional[str]], repo_path: str, branch: Optional[str], clone_url: str) -> str:
+        # Stage durations go to /metrics and, as "timings" in the job status, to the Server-Timing header
+        timings = StageTimings("clone")
+
+        def progress(stage: str) -> None:
+            timings.begin(stage)
+            self._update(job_id, status=stage)
+
+        def finish(result: str, **changes) -> None:
+            timings.begin(None)
+            CLONE_JOBS.inc(result=result)
+            self._update(job_id, timings=timings.as_dict(), **changes)
+
+        try:
+            progress("resolving")
+            # Resolve the commit first: if we already processed it, skip the fetch entirely. Neither step
+            # takes a slot, so cache hits are served while every slot is busy with a fetch.
+            commit_sha = await resolve_commit(clone_url, branch)
+            if commit_sha:
+                timings.begin("cache_lookup")
+                cache_key = RepoCache.make_key(repo_path, commit_sha, IGNORE_RULES_VERSION)
+                cached_text = await asyncio.to_thread(self.cache.get, cache_key)
+                if cached_text is not None:
+                    finish("cached", status="done", cache_key=cache_key, commit=commit_sha, bytes=len(cached_text))
+                    return cached_text
+
+            # Slots only cap the fetches and renders that actually run
+            self._update(job_id, status="queued")
+            timings.begin("slot_wait")
+            async with self._slot():
+                fetched_sha, processed_text = await self.mirror.refresh(clone_url, branch, progress=progress)
+            # Key on the commit we actually fetched, in case the branch moved since ls-remote
+            timings.begin("cache_store")
+            cache_key = RepoCache.make_key(repo_path, fetched_sha, IGNORE_RULES_VERSION)
+            try:
+                await asyncio.to_thread(self.cache.put, cache_key, processed_text)
+            except OSError as e:
+                print(f"Could not store repository dump in cache: {e}")
+            finish("fetched", status="done", cache_key=cache_key, commit=fetched_sha, bytes=len(processed_text))
+            return processed_text
+        except RepoMirrorError as e:
+            finish("failed", status="failed", error=f"Failed to clone repository: {e.stderr or e}", error_code=400)
+            raise
+        except Exception as e:
+            finish("failed", status="failed", error=f"An unexpected error occurred: {str(e)}", error_code=500)
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def wait(self, job_id: str) -> str:
+        # Only for jobs started by this worker; shielded so one disconnecting client does not cancel a shared job
+        return await asyncio.shield(self._tasks[job_id])
+
+    async def result(self, job_id: str) -> Optional[str]:
+        task = self._tasks.get(job_id)
+        if task is not None and task.done() and not task.cancelled() and task.exception() is None:
+            return task.result()
+        status = self.status(job_id)
+        if status and status.get('cache_key'):
+            return await asyncio.to_thread(self.cache.get, status['cache_key'])
+        return None
+
+    def stats(self) -> dict:
+        return {"inflight_jobs": len(self._inflight), "coalesced_jobs": self.coalesced, "clone_concurrency": self.concurrency}
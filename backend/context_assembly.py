@@ -0,0 +1,129 @@
+import hashlib
+import math
+import os
+import re
+from typing import Dict, List, Tuple
+
+from context_packer import BYTES_PER_TOKEN, ContextSource, duplicate_reference, file_extension
+from ingest import render_compact_section, render_file_section
+from metrics import CONTEXT_ASSEMBLY_SAVED_BYTES
+
+# --- Settings ---
+# Smaller files are repeated in full: a reference to the first copy would hardly be shorter
+DEDUP_MIN_BYTES = int(os.environ.get("CONTEXT_DEDUP_MIN_BYTES", "256"))
+# Generated files are collapsed when at least this share of their characters is whitespace
+WHITESPACE_COLLAPSE_SHARE = float(os.environ.get("CONTEXT_WHITESPACE_COLLAPSE_SHARE", "0.3"))
+WHITESPACE_COLLAPSE_MIN_BYTES = int(os.environ.get("CONTEXT_WHITESPACE_COLLAPSE_MIN_BYTES", "2048"))
+
+# Formats that are (nearly) always written by tools; other files count as generated if their head says so
+GENERATED_EXTENSIONS = {'.json', '.map', '.lock', '.svg', '.xml', '.ipynb', '.snap', '.min.js', '.min.css'}
+# Formats in which indentation carries no meaning, so leading whitespace and blank lines can go too
+INDENT_INSENSITIVE_EXTENSIONS = {'.json', '.map', '.svg', '.xml', '.ipynb'}
+GENERATED_MARKER = re.compile(r"@generated|auto-?generated|generated by|do not edit", re.IGNORECASE)
+GENERATED_MARKER_SCAN = 1_000
+BLANK_LINE_RUNS = re.compile(r"\n{3,}")
+
+# Per-file framing saved by render_compact_section (both are linear in the path and the content)
+COMPACT_FRAMING_SAVED_BYTES = len(render_file_section("", "")) - len(render_compact_section("", ""))
+
+
+class AssemblyReport:
+    def __init__(self):
+        self.files = 0
+        self.duplicates = 0
+        self.collapsed = 0
+        self.bytes_saved: Dict[str, int] = {'duplicate': 0, 'whitespace': 0, 'framing': 0}
+
+    @property
+    def total_bytes_saved(self) -> int:
+        return sum(self.bytes_saved.values())
+
+    @property
+    def tokens_saved(self) -> int:
+        return math.ceil(self.total_bytes_saved / BYTES_PER_TOKEN)
+
+    def headers(self) -> Dict[str, str]:
+        return {
+            "X-Context-Duplicates": str(self.duplicates),
+            "X-Context-Collapsed": str(self.collapsed),
+            "X-Context-Assembly-Bytes-Saved": str(self.total_bytes_saved),
+            "X-Context-Assembly-Tokens-Saved": str(self.tokens_saved),
+        }
+
+    def as_dict(self) -> dict:
+        return {
+            "files": self.files, "duplicates": self.duplicates, "collapsed": self.collapsed,
+            "bytes_saved": dict(self.bytes_saved), "tokens_saved": self.tokens_saved,
+        }
+
+
+def collapse_whitespace(path: str, content: str) -> str:
+    # Whitespace-heavy generated files (pretty-printed JSON, lockfiles, SVG, ...) lose trailing whitespace
+    # and runs of blank lines, and indentation where the format ignores it. Everything else is returned as is.
+    if len(content) < WHITESPACE_COLLAPSE_MIN_BYTES:
+        return content
+    ext = file_extension(path)
+    if ext not in GENERATED_EXTENSIONS and not GENERATED_MARKER.search(content[:GENERATED_MARKER_SCAN]):
+        return content
+    whitespace = content.count(' ') + content.count('\t') + content.count('\n')
+    if whitespace < WHITESPACE_COLLAPSE_SHARE * len(content):
+        return content
+
+    if ext in INDENT_INSENSITIVE_EXTENSIONS:
+        collapsed = "\n".join(line for line in (line.strip() for line in content.split('\n')) if line)
+    else:
+        collapsed = BLANK_LINE_RUNS.sub("\n\n", "\n".join(line.rstrip() for line in content.split('\n')))
+    collapsed = f"[Whitespace collapsed]\n{collapsed}"
+    # Only worth the marker if it saves a tenth of the file
+    return collapsed if len(collapsed) < 0.9 * len(content) else content
+
+
+def assemble_context(sources: List[ContextSource], compact: bool = False) -> Tuple[List[ContextSource], AssemblyReport]:
+    # Runs between ingestion and packing, over all attachments of a request at once. A file whose exact
+    # content already appeared (the same file uploaded on its own and inside a ZIP, vendored code shared
+    # by two repositories) keeps its path but its content becomes a reference to the first copy.
+    # Generated files are collapsed, and compact selects the shorter per-file framing. The returned
+    # sources are new objects: the ingested ones may be shared with the parsed-archive cache.
+    # The packer and the shard splitter expand a reference again if its first copy is degraded or
+    # lands in another shard (see ContextSource.duplicates).
+    report = AssemblyReport()
+    assembled: Dict[int, ContextSource] = {}
+    first_copies: Dict[bytes, str] = {}
+
+    # Files the user attached on their own keep their content; copies inside archives and dumps point to them
+    for index in sorted(range(len(sources)), key=lambda i: (sources[i].kind != 'file', i)):
+        source = sources[index]
+        if source.binary:
+            assembled[index] = source
+            continue
+        sections = []
+        duplicates: Dict[int, Tuple[str, str]] = {}
+        for path, content in source.sections:
+            report.files += 1
+            if len(content) >= DEDUP_MIN_BYTES:
+                data = content.encode('utf-8')
+                digest = hashlib.blake2b(data, digest_size=16).digest()
+                first_copy = first_copies.get(digest)
+                if first_copy is not None:
+                    reference = duplicate_reference(first_copy)
+                    duplicates[len(sections)] = (first_copy, content)
+                    sections.append((path, reference))
+                    report.duplicates += 1
+                    report.bytes_saved['duplicate'] += len(data) - len(reference.encode('utf-8'))
+                    continue
+                first_copies[digest] = source.location(path)
+
+            collapsed = collapse_whitespace(path, content)
+            if collapsed is not content:
+                report.collapsed += 1
+                report.bytes_saved['whitespace'] += len(content.encode('utf-8')) - len(collapsed.encode('utf-8'))
+            sections.append((path, collapsed))
+
+        if compact and source.kind != 'file':
+            report.bytes_saved['framing'] += COMPACT_FRAMING_SAVED_BYTES * len(sections)
+        assembled[index] = ContextSource(source.name, source.kind, sections, source.binary, compact, duplicates)
+
+    for reason, saved in report.bytes_saved.items():
+        if saved:
+            CONTEXT_ASSEMBLY_SAVED_BYTES.inc(saved, reason=reason)
+    return [assembled[index] for index in range(len(sources))], report
@@ -0,0 +1,165 @@
+import asyncio
+import datetime
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+from google.api_core import exceptions as google_exceptions
+from google.generativeai import caching, protos
+
+from context_packer import estimate_tokens
+from model_pool import ModelClientPool, model_pool, tool_names
+
+# --- Settings ---
+CONTEXT_CACHE_ENABLED = os.environ.get("CONTEXT_CACHE_ENABLED", "1") == "1"
+CONTEXT_CACHE_TTL = int(os.environ.get("CONTEXT_CACHE_TTL", "3600"))
+# Caching has a minimum size on the API side and costs storage; small prompts are cheaper to resend
+CONTEXT_CACHE_MIN_TOKENS = int(os.environ.get("CONTEXT_CACHE_MIN_TOKENS", "32768"))
+CONTEXT_CACHE_MAX_ENTRIES = int(os.environ.get("CONTEXT_CACHE_MAX_ENTRIES", "64"))
+# Entries this close to expiry are recreated rather than risking a "cache not found" mid-request
+CONTEXT_CACHE_EXPIRY_MARGIN = 60
+# After the API refuses to cache for a model, do not try again for this long
+CONTEXT_CACHE_UNSUPPORTED_BACKOFF = 600
+UNSUPPORTED_ERRORS = (
+    google_exceptions.InvalidArgument, google_exceptions.NotFound,
+    google_exceptions.PermissionDenied, google_exceptions.FailedPrecondition,
+)
+
+
+class GeminiCacheBackend:
+    # Thin wrapper over the SDK's context caching, so tests can swap in a local fake.
+    # The SDK calls are blocking HTTP requests, so they run in a thread. CachedContent.create()
+    # and .delete() always use the globally configured key, so the requests are sent through
+    # the caller's pooled client instead.
+
+    def __init__(self, pool: ModelClientPool = model_pool):
+        self.pool = pool
+
+    async def create(self, api_key: str, model: str, system_instruction: str, contents: List[str],
+                     tools: Any, tool_config: Any, ttl: int) -> Any:
+        request = caching.CachedContent._prepare_create_request(
+            model=model,
+            system_instruction=system_instruction,
+            contents=contents,
+            tools=[tools],
+            tool_config=tool_config,
+            ttl=datetime.timedelta(seconds=ttl),
+        )
+        response = await asyncio.to_thread(self.pool.cache_client(api_key).create_cached_content, request)
+        return caching.CachedContent._from_obj(response)
+
+    async def delete(self, api_key: str, cached_content: Any) -> None:
+        request = protos.DeleteCachedContentRequest(name=cached_content.name)
+        await asyncio.to_thread(self.pool.cache_client(api_key).delete_cached_content, request)
+
+    def model_for(self, api_key: str, cached_content: Any) -> Any:
+        return self.pool.cached_model(api_key, cached_content)
+
+
+class CachedEntry:
+    def __init__(self, api_key: str, cached_content: Any, expires_at: float):
+        self.api_key = api_key
+        self.cached_content = cached_content
+        self.expires_at = expires_at
+
+
+class ContextCacheRegistry:
+    # Registry of provider-side cached contexts (system prompt + tools + attachments), keyed by a hash
+    # of everything that goes into them, so follow-up turns about the same codebase only send the new
+    # request. get_model() returns no model whenever caching is not possible, and the caller sends the
+    # full prompt as before.
+
+    def __init__(self, backend: Optional[GeminiCacheBackend] = None, ttl: int = CONTEXT_CACHE_TTL,
+                 min_tokens: int = CONTEXT_CACHE_MIN_TOKENS, max_entries: int = CONTEXT_CACHE_MAX_ENTRIES,
+                 enabled: bool = CONTEXT_CACHE_ENABLED):
+        self.backend = backend or GeminiCacheBackend()
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, CachedEntry]" = OrderedDict()
+        self._unsupported_until: dict = {}
+        self._creating: dict = {}
+
+    @staticmethod
+    def make_key(api_key: str, model: str, system_prompt: str, tool_names: List[str], tool_config: Any,
+                 contents: List[str]) -> str:
+        # Caches belong to the API key's project, so the key is part of the identity. The tool config is
+        # baked into the cached content, so streamed and complete answers need separate caches.
+        digest = hashlib.sha256()
+        for value in (api_key, model, system_prompt, "\0".join(tool_names), repr(tool_config), *contents):
+            digest.update(hashlib.sha256(value.encode('utf-8')).digest())
+        return digest.hexdigest()
+
+    def _evict(self) -> None:
+        now = time.time()
+        for key in [k for k, entry in self._entries.items() if entry.expires_at - CONTEXT_CACHE_EXPIRY_MARGIN <= now]:
+            del self._entries[key]  # expired on the provider side already
+        while len(self._entries) > self.max_entries:
+            _, entry = self._entries.popitem(last=False)
+            self.evictions += 1
+            # Stop paying for storage of caches we will not use again
+            asyncio.create_task(self._delete_quietly(entry))
+
+    async def _delete_quietly(self, entry: CachedEntry) -> None:
+        try:
+            await self.backend.delete(entry.api_key, entry.cached_content)
+        except Exception as e:
+            print(f"Could not delete cached context: {e}")
+
+    def invalidate(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    async def get_model(self, api_key: str, model: str, system_prompt: str, contents: List[str],
+                        tools: Any, tool_config: Any) -> Tuple[Optional[Any], str, str]:
+        # Returns (model bound to the cached context or None, registry key, "hit" | "created" | "bypass")
+        key = self.make_key(api_key, model, system_prompt, list(tool_names([tools])), tool_config, contents)
+        if not self.enabled or not contents:
+            return None, key, "bypass"
+        if sum(estimate_tokens(part) for part in contents) < self.min_tokens:
+            return None, key, "bypass"
+        scope = (hashlib.sha256(api_key.encode('utf-8')).hexdigest(), model)
+        if self._unsupported_until.get(scope, 0) > time.time():
+            self.fallbacks += 1
+            return None, key, "bypass"
+
+        self._evict()
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self.backend.model_for(api_key, entry.cached_content), key, "hit"
+
+        self.misses += 1
+        # Concurrent requests for the same context share one creation call
+        pending = self._creating.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self.backend.create(api_key, model, system_prompt, contents, tools, tool_config, self.ttl))
+            self._creating[key] = pending
+        try:
+            cached_content = await asyncio.shield(pending)
+        except Exception as e:
+            print(f"Could not cache the context for {model}, sending the full prompt: {e}")
+            if isinstance(e, UNSUPPORTED_ERRORS):
+                # e.g. free-tier keys, models without caching, or content below the API minimum
+                self._unsupported_until[scope] = time.time() + CONTEXT_CACHE_UNSUPPORTED_BACKOFF
+            self.fallbacks += 1
+            return None, key, "bypass"
+        finally:
+            self._creating.pop(key, None)
+
+        self._entries[key] = CachedEntry(api_key, cached_content, time.time() + self.ttl)
+        self._evict()
+        return self.backend.model_for(api_key, cached_content), key, "created"
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+            "fallbacks": self.fallbacks, "evictions": self.evictions,
+        }
@@ -0,0 +1,307 @@
+import math
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+from ingest import BINARY_PLACEHOLDER, render_compact_section, render_file_section
+
+# --- Settings ---
+# Input token limits per model; anything not listed uses DEFAULT_CONTEXT_TOKENS
+MODEL_CONTEXT_TOKENS = {
+    "gemini-2.5-pro": 1_048_576,
+    "gemini-2.5-flash": 1_048_576,
+    "gemini-2.5-flash-lite": 1_048_576,
+}
+DEFAULT_CONTEXT_TOKENS = int(os.environ.get("DEFAULT_CONTEXT_TOKENS", "1048576"))
+# Optional hard cap below the model limit (e.g. to keep free-tier requests under their TPM quota)
+CONTEXT_BUDGET_TOKENS = int(os.environ.get("CONTEXT_BUDGET_TOKENS", "0"))
+# Kept free for the system prompt's tool declarations and the model's answer
+CONTEXT_RESERVED_TOKENS = 70_000
+# The estimator is approximate, so only fill this share of the budget
+CONTEXT_SAFETY_MARGIN = 0.9
+# No single file may take more than this share of the budget in full
+MAX_FILE_SHARE = 0.25
+MANIFEST_MAX_ENTRIES = 200
+# A truncated head keeps at least this many lines, each costing at least a token
+HEAD_MIN_LINES = 5
+# Roughly 4 bytes of UTF-8 per token for code and English text
+BYTES_PER_TOKEN = 4
+
+SOURCE_EXTENSIONS = {
+    '.py', '.ts', '.tsx', '.js', '.jsx', '.mjs', '.cjs', '.go', '.rs', '.java', '.kt', '.kts', '.scala',
+    '.c', '.h', '.cc', '.cpp', '.hpp', '.cs', '.swift', '.m', '.rb', '.php', '.sh', '.sql', '.vue', '.svelte',
+    '.lua', '.dart', '.ex', '.exs', '.hs', '.clj', '.r', '.jl',
+}
+CONFIG_EXTENSIONS = {'.md', '.rst', '.txt', '.toml', '.yaml', '.yml', '.json', '.ini', '.cfg', '.xml', '.html', '.css', '.scss', '.gradle', '.dockerfile'}
+LOW_VALUE_EXTENSIONS = {'.lock', '.map', '.svg', '.csv', '.tsv', '.min.js', '.min.css', '.snap', '.log', '.pb', '.ipynb'}
+
+OUTLINE_LINE = re.compile(
+    r"^\s*(?:(?:export\s+)?(?:default\s+)?(?:async\s+)?(?:def|class|function|interface|type|enum|struct|trait|impl|fn|func|module|namespace)\b"
+    r"|(?:public|private|protected|internal|static)\s|export\s+(?:const|let|var)\b|#{1,6}\s|@\w+)"
+)
+# Every line OUTLINE_LINE matches starts with one of these once indentation is stripped; the cheap
+# prefix test rules out most lines before the regex runs
+OUTLINE_PREFIXES = (
+    'export', 'default', 'async', 'def', 'class', 'function', 'interface', 'type', 'enum', 'struct', 'trait',
+    'impl', 'fn', 'func', 'module', 'namespace', 'public', 'private', 'protected', 'internal', 'static', '#', '@',
+)
+OUTLINE_NOTICE_MIN = "[Outline only: 1 of 1 lines shown]\n"
+WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_]{2,}")
+# Only the head of a file is searched for prompt terms: relevance scoring has to stay cheap
+PRIORITY_SCAN_CHARS = 20_000
+STOPWORDS = {
+    'the', 'and', 'for', 'with', 'this', 'that', 'from', 'are', 'was', 'what', 'how', 'why', 'can', 'you', 'your',
+    'not', 'but', 'all', 'any', 'use', 'code', 'file', 'files', 'make', 'into', 'have', 'has', 'should', 'would',
+    'please', 'need', 'want', 'there', 'their', 'them', 'then', 'than', 'also', 'its', 'our', 'out', 'get', 'set',
+}
+
+
+def estimate_tokens(text: str) -> int:
+    # Cheap enough to run per file
+    return math.ceil(len(text.encode('utf-8')) / BYTES_PER_TOKEN) if text else 0
+
+
+def context_budget(model: str) -> int:
+    model_id = model.split('/')[-1]
+    limit = next((tokens for name, tokens in MODEL_CONTEXT_TOKENS.items() if model_id.startswith(name)), DEFAULT_CONTEXT_TOKENS)
+    if CONTEXT_BUDGET_TOKENS:
+        limit = min(limit, CONTEXT_BUDGET_TOKENS)
+    return int((limit - CONTEXT_RESERVED_TOKENS) * CONTEXT_SAFETY_MARGIN)
+
+
+def duplicate_reference(first_copy: str) -> str:
+    return f"[Duplicate: same content as {first_copy}]"
+
+
+class ContextSource:
+    # One uploaded attachment, split into per-file sections so the packer can degrade them one by one.
+    # kind is 'file' (a single uploaded file), 'zip' (an archive) or 'repo' (a cloned repository dump).
+    # compact switches the per-file framing of archives and dumps to render_compact_section.
+    # duplicates maps the index of a section that assemble_context replaced by a reference to
+    # (location of the first copy, original content), so the reference can be expanded again
+    # wherever the first copy does not end up next to it in full.
+
+    def __init__(self, name: str, kind: str, sections: List[Tuple[str, str]], binary: bool = False, compact: bool = False,
+                 duplicates: Optional[Dict[int, Tuple[str, str]]] = None):
+        self.name = name
+        self.kind = kind
+        self.sections = sections
+        self.binary = binary
+        self.compact = compact
+        self.duplicates = duplicates or {}
+
+    def location(self, path: str) -> str:
+        # How a section is named in duplicate references
+        return self.name if self.kind == 'file' else f"{path} in {self.name}"
+
+    def render(self, sections: Optional[List[Tuple[str, str]]] = None) -> str:
+        sections = self.sections if sections is None else sections
+        if self.kind == 'file':
+            if self.binary:
+                return f"--- Provided File: {self.name} ---\n{BINARY_PLACEHOLDER}\n--- End File: {self.name} ---"
+            content = sections[0][1] if sections else ""
+            return f"--- Provided File: {self.name} ---\n```\n{content}\n```\n--- End File: {self.name} ---"
+        render_section = render_compact_section if self.compact else render_file_section
+        body = "\n".join(render_section(path, content) for path, content in sections)
+        if self.kind == 'zip':
+            return f"--- Provided ZIP Content: {self.name} ---\n{body}\n--- End ZIP Content ---"
+        return f"--- Provided File: {self.name} ---\n```\n{body}\n```\n--- End File: {self.name} ---"
+
+
+class PackResult:
+    def __init__(self, parts: List[str], manifest: Optional[str], tokens_before: int, tokens_packed: int, budget: int):
+        self.parts = parts
+        self.manifest = manifest
+        self.tokens_before = tokens_before
+        self.tokens_packed = tokens_packed
+        self.tokens_saved = max(0, tokens_before - tokens_packed)
+        self.budget = budget
+
+    def headers(self) -> Dict[str, str]:
+        return {
+            "X-Context-Tokens-Packed": str(self.tokens_packed),
+            "X-Context-Tokens-Saved": str(self.tokens_saved),
+            "X-Context-Token-Budget": str(self.budget),
+        }
+
+
+def _prompt_terms(prompt: str) -> set:
+    return {w.lower() for w in WORD.findall(prompt)} - STOPWORDS
+
+
+def _term_patterns(terms: set) -> Dict[str, "re.Pattern"]:
+    # A term counts only as a whole identifier, the same words WORD would find
+    return {term: re.compile(rf"(?<![A-Za-z0-9_]){re.escape(term)}(?![A-Za-z0-9_])") for term in terms}
+
+
+def file_extension(path: str) -> str:
+    name = path.rsplit('/', 1)[-1].lower()
+    for double in ('.min.js', '.min.css'):
+        if name.endswith(double):
+            return double
+    if name == 'dockerfile':
+        return '.dockerfile'
+    return os.path.splitext(name)[1]
+
+
+def _priority(source: ContextSource, path: str, content: str, terms: Dict[str, "re.Pattern"]) -> float:
+    ext = file_extension(path)
+    if ext in SOURCE_EXTENSIONS:
+        score = 3.0
+    elif ext in LOW_VALUE_EXTENSIONS:
+        score = 0.0
+    elif ext in CONFIG_EXTENSIONS:
+        score = 1.5
+    else:
+        score = 1.0
+    if source.kind == 'file':
+        score += 5.0  # attached on purpose by the user
+    if terms:
+        path_words = {w.lower() for w in WORD.findall(path)}
+        score += 4.0 * len(terms.keys() & path_words)
+        # A substring test rules out most terms; only the remaining ones need the identifier check
+        head = content[:PRIORITY_SCAN_CHARS].lower()
+        found = sum(1 for term, pattern in terms.items() if term in head and pattern.search(head))
+        score += 2.0 * found / len(terms)
+    if '/test' in f"/{path}" or 'vendor/' in path or 'third_party/' in path:
+        score -= 1.0
+    return score
+
+
+def _outline(content: str, max_tokens: int) -> Optional[str]:
+    # Gives up as soon as the kept lines alone no longer fit (a character is at least one byte)
+    max_chars = max_tokens * BYTES_PER_TOKEN
+    if max_chars <= len(OUTLINE_NOTICE_MIN):
+        return None
+    lines = content.split('\n')
+    kept, used = [], 0
+    for line in lines:
+        if line.lstrip().startswith(OUTLINE_PREFIXES) and OUTLINE_LINE.match(line):
+            kept.append(line)
+            used += len(line) + 1
+            if used > max_chars:
+                return None
+    if not kept:
+        return None
+    text = f"[Outline only: {len(kept)} of {len(lines)} lines shown]\n" + "\n".join(kept)
+    return text if estimate_tokens(text) <= max_tokens else None
+
+
+def _head(content: str, max_tokens: int) -> Optional[str]:
+    # Every kept line costs at least one token, so no more than max_tokens lines are split off
+    if max_tokens < HEAD_MIN_LINES:
+        return None
+    lines = content.split('\n', max_tokens)
+    kept, used = [], 0
+    for line in lines:
+        cost = estimate_tokens(line) + 1
+        if used + cost > max_tokens:
+            break
+        kept.append(line)
+        used += cost
+    if len(kept) < HEAD_MIN_LINES:
+        return None
+    total_lines = content.count('\n') + 1
+    return f"[Truncated: first {len(kept)} of {total_lines} lines shown]\n" + "\n".join(kept)
+
+
+def _manifest(included: List[str], degraded: Dict[str, List[str]], budget: int, tokens_packed: int, tokens_before: int) -> str:
+    lines = [
+        "--- Context Manifest ---",
+        f"The attached context ({tokens_before} estimated tokens) exceeded the budget of {budget} tokens "
+        f"and was packed to {tokens_packed} tokens. {len(included)} files are included in full.",
+    ]
+    shown = 0
+    for label, paths in (("Outlined", degraded['outline']), ("Truncated", degraded['head']), ("Omitted", degraded['omitted'])):
+        if not paths:
+            continue
+        listed = paths[:max(0, MANIFEST_MAX_ENTRIES - shown)]
+        shown += len(listed)
+        more = f" ... and {len(paths) - len(listed)} more" if len(listed) < len(paths) else ""
+        lines.append(f"{label} ({len(paths)}): " + ", ".join(listed) + more)
+    lines.append("--- End Context Manifest ---")
+    return "\n".join(lines)
+
+
+def pack_context(sources: List[ContextSource], prompt: str, model: str, fixed_tokens: int = 0) -> PackResult:
+    # Fits the attachments into the model's context budget. Below the budget everything passes through
+    # unchanged; above it, files are ranked by relevance to the prompt and by type, and the lowest ranked
+    # ones are reduced to outlines, truncated heads, or only a line in the manifest.
+    budget = max(0, context_budget(model) - fixed_tokens)
+    rendered = [source.render() for source in sources]
+    tokens_before = sum(estimate_tokens(text) for text in rendered)
+    if tokens_before <= budget:
+        return PackResult(rendered, None, tokens_before, tokens_before, budget)
+
+    terms = _term_patterns(_prompt_terms(prompt))
+    # Framing (headers, fences, paths) is always kept
+    framing = sum(estimate_tokens(source.render([(path, "") for path, _ in source.sections])) for source in sources)
+    remaining = budget - framing - 2_000  # room for the manifest
+    per_file_cap = max(1, int(budget * MAX_FILE_SHARE))
+
+    ranked = []
+    for s_index, source in enumerate(sources):
+        if source.binary:
+            continue
+        for f_index, (path, content) in enumerate(source.sections):
+            ranked.append((_priority(source, path, content, terms), s_index, f_index, path, content))
+    # Duplicate references go last: whether one can stay a reference depends on how its first copy was packed
+    ranked.sort(key=lambda item: (item[2] in sources[item[1]].duplicates, -item[0], item[1], item[2]))
+
+    packed: Dict[Tuple[int, int], Optional[str]] = {}
+    included: List[str] = []
+    degraded: Dict[str, List[str]] = {'outline': [], 'head': [], 'omitted': []}
+    full_copies: Dict[str, str] = {}  # first copy location -> location of a copy that was kept in full
+    for _, s_index, f_index, path, content in ranked:
+        source = sources[s_index]
+        location = source.location(path)
+        duplicate = source.duplicates.get(f_index)
+        if duplicate is not None:
+            location, original = duplicate
+            full_copy = full_copies.get(location)
+            if full_copy is not None:
+                content = duplicate_reference(full_copy)
+                packed[(s_index, f_index)] = content
+                included.append(path)
+                remaining -= estimate_tokens(content)
+                continue
+            # The first copy was reduced or omitted: this copy is packed like any other file
+            content = original
+        tokens = estimate_tokens(content)
+        allowance = min(per_file_cap, remaining)
+        if tokens <= allowance:
+            packed[(s_index, f_index)] = content
+            included.append(path)
+            remaining -= tokens
+            full_copies.setdefault(location, source.location(path))
+            continue
+        reduced = _outline(content, allowance)
+        kind = 'outline'
+        if reduced is None:
+            reduced = _head(content, allowance)
+            kind = 'head'
+        if reduced is None:
+            packed[(s_index, f_index)] = None
+            degraded['omitted'].append(path)
+            continue
+        packed[(s_index, f_index)] = reduced
+        degraded[kind].append(path)
+        remaining -= estimate_tokens(reduced)
+
+    parts = []
+    for s_index, source in enumerate(sources):
+        if source.binary:
+            parts.append(source.render())
+            continue
+        sections = [
+            (path, packed[(s_index, f_index)])
+            for f_index, (path, _) in enumerate(source.sections)
+            if packed.get((s_index, f_index)) is not None
+        ]
+        if sections or source.kind != 'file':
+            parts.append(source.render(sections))
+
+    tokens_packed = sum(estimate_tokens(text) for text in parts)
+    manifest = _manifest(included, degraded, budget, tokens_packed, tokens_before)
+    tokens_packed += estimate_tokens(manifest)
+    return PackResult(parts, manifest, tokens_before, tokens_packed, budget)
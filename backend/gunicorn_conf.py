@@ -2,3 +2,9 @@ bind = "unix:/tmp/gunicorn_gemini_gateway.sock"
 workers = 3
 worker_class = "uvicorn.workers.UvicornWorker"
 daemon = False
+
+
+def child_exit(server, worker):
+    # Fold the metrics of a worker that exited into the host-wide totals served by /metrics
+    from metrics import registry
+    registry.mark_process_dead(worker.pid)
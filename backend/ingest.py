@@ -0,0 +1,180 @@
+import hashlib
+import os
+import re
+import zipfile
+from typing import BinaryIO, Iterable, List, Optional, Tuple
+
+import pathspec
+
+# --- Ignore Rules ---
+DEFAULT_IGNORE = [
+    '.git/', 'node_modules/', '__pycache__/', 'venv/', 'env/', 'build/', 'dist/',
+    '.out/', '*.log', 'npm-debug.log*', 'yarn-debug.log*', 'yarn-error.log*',
+    '.vscode/', '.idea/', '.DS_Store', 'package-lock.json', 'yarn.lock',
+    'pnpm-lock.yaml', 'poetry.lock', '.env', '.env.*', '!/.env.example'
+]
+MAX_FILE_SIZE = 10 * 1024 * 1024
+BINARY_SNIFF_BYTES = 8000
+BINARY_PLACEHOLDER = "[Binary file, content not displayed]"
+
+# Zip bomb guardrails for uploaded archives (uploads are expected to be 50-100 MB)
+ZIP_MAX_TOTAL_UNCOMPRESSED = int(os.environ.get("ZIP_MAX_TOTAL_UNCOMPRESSED", str(512 * 1024 * 1024)))
+ZIP_MAX_COMPRESSION_RATIO = int(os.environ.get("ZIP_MAX_COMPRESSION_RATIO", "200"))
+# Small members are cheap to inflate whatever their ratio (a file of blank lines easily reaches 1000:1),
+# so the ratio of a member, and of the whole archive, is only checked from this uncompressed size up
+ZIP_RATIO_CHECK_MIN_BYTES = int(os.environ.get("ZIP_RATIO_CHECK_MIN_BYTES", str(1024 * 1024)))
+
+# Bump RENDER_FORMAT_VERSION whenever the rendered text of a repository or archive (render_content,
+# render_file_section) changes, so cached dumps made with the old rules are not served anymore.
+RENDER_FORMAT_VERSION = "3"
+IGNORE_RULES_VERSION = hashlib.sha256(
+    "\n".join([RENDER_FORMAT_VERSION, str(MAX_FILE_SIZE), *DEFAULT_IGNORE]).encode('utf-8')
+).hexdigest()[:16]
+
+
+def ignore_patterns(gitignore_lines: Iterable[str] = ()) -> List[str]:
+    patterns = list(DEFAULT_IGNORE)
+    patterns.extend(gitignore_lines)
+    return patterns
+
+
+def build_ignore_spec(gitignore_lines: Iterable[str] = ()) -> pathspec.PathSpec:
+    return pathspec.PathSpec.from_lines('gitwildmatch', ignore_patterns(gitignore_lines))
+
+
+def is_binary(head: bytes) -> bool:
+    # Same heuristic git uses: a NUL byte in the first few KB means binary
+    return b'\0' in head
+
+
+def decode_text(data: bytes) -> str:
+    # Same result as open(..., 'r', encoding='utf-8', errors='ignore').read(), including newline translation
+    text = data.decode('utf-8', errors='ignore')
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+
+def render_content(data: bytes) -> str:
+    if is_binary(data[:BINARY_SNIFF_BYTES]):
+        return BINARY_PLACEHOLDER
+    return decode_text(data)
+
+
+def render_file_section(relative_path: str, content: str) -> str:
+    return f"---\nFile: {relative_path}\nContent:\n```\n{content}\n```"
+
+
+def render_compact_section(relative_path: str, content: str) -> str:
+    # Opt-in framing for prompts (the `head` multi-file convention): same paths, fewer tokens per file.
+    # Repository dumps and caches always use render_file_section.
+    return f"==> {relative_path} <==\n{content}"
+
+
+class ZipLimitError(ValueError):
+    pass
+
+
+def _zip_member_path(name: str) -> Optional[str]:
+    # Normalises a member name to a relative posix path; None for entries we never read
+    path = name.replace('\\', '/').lstrip('/')
+    parts = [p for p in path.split('/') if p not in ('', '.')]
+    if not parts or parts[0] == '__MACOSX' or '..' in parts:
+        return None
+    return '/'.join(parts)
+
+
+def _zip_common_root(paths: List[str]) -> str:
+    # Virtual version of "extract, then use os.path.commonpath if it is a directory":
+    # returns the shared leading directory (with a trailing slash) or '' if there is none
+    split_paths = [p.split('/') for p in paths]
+    common = split_paths[0][:-1]
+    for parts in split_paths[1:]:
+        dirs = parts[:-1]
+        i = 0
+        while i < len(common) and i < len(dirs) and common[i] == dirs[i]:
+            i += 1
+        common = common[:i]
+    return '/'.join(common) + '/' if common else ''
+
+
+def zip_file_sections(zip_file: BinaryIO) -> List[Tuple[str, str]]:
+    # (relative_path, content) for every member that is not ignored, in the byte-wise path order of
+    # `git ls-tree -r`, so an archive renders like the same tree cloned through repo_mirror.py
+    with zipfile.ZipFile(zip_file) as archive:
+        members = {}
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            path = _zip_member_path(info.filename)
+            if path is not None:
+                members[path] = info
+        if not members:
+            return []
+
+        root = _zip_common_root(list(members))
+        members = {path[len(root):]: info for path, info in members.items()}
+
+        gitignore_lines = []
+        if '.gitignore' in members:
+            gitignore_lines = decode_text(archive.read(members['.gitignore'])).splitlines()
+        spec = build_ignore_spec(gitignore_lines)
+
+        selected = []
+        total_uncompressed = 0
+        total_compressed = 0
+        for rel_path in sorted(members, key=lambda p: p.encode('utf-8', errors='surrogateescape')):
+            info = members[rel_path]
+            if spec.match_file(rel_path):
+                continue
+            if info.file_size > MAX_FILE_SIZE:
+                print(f"Skipping large file {rel_path}")
+                continue
+            if (info.file_size >= ZIP_RATIO_CHECK_MIN_BYTES and info.compress_size
+                    and info.file_size / info.compress_size > ZIP_MAX_COMPRESSION_RATIO):
+                raise ZipLimitError(f"Archive member {rel_path} has a suspicious compression ratio ({info.file_size // info.compress_size}:1).")
+            total_uncompressed += info.file_size
+            total_compressed += info.compress_size
+            if total_uncompressed > ZIP_MAX_TOTAL_UNCOMPRESSED:
+                raise ZipLimitError(f"Archive expands to more than {ZIP_MAX_TOTAL_UNCOMPRESSED // (1024 * 1024)} MB.")
+            selected.append((rel_path, info))
+        # Many members just below the per-member threshold add up to a bomb all the same
+        if (total_uncompressed >= ZIP_RATIO_CHECK_MIN_BYTES and total_compressed
+                and total_uncompressed / total_compressed > ZIP_MAX_COMPRESSION_RATIO):
+            raise ZipLimitError(f"Archive has a suspicious compression ratio ({total_uncompressed // total_compressed}:1).")
+
+        sections = []
+        for rel_path, info in selected:
+            try:
+                with archive.open(info) as member:
+                    # zipfile stops at the declared file_size and checks the CRC, so a member
+                    # cannot expand past the limits checked above. Binary members are only
+                    # inflated as far as the sniffed head.
+                    head = member.read(BINARY_SNIFF_BYTES)
+                    if is_binary(head):
+                        sections.append((rel_path, BINARY_PLACEHOLDER))
+                        continue
+                    data = head + member.read()
+                sections.append((rel_path, decode_text(data)))
+            except (zipfile.BadZipFile, NotImplementedError, RuntimeError) as e:
+                print(f"Could not read archive member {rel_path}: {e}")
+    return sections
+
+
+_SECTION_START = re.compile(r"^---\nFile: (.*)\nContent:\n```\n", re.MULTILINE)
+
+
+def split_repository_dump(text: str) -> List[Tuple[str, str]]:
+    # Inverse of joining render_file_section() outputs: (relative_path, content) per file.
+    # Returns [] if the text does not look like a repository dump.
+    starts = [m for m in _SECTION_START.finditer(text) if m.start() == 0 or text[m.start() - 1] == '\n']
+    if not starts or starts[0].start() != 0:
+        return []
+    sections = []
+    for i, match in enumerate(starts):
+        end = starts[i + 1].start() - 1 if i + 1 < len(starts) else len(text)
+        body = text[match.end():end]
+        if not body.endswith("\n```"):
+            return []
+        sections.append((match.group(1), body[:-4]))
+    return sections
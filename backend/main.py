@@ -1,21 +1,34 @@
+import asyncio
 import os
 import re
+import time
 import zipfile
-import tempfile
-import subprocess
-import json
-from pathlib import Path
-from typing import List, Any
-
-import google.generativeai as genai
-import pathspec
+from typing import Any, Callable, List, Optional, Tuple
+
 from google.api_core import exceptions as google_exceptions
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 
 # import our toolset from tools.py
-from tools import response_tools, ALL_TOOL_NAMES
+from tools import STREAMING_INSTRUCTION, STREAMING_TOOL_CONFIG, TOOL_CONFIG, response_tools
+from cache_store import open_cache_store
+from context_assembly import assemble_context
+from clone_jobs import CloneJobs
+from context_cache import ContextCacheRegistry
+from context_packer import ContextSource, context_budget, estimate_tokens, pack_context
+from ingest import IGNORE_RULES_VERSION, RENDER_FORMAT_VERSION, ZipLimitError, split_repository_dump, zip_file_sections
+from metrics import CONTEXT_TOKENS, INGESTED_BYTES, INGESTED_FILES, MetricsMiddleware, registry as metrics_registry
+from model_pool import model_pool
+from prompt_refiner import refine_prompt_for_coding, refined_prompts
+from repo_cache import RepoCache
+from repo_mirror import RepoMirror
+from response_blocks import blocks_from_response, replay_blocks, sse_event, stream_blocks
+from response_cache import ResponseCache, upload_digest
+from sharding import ShardingError, run_map_phase, split_into_shards
+from stage_timings import StageTimings, server_timing
+from upstream import ScheduledModel, UpstreamBusy, upstream
 
 # --- FastAPI App Initialization & CORS ---
 app = FastAPI()
@@ -23,7 +36,7 @@ app = FastAPI()
 origins = [
     "http://localhost:5173",
     "http://127.0.0.1:5173",
-    ""https://angryflaren.github.io/gemini-gateway/" ",
+    "https://angryflaren.github.io",
 ]
 
 
@@ -34,6 +47,18 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Request durations by route and status for /metrics
+app.add_middleware(MetricsMiddleware)
+
+# Shared by all workers on the host (see cache_store.py)
+cache_store = open_cache_store()
+# Parsed uploads are only reused by re-submits and follow-up turns, so they expire like generated answers do
+ZIP_CACHE_TTL = int(os.environ.get("ZIP_CACHE_TTL", "3600"))
+repo_cache = RepoCache(cache_store)
+repo_mirror = RepoMirror()
+clone_jobs = CloneJobs(repo_mirror, repo_cache)
+context_cache = ContextCacheRegistry()
+response_cache = ResponseCache(cache_store)
 
 # --- Pydantic Models ---
 class RepoRequest(BaseModel):
@@ -41,17 +66,6 @@ class RepoRequest(BaseModel):
 
 # --- Helper Functions ---
 
-def recursive_to_dict(obj: Any) -> Any:
-    # FIXED: Added a check for None to avoid errors
-    if obj is None:
-        return None
-    if hasattr(obj, 'items'):
-        return {key: recursive_to_dict(value) for key, value in obj.items()}
-    elif isinstance(obj, (list, tuple)) or (hasattr(obj, '__iter__') and not isinstance(obj, (str, bytes))):
-        return [recursive_to_dict(item) for item in obj]
-    else:
-        return obj
-
 def load_system_prompt():
     try:
         with open("prompt.xml", "r", encoding="utf-8") as f:
@@ -60,235 +74,359 @@ def load_system_prompt():
         print("WARNING: prompt.xml not found. Using a basic fallback prompt.")
         return "You are a helpful programming assistant."
 
-def process_repository_to_text(repo_path_str: str) -> str:
-    repo_path = Path(repo_path_str)
-    output_parts = []
-    default_ignore = [
-        '.git/', 'node_modules/', '__pycache__/', 'venv/', 'env/', 'build/', 'dist/',
-        '.out/', '*.log', 'npm-debug.log*', 'yarn-debug.log*', 'yarn-error.log*',
-        '.vscode/', '.idea/', '.DS_Store', 'package-lock.json', 'yarn.lock',
-        'pnpm-lock.yaml', 'poetry.lock', '.env', '.env.*', '!/.env.example'
-    ]
-    patterns = default_ignore
-    gitignore_path = repo_path / '.gitignore'
-    if gitignore_path.is_file():
-        try:
-            with open(gitignore_path, 'r', encoding='utf-8') as f:
-                patterns.extend(f.read().splitlines())
-        except Exception as e:
-            print(f"Could not read .gitignore file: {e}")
-    spec = pathspec.PathSpec.from_lines('gitwildmatch', patterns)
-    for file_path in repo_path.rglob('*'):
-        if not file_path.is_file(): continue
-        try:
-            relative_path_for_spec = file_path.relative_to(repo_path)
-            if spec.match_file(str(relative_path_for_spec).replace('\\', '/')): continue
-            if file_path.stat().st_size > 10 * 1024 * 1024:
-                print(f"Skipping large file {file_path}")
-                continue
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
-            relative_path_for_output = file_path.relative_to(repo_path)
-            output_parts.append(f"---\nFile: {relative_path_for_output.as_posix()}\nContent:\n```\n{content}\n```")
-        except Exception as e:
-            print(f"Could not read file {file_path}: {e}")
-    return "\n".join(output_parts)
-
-
-async def refine_prompt_for_coding(api_key: str, user_prompt: str, refiner_model_id: str) -> str:
-    if len(user_prompt.strip()) < 2:
-        return user_prompt
-    refiner_system_prompt = """
-# System Prompt: Smart Query Builder
-# Role
-You are a Smart Query Builder. Your job is to take a user's question and make it better. The new question should be a perfect instruction for another AI, the "Gemini Architect". Your new question must keep the user's idea. But it should also make it better, so the other AI gives a very good answer. The answer should be correct, secure, and clear.
-# VERY IMPORTANT RULES
-- **Keep the Meaning (Top Priority):** The new question MUST mean the same thing as the user's question. Keep all special words and rules. Do not lose any information.
-- **Same Language:** The output language MUST be the same as the input language. Do not translate.
-- **Make the Idea Better (Main Job):**
-  - **Find the Real Goal:** Look at the user's question to understand what they really want to do.
-  - **Improve the Request:** If the question is simple (like "how to do X"), change it to ask for a solution that is ready for real use, strong, and has good explanations.
-  - **Ask for More Details:** If the question is about code, change it to ask the AI to check for security problems, special cases, and good ways to build the code.
-  - **Keep it Simple for Simple Questions:** If the user asks a small, easy question (like "what is a for-loop in Python?"), just make the question clean and direct. Do not make small questions too big.
-- **Only the New Question:** Your output MUST BE only the new question text. No "hello", no "sorry", no extra words, no markdown.
-- **Do Nothing Protocol:** If the question is not about tech, is just talking, or is not clear (like "hello", "thank you"), return it exactly as it is.
-# Your Process
-1.  **Understand:** Read the user's question and find their real goal.
-2.  **Build the New Question:** Make a new, better question. Write it like instructions for an expert AI. Tell it to check its work and explain why it chose its solution.
-3.  **Final Check:** Make sure the new question is clean, clear, and ready for the next AI model.
-"""
+# --- API Endpoints ---
+def parse_github_url(repo_url: str):
+    match = re.search(r"github\.com/([^/]+/[^/]+?)(?:\.git|/tree/([^/]+)|/*$)", repo_url)
+    if not match:
+        raise HTTPException(status_code=400, detail="Could not parse GitHub URL.")
+    repo_path = match.group(1)
+    branch = match.group(2)
+    safe_repo_path = repo_path.replace('/', '---')
+    repo_name_for_file = f"gh_repo:::{safe_repo_path}"
+    clone_url = f"https://github.com/{repo_path}.git"
+    return repo_path, branch, clone_url, repo_name_for_file
+
+
+@app.post("/api/clone_repo")
+async def clone_repo(repo_request: RepoRequest, response: Response):
+    repo_path, branch, clone_url, repo_name_for_file = parse_github_url(repo_request.url)
+    job_id = clone_jobs.submit(repo_path, branch, clone_url, repo_name_for_file)
     try:
-        genai.configure(api_key=api_key)
-        refiner_model = genai.GenerativeModel(refiner_model_id)
-        full_prompt = f"{refiner_system_prompt}\n\nUser prompt to refine:\n\"{user_prompt}\""
-        response = await refiner_model.generate_content_async(full_prompt)
-        refined_text = response.text.strip()
-        return refined_text if refined_text else user_prompt
+        processed_text = await clone_jobs.wait(job_id)
+        timings = (clone_jobs.status(job_id) or {}).get('timings')
+        if timings:
+            response.headers["Server-Timing"] = server_timing(timings)
+        return {"repo_name": repo_name_for_file, "processed_text": processed_text}
+    except Exception:
+        status = clone_jobs.status(job_id) or {}
+        raise HTTPException(status_code=status.get('error_code', 500), detail=status.get('error', "An unexpected error occurred."))
+
+
+@app.post("/api/clone_jobs")
+async def start_clone_job(repo_request: RepoRequest):
+    # Non-blocking variant of /api/clone_repo: returns a job id to poll or stream
+    repo_path, branch, clone_url, repo_name_for_file = parse_github_url(repo_request.url)
+    job_id = clone_jobs.submit(repo_path, branch, clone_url, repo_name_for_file)
+    return clone_jobs.status(job_id)
+
+
+@app.get("/api/clone_jobs/{job_id}")
+async def get_clone_job(job_id: str):
+    status = clone_jobs.status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown clone job.")
+    if status['status'] == "done":
+        processed_text = await clone_jobs.result(job_id)
+        if processed_text is None:
+            raise HTTPException(status_code=410, detail="The result of this clone job is no longer available. Please clone again.")
+        return {**status, "processed_text": processed_text}
+    return status
+
+
+@app.get("/api/clone_jobs/{job_id}/events")
+async def stream_clone_job(job_id: str):
+    if clone_jobs.status(job_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown clone job.")
+
+    async def progress_events():
+        last_stage = None
+        while True:
+            status = clone_jobs.status(job_id)
+            if status is None:
+                return
+            if status['status'] != last_stage:
+                last_stage = status['status']
+                yield sse_event("progress", status)
+            if last_stage in ("done", "failed"):
+                return
+            await asyncio.sleep(0.25)
+
+    return StreamingResponse(
+        progress_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.get("/api/clone_repo/cache")
+async def clone_repo_cache_stats():
+    return {**repo_cache.stats(), **repo_mirror.stats(), **clone_jobs.stats(), "store": await asyncio.to_thread(cache_store.stats)}
+
+
+@app.get("/api/generate/context_cache")
+async def context_cache_stats():
+    return {**context_cache.stats(), **model_pool.stats()}
+
+
+@app.get("/api/generate/response_cache")
+async def response_cache_stats():
+    return {**response_cache.stats(), "store": await asyncio.to_thread(cache_store.stats)}
+
+
+@app.get("/api/generate/upstream")
+async def upstream_stats():
+    return upstream.stats()
+
+
+@app.get("/api/generate/refined_prompts")
+async def refined_prompt_stats():
+    return refined_prompts.stats()
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    # Summed over all workers on the host (see metrics.py)
+    return PlainTextResponse(await asyncio.to_thread(metrics_registry.collect), media_type="text/plain; version=0.0.4")
+
+
+async def zip_sections_cached(file: UploadFile, digest: Optional[str]) -> List[Tuple[str, str]]:
+    # Parsed archives are shared by all workers, keyed by the archive's content hash and the rendering rules
+    if digest is None:
+        digest = await asyncio.to_thread(upload_digest, file.file)
+    key = f"{digest}:{RENDER_FORMAT_VERSION}:{IGNORE_RULES_VERSION}"
+    sections = await asyncio.to_thread(cache_store.get_json, "zip", key)
+    if sections is not None:
+        return [(path, content) for path, content in sections]
+    await file.seek(0)
+    sections = await asyncio.to_thread(zip_file_sections, file.file)
+    try:
+        await asyncio.to_thread(cache_store.put_json, "zip", key, sections, ZIP_CACHE_TTL)
     except Exception as e:
-        print(f"Could not refine prompt due to an error: {e}. Using original prompt.")
-        return user_prompt
+        print(f"Could not store parsed ZIP in cache: {e}")
+    return sections
 
 
-# --- API Endpoints ---
-@app.post("/api/clone_repo")
-async def clone_repo(repo_request: RepoRequest):
-    with tempfile.TemporaryDirectory() as temp_dir:
-        repo_url = repo_request.url
-        match = re.search(r"github\.com/([^/]+/[^/]+?)(?:\.git|/tree/([^/]+)|/*$)", repo_url)
-        if not match:
-            raise HTTPException(status_code=400, detail="Could not parse GitHub URL.")
-        repo_path = match.group(1)
-        branch = match.group(2)
-        safe_repo_path = repo_path.replace('/', '---')
-        repo_name_for_file = f"gh_repo:::{safe_repo_path}"
-        clone_url = f"https://github.com/{repo_path}.git"
-        command = ["git", "clone", "--depth", "1"]
-        if branch:
-            command.extend(["--branch", branch])
-        command.extend([clone_url, temp_dir])
+async def read_upload(file: UploadFile, digest: Optional[str] = None) -> ContextSource:
+    filename = file.filename
+    try:
+        if filename.endswith('.zip'):
+            # Read members straight from the spooled upload instead of loading it into memory and extracting it
+            try:
+                sections = await zip_sections_cached(file, digest)
+                INGESTED_FILES.inc(len(sections), source='zip')
+                INGESTED_BYTES.inc(file.size or 0, source='zip')
+                return ContextSource(filename, 'zip', sections)
+            except ZipLimitError as e:
+                raise HTTPException(status_code=413, detail=f"{filename}: {e}")
+            except zipfile.BadZipFile as e:
+                raise HTTPException(status_code=400, detail=f"{filename} is not a valid ZIP archive: {e}")
+
+        contents = await file.read()
+        INGESTED_BYTES.inc(len(contents), source='file')
         try:
-            subprocess.run(command, check=True, capture_output=True, text=True)
-            processed_text = process_repository_to_text(temp_dir)
-            return {"repo_name": repo_name_for_file, "processed_text": processed_text}
-        except subprocess.CalledProcessError as e:
-            raise HTTPException(status_code=400, detail=f"Failed to clone repository: {e.stderr}")
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+            # FIXED: Added decoding error handling
+            decoded_contents = contents.decode('utf-8')
+        except UnicodeDecodeError:
+            INGESTED_FILES.inc(source='file')
+            return ContextSource(filename, 'file', [], binary=True)
+        # Repository dumps from /api/clone_repo come back as text files; split them so they can be packed per file
+        repo_sections = split_repository_dump(decoded_contents) if filename.startswith('gh_repo:::') else []
+        INGESTED_FILES.inc(len(repo_sections) or 1, source='file')
+        if repo_sections:
+            return ContextSource(filename, 'repo', repo_sections)
+        return ContextSource(filename, 'file', [(filename, decoded_contents)])
+    finally:
+        await file.close()
 
 
 @app.post("/api/generate")
 async def generate_response(
+    response: Response,
     apiKey: str = Form(...),
     prompt: str = Form(...),
     model: str = Form(...),
     refinerModel: str = Form(...),
-    files: List[UploadFile] = File(default=[])
+    files: List[UploadFile] = File(default=[]),
+    stream: bool = Form(False),
+    sharded: bool = Form(False),
+    noCache: bool = Form(False),
+    compactContext: bool = Form(False)
 ):
-    system_prompt = load_system_prompt()
-    prompt_parts: List[Any] = [system_prompt]
-    
-    refined_prompt = await refine_prompt_for_coding(apiKey, prompt, refinerModel)
-    prompt_parts.append(f"\n\nUser Request: {refined_prompt}\n\n")
+    timings = StageTimings("generate")
+    if noCache:
+        response.headers["X-Response-Cache"] = "bypass"
+        return await run_generation(
+            response, apiKey, prompt, model, refinerModel, files, stream, sharded, compact=compactContext, timings=timings
+        )
 
-    for file in files:
-        contents = await file.read()
-        filename = file.filename
-        
-        if filename.endswith('.zip'):
-            with tempfile.TemporaryDirectory() as temp_dir:
-                zip_path = os.path.join(temp_dir, filename)
-                with open(zip_path, 'wb') as f:
-                    f.write(contents)
-                
-                unzip_dir = os.path.join(temp_dir, 'unzipped')
-                os.makedirs(unzip_dir, exist_ok=True)
-                with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                    zip_ref.extractall(unzip_dir)
-                
-                # FIXED: Improved logic for finding the root folder
-                # Instead of guessing, we find the common prefix for all files, which is much more reliable.
-                all_paths = [os.path.join(unzip_dir, f) for f in zip_ref.namelist() if not f.startswith('__MACOSX')]
-                if not all_paths:
-                     # If the archive is empty or contains only system folders
-                    processed_text = ""
-                else:
-                    # Find the common root path
-                    common_prefix = os.path.commonpath(all_paths)
-                    # If the common prefix is the extraction folder itself, use it.
-                    # If there is one common folder inside, use it.
-                    repo_content_path = common_prefix if os.path.isdir(common_prefix) else unzip_dir
-                    processed_text = process_repository_to_text(repo_content_path)
-
-                prompt_parts.append(f"--- Provided ZIP Content: {filename} ---\n{processed_text}\n--- End ZIP Content ---")
-
-        else:
-            try:
-                # FIXED: Added decoding error handling
-                decoded_contents = contents.decode('utf-8')
-                prompt_parts.append(f"--- Provided File: {filename} ---\n```\n{decoded_contents}\n```\n--- End File: {filename} ---")
-            except UnicodeDecodeError:
-                prompt_parts.append(f"--- Provided File: {filename} ---\n[Binary file, content not displayed]\n--- End File: {filename} ---")
+    # Re-submits of the same request (page refresh, double click) are answered from the response cache
+    started_at = time.perf_counter()
+    system_prompt = await asyncio.to_thread(load_system_prompt)
+    file_digests = [(file.filename, await asyncio.to_thread(upload_digest, file.file)) for file in files]
+    cache_key = ResponseCache.make_key(apiKey, model, refinerModel, prompt, system_prompt, sharded, file_digests, compactContext)
+    timings.record("cache_key", time.perf_counter() - started_at)
 
-        
-        await file.close()
+    cached_blocks = await timings.run("response_cache", response_cache.get(cache_key))
+    if cached_blocks is None and (not stream or response_cache.inflight(cache_key)):
+        # Identical requests already in flight share one upstream call; streams only join a running one
+        cached_blocks, cache_status = await response_cache.run(
+            cache_key, lambda: run_generation(
+                response, apiKey, prompt, model, refinerModel, files, False, sharded, compact=compactContext,
+                digests=[digest for _, digest in file_digests], timings=timings
+            )
+        )
+    elif cached_blocks is not None:
+        cache_status = "hit"
+    else:
+        cache_status = "miss"
 
-    try:
-        genai.configure(api_key=apiKey)
-        
-        generation_model = genai.GenerativeModel(
-            model_name=model,
-            tools=[response_tools]
+    if cached_blocks is None:
+        return await run_generation(
+            response, apiKey, prompt, model, refinerModel, files, stream, sharded, compact=compactContext,
+            on_complete=lambda blocks: response_cache.store_later(cache_key, blocks),
+            extra_headers={"X-Response-Cache": cache_status}, digests=[digest for _, digest in file_digests],
+            timings=timings
         )
-        
-        response = await generation_model.generate_content_async(
-            prompt_parts,
-            tool_config={"function_calling_config": "ANY"}
+    for file in files:
+        await file.close()
+    response.headers["X-Response-Cache"] = cache_status
+    response.headers["Server-Timing"] = timings.header()
+    if stream:
+        return StreamingResponse(
+            replay_blocks(cached_blocks, started_at),
+            media_type="text/event-stream",
+            headers={
+                "Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Response-Cache": cache_status,
+                "Server-Timing": timings.header(),
+            }
         )
-        
-        part = response.candidates[0].content.parts[0]
-        
-        if not hasattr(part, 'function_call') or not part.function_call.name:
-            if hasattr(response, 'text') and response.text:
-                return [{"type": "text", "content": response.text}]
-            return [{"type": "text", "content": "Error: Model returned an empty response without a function call."}]
-
-        final_parts = []
-        function_name = part.function_call.name
-        function_args = recursive_to_dict(part.function_call.args)
-
-        if function_name == "generate_structured_response":
-            # FIXED: We now check each block inside 'parts'
-            raw_parts = function_args.get('parts', [])
-            if isinstance(raw_parts, list):
-                for p in raw_parts:
-                    # We check that 'p' is a dictionary and has a 'type' key
-                    if isinstance(p, dict) and 'type' in p:
-                        final_parts.append(p)
-                    else:
-                        print(f"Warning: Skipping malformed part in structured response: {p}")
-            else:
-                 print(f"Warning: 'parts' in structured response is not a list: {raw_parts}")
-
-        elif function_name in ALL_TOOL_NAMES:
-            # FIXED: Added basic validation for simple tools
-            block_type = function_name.replace('make_', '')
-            is_valid = True
-            if block_type == 'list' and not isinstance(function_args.get('items'), list):
-                is_valid = False
-            elif 'content' not in function_args: # Most other tools require 'content'
-                is_valid = False
-
-            if is_valid:
-                new_part = {"type": block_type, **function_args}
-                final_parts.append(new_part)
-            else:
-                print(f"Warning: AI called function '{function_name}' with invalid args: {function_args}")
-        else:
-            return [{"type": "code", "language": "error", "content": f"AI called an unexpected function: {function_name}\n\nArguments: {json.dumps(function_args, indent=2)}"}]
-        
-        if not final_parts:
-            # FIXED: Return the original response text if nothing is left after processing
-            if hasattr(response, 'text') and response.text:
-                return [{"type": "text", "content": f"[Fallback Content]\n{response.text}"}]
-            return [{"type": "text", "content": "AI response was empty or malformed after processing the function call."}]
-        
-        supported_types = {'title', 'heading', 'subheading', 'annotated_heading', 'quote_heading', 'text', 'code', 'math', 'list'}
-        filtered_parts = [
-            p for p in final_parts
-            if isinstance(p, dict) and p.get('type') in supported_types
-        ]
-
-        if not filtered_parts and final_parts:
-            print(f"Warning: AI returned only unsupported block types. Original parts: {final_parts}")
-            # FIXED: Also added logic to fall back to the original text
-            if hasattr(response, 'text') and response.text:
-                return [{"type": "text", "content": f"[Fallback Content]\n{response.text}"}]
-            return [{"type": "text", "content": "AI returned content in an unsupported format that cannot be displayed."}]
-
-        return filtered_parts
+    return cached_blocks
 
+
+async def run_generation(
+    response: Response, apiKey: str, prompt: str, model: str, refinerModel: str, files: List[UploadFile],
+    stream: bool, sharded: bool, on_complete: Optional[Callable[[List[dict]], None]] = None,
+    extra_headers: Optional[dict] = None, digests: Optional[List[str]] = None, timings: Optional[StageTimings] = None,
+    compact: bool = False
+):
+    timings = timings or StageTimings("generate")
+    response.headers.update(extra_headers or {})
+
+    # Refinement is a model round trip and does not depend on the uploads, so it overlaps with reading them
+    uploads = zip(files, digests or [None] * len(files))
+    (refined_prompt, refinement), system_prompt, sources = await asyncio.gather(
+        timings.run("refine", refine_prompt_for_coding(apiKey, prompt, refinerModel)),
+        timings.run("system_prompt", asyncio.to_thread(load_system_prompt)),
+        timings.run("ingest", asyncio.gather(*(read_upload(file, digest) for file, digest in uploads))),
+    )
+    # Deduplicate files across all attachments and collapse generated ones before anything is counted or packed
+    sources, assembly = await timings.run("assemble", asyncio.to_thread(assemble_context, list(sources), compact))
+    request_part = f"\n\nUser Request: {refined_prompt}\n\n"
+    if stream:
+        request_part += f"{STREAMING_INSTRUCTION}\n\n"
+    prompt_parts: List[Any] = [system_prompt, request_part]
+    response.headers["X-Prompt-Refinement"] = refinement
+
+    fixed_tokens = sum(estimate_tokens(part) for part in prompt_parts)
+    budget = max(0, context_budget(model) - fixed_tokens)
+    # Counting and packing walk every attached byte, so like assembly they run off the event loop
+    source_tokens = await asyncio.to_thread(lambda: sum(estimate_tokens(source.render()) for source in sources)) if sharded else None
+    use_shards = sharded and source_tokens > budget
+    context_headers = assembly.headers()
+    context_parts: List[str] = []
+    if not use_shards:
+        packed = await timings.run("pack", asyncio.to_thread(pack_context, sources, refined_prompt, model, fixed_tokens))
+        if packed.manifest:
+            context_parts.append(packed.manifest)
+        context_parts.extend(packed.parts)
+        prompt_parts.extend(context_parts)
+        context_headers.update(packed.headers())
+        source_tokens = packed.tokens_packed + packed.tokens_saved
+        CONTEXT_TOKENS.observe(packed.tokens_packed, phase="packed")
+    CONTEXT_TOKENS.observe(source_tokens, phase="attached")
+
+    try:
+        if use_shards:
+            # Opt-in map-reduce for context larger than the model window: analyse it in shards,
+            # then answer from the combined notes with the usual structured-response call
+            map_model = ScheduledModel(upstream, apiKey, model, lambda name: model_pool.model(apiKey, name))
+            shards = await asyncio.to_thread(split_into_shards, sources, budget)
+            shard_result = await timings.run("map", run_map_phase(map_model, refined_prompt, shards))
+            prompt_parts.append(shard_result.render())
+            context_headers.update(shard_result.headers())
+
+        request_parts = prompt_parts
+        tool_config = STREAMING_TOOL_CONFIG if stream else TOOL_CONFIG
+        request_options = {"tool_config": tool_config}
+        cached_model = None
+        if not use_shards:
+            # Follow-up turns about the same attachments reuse a provider-side cache of the system prompt,
+            # tools and context, and only send the new request
+            cached_model, cache_key, cache_status = await timings.run("context_cache", context_cache.get_model(
+                apiKey, model, system_prompt, context_parts, response_tools, tool_config
+            ))
+            context_headers["X-Context-Cache"] = cache_status
+            if cached_model is not None:
+                request_parts = [request_part]
+                request_options = {}  # tools and tool config are part of the cached content
+        response.headers.update(context_headers)
+
+        async def call_model(model_name: str) -> Any:
+            nonlocal cached_model
+            if cached_model is not None and model_name == model:
+                try:
+                    return await cached_model.generate_content_async(request_parts, stream=stream, **request_options)
+                except google_exceptions.NotFound:
+                    # The cache expired or was deleted on the provider side: send the full prompt
+                    cached_model = None
+                    context_cache.invalidate(cache_key)
+                    context_headers["X-Context-Cache"] = "expired"
+                    response.headers.update(context_headers)
+            # Pooled per API key: concurrent requests with different keys never share a configured client
+            generation_model = model_pool.model(apiKey, model_name, tools=[response_tools])
+            return await generation_model.generate_content_async(
+                prompt_parts, stream=stream, tool_config=tool_config
+            )
+
+        started_at = time.perf_counter()
+        # Admission per API key, retry of 429/5xx with backoff, fallback models and optional hedging
+        model_response, upstream_report = await upstream.call(apiKey, model, call_model)
+        context_headers.update({
+            "X-Upstream-Model": upstream_report["model"],
+            "X-Upstream-Attempts": str(upstream_report["attempts"]),
+            "X-Upstream-Queued-Ms": str(upstream_report["queued_ms"]),
+        })
+        response.headers.update(context_headers)
+        # For streams this is the time until the model started answering
+        timings.record("generate", time.perf_counter() - started_at)
+        response.headers["Server-Timing"] = timings.header()
+
+        if stream:
+            def stream_complete(blocks: List[dict]) -> None:
+                timings.record("stream", time.perf_counter() - started_at)
+                if on_complete:
+                    on_complete(blocks)
+
+            # Opt-in SSE mode: blocks are sent as soon as the model produces them
+            return StreamingResponse(
+                stream_blocks(model_response, started_at, stream_complete),
+                media_type="text/event-stream",
+                headers={
+                    "Cache-Control": "no-cache", "X-Accel-Buffering": "no", **(extra_headers or {}), **context_headers,
+                    "X-Prompt-Refinement": refinement, "Server-Timing": timings.header(),
+                }
+            )
+        postprocess_started_at = time.perf_counter()
+        blocks = blocks_from_response(model_response)
+        timings.record("postprocess", time.perf_counter() - postprocess_started_at)
+        response.headers["Server-Timing"] = timings.header()
+        return blocks
+
+    except UpstreamBusy as e:
+        raise HTTPException(
+            status_code=429, detail=f"{e} Please try again shortly.",
+            headers={"Retry-After": str(max(1, round(e.retry_after)))}
+        )
+    except ShardingError as e:
+        error_content = f"Could not analyse the attached context in parts: {e}"
+        print(error_content)
+        return [{"type": "code", "language": "error", "content": error_content}]
     except google_exceptions.InvalidArgument as e:
         raise HTTPException(status_code=400, detail=f"Invalid argument to API. Details: {e}")
+    except google_exceptions.ResourceExhausted as e:
+        error_content = f"Google API Error (429): The rate limit or quota of this API key is exhausted, even after retrying. Please wait a minute and try again. Details: {e}"
+        print(error_content)
+        return [{"type": "code", "language": "error", "content": error_content}]
     # FIXED: Added catching for InternalServerError for a more informative message
     except google_exceptions.InternalServerError as e:
         error_content = f"Google API Error (500): The server encountered an internal error. This often happens if the AI model tries to generate a malformed response. Please try modifying your prompt or reducing the amount of context. Details: {e}"
@@ -0,0 +1,285 @@
+import asyncio
+import fcntl
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, Iterable, List, Tuple
+
+# --- Settings ---
+# Every worker writes its counters to a file here; /metrics on any worker sums all of them
+METRICS_DIR = os.environ.get("METRICS_DIR", os.path.join(tempfile.gettempdir(), "gemini_gateway_metrics"))
+# How soon after an observation a worker's file is brought up to date
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "5"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+TOKEN_BUCKETS = (1_000, 4_000, 16_000, 64_000, 128_000, 256_000, 512_000, 1_000_000, 2_000_000)
+EXITED_FILE = "exited.json"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(int(value)) if float(value).is_integer() else repr(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    # A counter or histogram with a fixed set of label names. Series are keyed by the tuple of label values;
+    # a histogram series is [per-bucket counts..., +Inf count, sum, count].
+
+    def __init__(self, registry: "MetricsRegistry", name: str, help_text: str, kind: str,
+                 label_names: Tuple[str, ...], buckets: Tuple[float, ...] = ()):
+        self.registry = registry
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series: Dict[Tuple[str, ...], list] = {}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self.registry.lock:
+            series = self.series.setdefault(key, [0])
+            series[0] += amount
+        self.registry.changed()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self.registry.lock:
+            series = self.series.setdefault(key, [0] * (len(self.buckets) + 3))
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+        self.registry.changed()
+
+    def snapshot(self) -> dict:
+        return {
+            "kind": self.kind, "help": self.help_text, "labels": list(self.label_names), "buckets": list(self.buckets),
+            "series": [[list(key), list(values)] for key, values in self.series.items()],
+        }
+
+
+class MetricsRegistry:
+    # Process-local metrics that are aggregated across gunicorn workers through METRICS_DIR: each worker
+    # flushes a snapshot to worker-<pid>.json shortly after it records something, and rendering /metrics
+    # sums the snapshots of all workers. Files of workers that have exited are folded into exited.json,
+    # so their counts are not lost when gunicorn replaces a worker.
+
+    def __init__(self, directory: str = METRICS_DIR, flush_interval: float = METRICS_FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.metrics: Dict[str, Metric] = {}
+        self._flush_scheduled = False
+
+    def counter(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()) -> Metric:
+        return self.metrics.setdefault(name, Metric(self, name, help_text, "counter", label_names))
+
+    def histogram(self, name: str, help_text: str, label_names: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Metric:
+        return self.metrics.setdefault(name, Metric(self, name, help_text, "histogram", label_names, buckets))
+
+    # --- Per-worker files ---
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def changed(self) -> None:
+        # Schedules one flush per interval on the event loop; observations made outside it are written with the next one
+        if self._flush_scheduled:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._flush_scheduled = True
+        loop.call_later(self.flush_interval, lambda: asyncio.ensure_future(self._flush_later()))
+
+    async def _flush_later(self) -> None:
+        self._flush_scheduled = False
+        try:
+            await asyncio.to_thread(self.flush)
+        except OSError as e:
+            print(f"Could not write metrics file: {e}")
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def _write(self, name: str, snapshot: dict) -> None:
+        tmp_path = self._path(f"{name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self._path(name))
+
+    def _read(self, name: str) -> dict:
+        try:
+            with open(self._path(name), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def flush(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self._write(f"worker-{os.getpid()}.json", self.snapshot())
+
+    def mark_process_dead(self, pid: int) -> None:
+        # Called from gunicorn's child_exit hook in the master; also run for any stale file found by collect()
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path("fold.lock"), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                worker_snapshot = self._read(f"worker-{pid}.json")
+                if worker_snapshot:
+                    self._write(EXITED_FILE, merge_snapshots([self._read(EXITED_FILE), worker_snapshot]))
+                try:
+                    os.unlink(self._path(f"worker-{pid}.json"))
+                except FileNotFoundError:
+                    pass
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _worker_pids(self) -> List[int]:
+        pids = []
+        for name in os.listdir(self.directory):
+            if name.startswith("worker-") and name.endswith(".json") and name[7:-5].isdigit():
+                pids.append(int(name[7:-5]))
+        return pids
+
+    def collect(self) -> str:
+        # Host-wide Prometheus text exposition: this worker's current values plus every other worker's last flush
+        self.flush()
+        pids = []
+        for pid in self._worker_pids():
+            if pid == os.getpid() or _process_alive(pid):
+                pids.append(pid)
+            else:
+                self.mark_process_dead(pid)
+        snapshots = [self._read(EXITED_FILE)]
+        snapshots.extend(self.snapshot() if pid == os.getpid() else self._read(f"worker-{pid}.json") for pid in pids)
+        # Metrics nobody has recorded yet are still listed, with their HELP and TYPE lines
+        snapshots.append({name: {**snapshot, "series": []} for name, snapshot in self.snapshot().items()})
+        return render(merge_snapshots(snapshots))
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def merge_snapshots(snapshots: List[dict]) -> dict:
+    merged: Dict[str, dict] = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, {**metric, "series": []})
+            if target["buckets"] != metric["buckets"] or target["labels"] != metric["labels"]:
+                continue  # written by a build with different buckets; cannot be added up
+            series = {tuple(key): values for key, values in target["series"]}
+            for key, values in metric["series"]:
+                existing = series.get(tuple(key))
+                series[tuple(key)] = [a + b for a, b in zip(existing, values)] if existing else list(values)
+            target["series"] = [[list(key), values] for key, values in series.items()]
+    return merged
+
+
+def render(snapshot: dict) -> str:
+    lines = []
+    for name in sorted(snapshot):
+        metric = snapshot[name]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        label_names = metric["labels"]
+        for key, values in sorted(metric["series"], key=lambda s: s[0]):
+            if metric["kind"] == "counter":
+                lines.append(f"{name}{_format_labels(label_names, key)} {_format_value(values[0])}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(metric["buckets"]) + [math.inf], values[:-2]):
+                cumulative += count
+                labels = _format_labels(label_names + ["le"], key + [_format_value(bound)])
+                lines.append(f"{name}_bucket{labels} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(label_names, key)} {_format_value(values[-2])}")
+            lines.append(f"{name}_count{_format_labels(label_names, key)} {_format_value(values[-1])}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    # Plain ASGI middleware (not BaseHTTPMiddleware) so a streamed response is timed until its last byte.
+    # Requests are labelled with the route template, never the raw path, to keep job ids out of the labels.
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started_at = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started_at, method=scope["method"], route=route, status=str(status["code"])
+            )
+
+
+registry = MetricsRegistry()
+
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "gateway_http_request_duration_seconds", "Time from request to the last byte of the response.",
+    ("method", "route", "status"),
+)
+STAGE_SECONDS = registry.histogram(
+    "gateway_stage_duration_seconds", "Duration of one stage of a clone or generate request.", ("route", "stage"),
+)
+INGESTED_BYTES = registry.counter(
+    "gateway_ingested_bytes_total", "Bytes of uploaded or cloned content that were read and rendered.", ("source",),
+)
+INGESTED_FILES = registry.counter(
+    "gateway_ingested_files_total", "Files read from uploads, archives and cloned repositories.", ("source",),
+)
+CONTEXT_TOKENS = registry.histogram(
+    "gateway_context_tokens", "Estimated tokens of attached context per request, before and after packing.",
+    ("phase",), buckets=TOKEN_BUCKETS,
+)
+REFINEMENT_SECONDS = registry.histogram(
+    "gateway_prompt_refinement_duration_seconds", "Duration of prompt refinement by outcome.", ("status",),
+)
+UPSTREAM_ERRORS = registry.counter(
+    "gateway_upstream_errors_total", "Errors from Gemini calls by exception class and what the scheduler did next.",
+    ("error", "action"),
+)
+CONTEXT_ASSEMBLY_SAVED_BYTES = registry.counter(
+    "gateway_context_assembly_saved_bytes_total", "Prompt bytes saved by context assembly, by technique.", ("reason",),
+)
+CLONE_JOBS = registry.counter(
+    "gateway_clone_jobs_total", "Finished clone jobs by result.", ("result",),
+)
@@ -0,0 +1,114 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import google.generativeai as genai
+from google.generativeai import client as genai_client
+
+# --- Settings ---
+MODEL_POOL_MAX_KEYS = int(os.environ.get("MODEL_POOL_MAX_KEYS", "256"))
+# Clients of keys that were not used for this long are dropped
+MODEL_POOL_IDLE_SECONDS = int(os.environ.get("MODEL_POOL_IDLE_SECONDS", "900"))
+# host:port of a different Gemini API endpoint (gRPC over TLS), e.g. the fake server in benchmarks/fake_gemini.py
+GEMINI_API_ENDPOINT = os.environ.get("GEMINI_API_ENDPOINT", "")
+
+
+def _make_client_manager(api_key: str) -> Any:
+    # A private copy of what genai.configure() sets up globally, so this key's clients never see another key
+    manager = genai_client._ClientManager()
+    if GEMINI_API_ENDPOINT:
+        manager.configure(api_key=api_key, client_options={"api_endpoint": GEMINI_API_ENDPOINT})
+    else:
+        manager.configure(api_key=api_key)
+    return manager
+
+
+def tool_names(tools: Any) -> Tuple[str, ...]:
+    if not tools:
+        return ()
+    return tuple(declaration.name for tool in tools for declaration in tool.function_declarations)
+
+
+class PooledKey:
+    def __init__(self, manager: Any):
+        self.manager = manager
+        self.models: Dict[Tuple[str, Tuple[str, ...]], Any] = {}
+        self.last_used = time.monotonic()
+
+
+class ModelClientPool:
+    # GenerativeModel objects and their API clients, scoped per API key.
+    # genai.configure() swaps the key for the whole process, so two requests with different keys that
+    # interleave at an await can send a request with the wrong key. Here every key has its own client
+    # manager (and with it its own connection), and a model with its converted tool declarations is
+    # built once per (key, model, tool set) and reused by later requests.
+    #
+    # The SDK has no public way to bind a model to a client, so the pool sets the model's client
+    # attribute itself. Evicted clients are not closed explicitly: a request that is still streaming
+    # holds a reference, and the connection goes away with the last one.
+
+    def __init__(self, max_keys: int = MODEL_POOL_MAX_KEYS, idle_seconds: int = MODEL_POOL_IDLE_SECONDS,
+                 client_factory: Callable[[str], Any] = _make_client_manager):
+        self.max_keys = max(1, max_keys)
+        self.idle_seconds = idle_seconds
+        self.client_factory = client_factory
+        self.models_created = 0
+        self.models_reused = 0
+        self.evictions = 0
+        self._keys: "OrderedDict[str, PooledKey]" = OrderedDict()
+
+    def _evict(self) -> None:
+        cutoff = time.monotonic() - self.idle_seconds
+        while self._keys:
+            digest, pooled = next(iter(self._keys.items()))
+            if len(self._keys) <= self.max_keys and pooled.last_used >= cutoff:
+                break
+            del self._keys[digest]
+            self.evictions += 1
+
+    def _pooled(self, api_key: str) -> PooledKey:
+        # Keys are only held hashed as dictionary keys; the client manager still needs the raw key
+        digest = hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+        pooled = self._keys.get(digest)
+        if pooled is None:
+            pooled = PooledKey(self.client_factory(api_key))
+            self._keys[digest] = pooled
+        self._keys.move_to_end(digest)
+        pooled.last_used = time.monotonic()
+        self._evict()
+        return pooled
+
+    def _bind(self, model: Any, pooled: PooledKey) -> Any:
+        model._async_client = pooled.manager.get_default_client("generative_async")
+        model._client = pooled.manager.get_default_client("generative")
+        return model
+
+    def model(self, api_key: str, model_name: str, tools: Optional[Any] = None) -> Any:
+        pooled = self._pooled(api_key)
+        key = (model_name, tool_names(tools))
+        model = pooled.models.get(key)
+        if model is not None:
+            self.models_reused += 1
+            return model
+        model = self._bind(genai.GenerativeModel(model_name=model_name, tools=tools), pooled)
+        pooled.models[key] = model
+        self.models_created += 1
+        return model
+
+    def cached_model(self, api_key: str, cached_content: Any) -> Any:
+        # Models bound to a provider-side context cache are cheap (no tools to convert) and not pooled
+        return self._bind(genai.GenerativeModel.from_cached_content(cached_content), self._pooled(api_key))
+
+    def cache_client(self, api_key: str) -> Any:
+        return self._pooled(api_key).manager.get_default_client("cache")
+
+    def stats(self) -> dict:
+        return {
+            "pooled_keys": len(self._keys), "models_created": self.models_created,
+            "models_reused": self.models_reused, "evictions": self.evictions,
+        }
+
+
+model_pool = ModelClientPool()
@@ -0,0 +1,127 @@
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from metrics import REFINEMENT_SECONDS
+from model_pool import model_pool
+from upstream import ScheduledModel, upstream
+
+# --- Settings ---
+REFINED_PROMPT_CACHE_SIZE = int(os.environ.get("REFINED_PROMPT_CACHE_SIZE", "512"))
+# Prompts with fewer words than this and nothing code-like in them are sent as they are
+REFINER_MIN_WORDS = int(os.environ.get("REFINER_MIN_WORDS", "3"))
+# Refinement is optional: when the key's rate limit is saturated it is skipped rather than queued or retried
+REFINER_MAX_WAIT = 1.0
+
+REFINER_SYSTEM_PROMPT = """
+# System Prompt: Smart Query Builder
+# Role
+You are a Smart Query Builder. Your job is to take a user's question and make it better. The new question should be a perfect instruction for another AI, the "Gemini Architect". Your new question must keep the user's idea. But it should also make it better, so the other AI gives a very good answer. The answer should be correct, secure, and clear.
+# VERY IMPORTANT RULES
+- **Keep the Meaning (Top Priority):** The new question MUST mean the same thing as the user's question. Keep all special words and rules. Do not lose any information.
+- **Same Language:** The output language MUST be the same as the input language. Do not translate.
+- **Make the Idea Better (Main Job):**
+  - **Find the Real Goal:** Look at the user's question to understand what they really want to do.
+  - **Improve the Request:** If the question is simple (like "how to do X"), change it to ask for a solution that is ready for real use, strong, and has good explanations.
+  - **Ask for More Details:** If the question is about code, change it to ask the AI to check for security problems, special cases, and good ways to build the code.
+  - **Keep it Simple for Simple Questions:** If the user asks a small, easy question (like "what is a for-loop in Python?"), just make the question clean and direct. Do not make small questions too big.
+- **Only the New Question:** Your output MUST BE only the new question text. No "hello", no "sorry", no extra words, no markdown.
+- **Do Nothing Protocol:** If the question is not about tech, is just talking, or is not clear (like "hello", "thank you"), return it exactly as it is.
+# Your Process
+1.  **Understand:** Read the user's question and find their real goal.
+2.  **Build the New Question:** Make a new, better question. Write it like instructions for an expert AI. Tell it to check its work and explain why it chose its solution.
+3.  **Final Check:** Make sure the new question is clean, clear, and ready for the next AI model.
+"""
+
+# Small talk the refiner would return unchanged anyway ("Do Nothing Protocol")
+SMALL_TALK = re.compile(
+    r"^(?:hi|hello|hey|yo|thanks|thank you|thx|ok|okay|yes|no|sure|great|cool|nice|bye|good (?:morning|evening|night)"
+    r"|привет|здравствуйте|спасибо|ок|окей|да|нет|пока|отлично|супер)[\s!.,?)]*$",
+    re.IGNORECASE,
+)
+CODE_HINT = re.compile(r"[`{}()\[\]<>=/\\#;]|\w[._]\w|\d")
+
+
+def normalize_prompt(prompt: str) -> str:
+    return " ".join(prompt.split())
+
+
+def needs_refinement(prompt: str) -> bool:
+    # Cheap local check that saves a model round trip for greetings, acknowledgements and
+    # one- or two-word prompts; anything that looks like code always goes to the refiner
+    text = normalize_prompt(prompt)
+    if len(text) < 2 or SMALL_TALK.match(text):
+        return False
+    if len(text.split()) < REFINER_MIN_WORDS and not CODE_HINT.search(text):
+        return False
+    return True
+
+
+class RefinedPromptCache:
+    # In-memory LRU of refined prompts keyed by (refiner model, normalized prompt).
+    # Refinement is close to deterministic, and users often resend the same request with new files.
+
+    def __init__(self, max_entries: int = REFINED_PROMPT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self._entries: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+
+    def get(self, refiner_model_id: str, prompt: str) -> Optional[str]:
+        key = (refiner_model_id, normalize_prompt(prompt))
+        refined = self._entries.get(key)
+        if refined is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return refined
+
+    def put(self, refiner_model_id: str, prompt: str, refined: str) -> None:
+        key = (refiner_model_id, normalize_prompt(prompt))
+        self._entries[key] = refined
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses, "skipped": self.skipped}
+
+
+refined_prompts = RefinedPromptCache()
+
+
+async def refine_prompt_for_coding(api_key: str, user_prompt: str, refiner_model_id: str) -> Tuple[str, str]:
+    # Returns (prompt to use, how it was obtained: "skipped" | "cached" | "refined" | "failed")
+    started_at = time.perf_counter()
+    refined_text, status = await _refine(api_key, user_prompt, refiner_model_id)
+    REFINEMENT_SECONDS.observe(time.perf_counter() - started_at, status=status)
+    return refined_text, status
+
+
+async def _refine(api_key: str, user_prompt: str, refiner_model_id: str) -> Tuple[str, str]:
+    if not needs_refinement(user_prompt):
+        refined_prompts.skipped += 1
+        return user_prompt, "skipped"
+    cached = refined_prompts.get(refiner_model_id, user_prompt)
+    if cached is not None:
+        return cached, "cached"
+    try:
+        refiner_model = ScheduledModel(
+            upstream, api_key, refiner_model_id, lambda name: model_pool.model(api_key, name),
+            max_retries=0, max_wait=REFINER_MAX_WAIT, fallback_models=[], hedge_after=0
+        )
+        full_prompt = f"{REFINER_SYSTEM_PROMPT}\n\nUser prompt to refine:\n\"{user_prompt}\""
+        response = await refiner_model.generate_content_async(full_prompt)
+        refined_text = response.text.strip()
+        if not refined_text:
+            return user_prompt, "failed"
+        # Failures are not cached, so a flaky refiner call is retried on the next request
+        refined_prompts.put(refiner_model_id, user_prompt, refined_text)
+        return refined_text, "refined"
+    except Exception as e:
+        print(f"Could not refine prompt due to an error: {e}. Using original prompt.")
+        return user_prompt, "failed"
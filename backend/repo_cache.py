@@ -0,0 +1,41 @@
+import hashlib
+import json
+import threading
+from typing import Optional
+
+from cache_store import CacheStore
+
+
+class RepoCache:
+    # Processed repository dumps keyed by (repo, commit SHA, ignore rules version), kept in the
+    # host-wide cache store so every gunicorn worker sees the same entries and they survive restarts.
+    # Dumps are large, repetitive text: the store keeps them compressed.
+
+    NAMESPACE = "repo"
+
+    def __init__(self, store: CacheStore):
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(repo: str, commit_sha: str, rules_version: str) -> str:
+        raw = json.dumps([repo.lower(), commit_sha, rules_version])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        text = self.store.get_text(self.NAMESPACE, key)
+        with self._lock:
+            if text is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return text
+
+    def put(self, key: str, text: str) -> None:
+        self.store.put_text(self.NAMESPACE, key, text)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
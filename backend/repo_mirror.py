@@ -0,0 +1,329 @@
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from ingest import MAX_FILE_SIZE, build_ignore_spec, decode_text, render_content, render_file_section
+from metrics import INGESTED_BYTES, INGESTED_FILES
+
+# --- Settings ---
+MIRROR_DIR = os.environ.get("REPO_MIRROR_DIR", os.path.join(tempfile.gettempdir(), "gemini_gateway_mirrors"))
+# Mirrors (with their render caches) are evicted least recently used first above this total size,
+# and once they have not been used for REPO_MIRROR_MAX_AGE seconds (0 disables either bound)
+REPO_MIRROR_MAX_BYTES = int(os.environ.get("REPO_MIRROR_MAX_BYTES", str(5 * 1024 * 1024 * 1024)))
+REPO_MIRROR_MAX_AGE = int(os.environ.get("REPO_MIRROR_MAX_AGE", str(7 * 24 * 3600)))
+# Measuring the mirrors walks all their files, so each worker sweeps at most this often
+REPO_MIRROR_SWEEP_INTERVAL = int(os.environ.get("REPO_MIRROR_SWEEP_INTERVAL", "300"))
+
+SYMLINK_MODE = b'120000'
+
+
+class RepoMirrorError(Exception):
+    def __init__(self, message: str, stderr: str = ""):
+        super().__init__(message)
+        self.stderr = stderr
+
+
+async def run_git(*args: str, input: Optional[bytes] = None, timeout: int = 300) -> bytes:
+    # Runs git as an asyncio subprocess, so a slow clone never blocks the worker's event loop
+    proc = await asyncio.create_subprocess_exec(
+        "git", *args,
+        stdin=asyncio.subprocess.PIPE if input is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(input), timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        proc.kill()
+        await proc.wait()
+        raise
+    if proc.returncode != 0:
+        message = stderr.decode('utf-8', errors='replace')
+        raise RepoMirrorError(f"git {args[0]} failed: {message}", message)
+    return stdout
+
+
+async def resolve_commit(clone_url: str, branch: Optional[str] = None, timeout: int = 30) -> Optional[str]:
+    # Cheap lookup of the commit a clone would check out, without downloading any objects.
+    # Returns None if the ref cannot be resolved (e.g. a raw commit SHA in the URL), so the caller can fall back to a plain clone.
+    ref = branch or "HEAD"
+    try:
+        stdout = await run_git("ls-remote", clone_url, ref, f"{ref}^{{}}", timeout=timeout)
+    except (RepoMirrorError, asyncio.TimeoutError) as e:
+        print(f"Could not resolve {ref} for {clone_url}: {e}")
+        return None
+
+    refs = {}
+    for line in stdout.decode('utf-8', errors='replace').splitlines():
+        if '\t' not in line:
+            continue
+        sha, name = line.split('\t', 1)
+        refs[name] = sha
+
+    if ref == "HEAD":
+        return refs.get("HEAD")
+    # Same precedence as `git clone --branch`: branches first, then tags (peeled to the commit if annotated)
+    for name in (f"refs/heads/{ref}", f"refs/tags/{ref}^{{}}", f"refs/tags/{ref}"):
+        if name in refs:
+            return refs[name]
+    return None
+
+
+class RepoMirror:
+    # Persistent bare mirrors of the repositories we ingest. A refresh only fetches the objects
+    # of the new commit that we do not have yet, and the dump is rebuilt from a per-blob cache of
+    # decoded file contents, so only files whose blob SHA changed are read out of git again.
+    #
+    # Layout per repository:
+    #   <MIRROR_DIR>/<hash>.git          bare repository (shallow, depth 1 per fetch)
+    #   <MIRROR_DIR>/<hash>.lock         flock held while fetching/rendering/evicting; its mtime is the last use.
+    #                                    Never deleted: a worker may already be waiting for a lock on it.
+    #   <hash>.git/gateway-render.json   {blob_sha: [offset, length]} into gateway-render.dat
+    #   <hash>.git/gateway-render.dat    decoded contents of the blobs of the last rendered tree
+
+    def __init__(self, mirror_dir: str = MIRROR_DIR, timeout: int = 300, max_bytes: int = REPO_MIRROR_MAX_BYTES,
+                 max_age: int = REPO_MIRROR_MAX_AGE, sweep_interval: int = REPO_MIRROR_SWEEP_INTERVAL):
+        self.mirror_dir = Path(mirror_dir)
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+        self.blobs_reused = 0
+        self.blobs_read = 0
+        self.evicted = 0
+        self._last_sweep = 0.0
+
+    async def _git(self, git_dir: Path, *args: str, input: Optional[bytes] = None) -> bytes:
+        try:
+            return await run_git("--git-dir", str(git_dir), *args, input=input, timeout=self.timeout)
+        except asyncio.TimeoutError as e:
+            raise RepoMirrorError(f"git {args[0]} timed out after {self.timeout}s") from e
+
+    def _paths(self, clone_url: str) -> Tuple[Path, Path]:
+        name = hashlib.sha256(clone_url.encode('utf-8')).hexdigest()[:32]
+        return self.mirror_dir / f"{name}.git", self.mirror_dir / f"{name}.lock"
+
+    @asynccontextmanager
+    async def _locked(self, lock_path: Path):
+        # Serialises fetches into the same mirror across gunicorn workers; waiting happens off the event loop.
+        # Opening the lock file for writing also bumps its mtime, which the eviction sweep reads as the last use.
+        self.mirror_dir.mkdir(parents=True, exist_ok=True)
+        with open(lock_path, 'w') as lock_file:
+            await asyncio.to_thread(fcntl.flock, lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    async def _ensure_mirror(self, git_dir: Path, clone_url: str) -> None:
+        if (git_dir / 'HEAD').is_file():
+            return
+        await run_git("init", "--bare", "--quiet", str(git_dir))
+        await self._git(git_dir, "remote", "add", "origin", clone_url)
+
+    async def fetch(self, git_dir: Path, branch: Optional[str]) -> str:
+        ref = branch or "HEAD"
+        local_ref = f"refs/gateway/{ref}"
+        # The objects we already have are advertised as "haves", so only the delta is transferred
+        await self._git(git_dir, "fetch", "--quiet", "--depth", "1", "--no-tags", "origin", f"+{ref}:{local_ref}")
+        return (await self._git(git_dir, "rev-parse", f"{local_ref}^{{commit}}")).decode('utf-8').strip()
+
+    async def _list_tree(self, git_dir: Path, commit_sha: str) -> List[Tuple[str, str, int]]:
+        # Returns (path, blob_sha, size) for every regular file, in git's (byte-wise sorted) order
+        entries = []
+        raw = await self._git(git_dir, "ls-tree", "-r", "-l", "-z", commit_sha)
+        for record in raw.split(b'\0'):
+            if not record:
+                continue
+            meta, path = record.split(b'\t', 1)
+            mode, obj_type, blob_sha, size = meta.split()
+            # Submodules have no content here; symlinks would only give us the link target
+            if obj_type != b'blob' or mode == SYMLINK_MODE:
+                continue
+            entries.append((path.decode('utf-8', errors='replace'), blob_sha.decode('ascii'), int(size)))
+        return entries
+
+    async def _read_blobs(self, git_dir: Path, blob_shas: List[str]) -> Dict[str, bytes]:
+        if not blob_shas:
+            return {}
+        out = await self._git(git_dir, "cat-file", "--batch", input="\n".join(blob_shas).encode('ascii') + b"\n")
+        blobs = {}
+        pos = 0
+        for _ in blob_shas:
+            header_end = out.index(b'\n', pos)
+            header = out[pos:header_end].split(b' ')
+            if len(header) != 3:
+                raise RepoMirrorError(f"git cat-file could not read object: {header[0].decode('ascii', errors='replace')}")
+            sha, _, size = header
+            start = header_end + 1
+            end = start + int(size)
+            blobs[sha.decode('ascii')] = out[start:end]
+            pos = end + 1  # content is followed by a newline
+        return blobs
+
+    def _load_render_cache(self, git_dir: Path) -> Tuple[Dict[str, List[int]], Optional[bytes]]:
+        try:
+            with open(git_dir / 'gateway-render.json', 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            with open(git_dir / 'gateway-render.dat', 'rb') as f:
+                data = f.read()
+        except (FileNotFoundError, ValueError):
+            return {}, None
+        return index, data
+
+    def _store_render_cache(self, git_dir: Path, contents: Dict[str, str]) -> None:
+        index = {}
+        chunks = []
+        offset = 0
+        for blob_sha, text in contents.items():
+            encoded = text.encode('utf-8')
+            index[blob_sha] = [offset, len(encoded)]
+            chunks.append(encoded)
+            offset += len(encoded)
+        # Data first, then the index that points into it: a reader never sees an index without its data
+        for name, payload in (('gateway-render.dat', b''.join(chunks)), ('gateway-render.json', json.dumps(index).encode('utf-8'))):
+            tmp_path = git_dir / f"{name}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp_path, git_dir / name)
+
+    @staticmethod
+    def _select(entries: List[Tuple[str, str, int]], gitignore_lines: List[str]) -> List[Tuple[str, str]]:
+        spec = build_ignore_spec(gitignore_lines)
+        selected = []
+        for path, blob_sha, size in entries:
+            if spec.match_file(path):
+                continue
+            if size > MAX_FILE_SIZE:
+                print(f"Skipping large file {path}")
+                continue
+            selected.append((path, blob_sha))
+        return selected
+
+    def _reuse_cached(self, git_dir: Path, selected: List[Tuple[str, str]]) -> Tuple[Dict[str, Optional[str]], List[str], int]:
+        index, data = self._load_render_cache(git_dir)
+        contents: Dict[str, Optional[str]] = {}
+        missing = []
+        for _, blob_sha in selected:
+            if blob_sha in contents:
+                continue
+            span = index.get(blob_sha)
+            if span is not None and data is not None:
+                offset, length = span
+                contents[blob_sha] = data[offset:offset + length].decode('utf-8')
+                self.blobs_reused += 1
+            else:
+                contents[blob_sha] = None
+                missing.append(blob_sha)
+        return contents, missing, len(index)
+
+    async def render(self, git_dir: Path, commit_sha: str, progress: Optional[Callable[[str], None]] = None) -> str:
+        if progress:
+            progress("walking")
+        entries = await self._list_tree(git_dir, commit_sha)
+
+        gitignore_lines = []
+        gitignore_sha = next((sha for path, sha, _ in entries if path == '.gitignore'), None)
+        if gitignore_sha:
+            gitignore_lines = decode_text((await self._read_blobs(git_dir, [gitignore_sha]))[gitignore_sha]).splitlines()
+        # Matching thousands of paths and the file I/O below are CPU/disk work: keep them off the event loop
+        selected = await asyncio.to_thread(self._select, entries, gitignore_lines)
+        blob_sizes = {blob_sha: size for _, blob_sha, size in entries}
+        INGESTED_FILES.inc(len(selected), source="clone")
+        INGESTED_BYTES.inc(sum(blob_sizes[blob_sha] for _, blob_sha in selected), source="clone")
+
+        if progress:
+            progress("rendering")
+        contents, missing, cached_count = await asyncio.to_thread(self._reuse_cached, git_dir, selected)
+        for blob_sha, raw in (await self._read_blobs(git_dir, missing)).items():
+            contents[blob_sha] = render_content(raw)
+        self.blobs_read += len(missing)
+
+        if missing or len(contents) != cached_count:
+            await asyncio.to_thread(self._store_render_cache, git_dir, contents)
+
+        return await asyncio.to_thread(
+            lambda: "\n".join(render_file_section(path, contents[blob_sha]) for path, blob_sha in selected)
+        )
+
+    async def refresh(self, clone_url: str, branch: Optional[str] = None, progress: Optional[Callable[[str], None]] = None) -> Tuple[str, str]:
+        # Fetches the latest commit of `branch` (or the default branch) and returns (commit_sha, processed_text).
+        # `progress` is called with the name of each stage: cloning, walking, rendering.
+        git_dir, lock_path = self._paths(clone_url)
+        async with self._locked(lock_path):
+            if progress:
+                progress("cloning")
+            created = not (git_dir / 'HEAD').is_file()
+            try:
+                await self._ensure_mirror(git_dir, clone_url)
+                commit_sha = await self.fetch(git_dir, branch)
+            except BaseException:
+                # A URL that never fetched (typo, private or deleted repository) must not leave an empty mirror behind
+                if created:
+                    await asyncio.to_thread(shutil.rmtree, git_dir, True)
+                raise
+            result = commit_sha, await self.render(git_dir, commit_sha, progress)
+        if time.monotonic() - self._last_sweep >= self.sweep_interval:
+            self._last_sweep = time.monotonic()
+            await asyncio.to_thread(self.sweep, git_dir)
+        return result
+
+    # --- Eviction ---
+
+    @staticmethod
+    def _disk_usage(git_dir: Path) -> int:
+        total = 0
+        for root, _, files in os.walk(git_dir):
+            for name in files:
+                try:
+                    total += os.lstat(os.path.join(root, name)).st_size
+                except FileNotFoundError:
+                    pass
+        return total
+
+    def sweep(self, keep: Optional[Path] = None) -> int:
+        # Removes mirrors unused for max_age, then the least recently used ones until the rest fit in max_bytes.
+        # A mirror whose lock is held (being fetched or rendered by any worker) is skipped. Returns the number removed.
+        if not self.mirror_dir.is_dir():
+            return 0
+        mirrors = []
+        for git_dir in self.mirror_dir.glob('*.git'):
+            lock_path = git_dir.with_suffix('.lock')
+            try:
+                last_used = lock_path.stat().st_mtime
+            except FileNotFoundError:
+                last_used = git_dir.stat().st_mtime
+            mirrors.append((last_used, git_dir, lock_path, self._disk_usage(git_dir)))
+        mirrors.sort(key=lambda mirror: mirror[0])
+
+        total = sum(size for _, _, _, size in mirrors)
+        cutoff = time.time() - self.max_age if self.max_age else None
+        removed = 0
+        for last_used, git_dir, lock_path, size in mirrors:
+            expired = cutoff is not None and last_used < cutoff
+            if git_dir == keep or not (expired or (self.max_bytes and total > self.max_bytes)):
+                continue
+            with open(lock_path, 'a') as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                try:
+                    shutil.rmtree(git_dir, ignore_errors=True)
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+            total -= size
+            removed += 1
+        self.evicted += removed
+        return removed
+
+    def stats(self) -> dict:
+        return {"blobs_reused": self.blobs_reused, "blobs_read": self.blobs_read, "mirrors_evicted": self.evicted}
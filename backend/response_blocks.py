@@ -0,0 +1,119 @@
+import json
+import time
+from typing import Any, AsyncIterable, AsyncIterator, Callable, List, Optional
+
+from block_normalizer import BLOCK_TYPES, Block, normalize_function_call
+
+# The block types the frontend renders: the type enum of generate_structured_response in tools.py
+SUPPORTED_TYPES = BLOCK_TYPES
+
+
+def response_text(response: Any) -> str:
+    # response.text raises ValueError (not AttributeError) when the candidate only holds a function call
+    try:
+        return response.text or ""
+    except (AttributeError, ValueError):
+        return ""
+
+
+def finish_blocks(blocks: List[Block], unsupported: int, fallback_text: str) -> List[dict]:
+    if blocks:
+        return [block.as_dict() for block in blocks]
+    if not unsupported:
+        # FIXED: Return the original response text if nothing is left after processing
+        if fallback_text:
+            return [{"type": "text", "content": f"[Fallback Content]\n{fallback_text}"}]
+        return [{"type": "text", "content": "AI response was empty or malformed after processing the function call."}]
+
+    print(f"Warning: AI returned only unsupported block types ({unsupported} parts).")
+    # FIXED: Also added logic to fall back to the original text
+    if fallback_text:
+        return [{"type": "text", "content": f"[Fallback Content]\n{fallback_text}"}]
+    return [{"type": "text", "content": "AI returned content in an unsupported format that cannot be displayed."}]
+
+
+def blocks_from_response(model_response: Any) -> List[dict]:
+    part = model_response.candidates[0].content.parts[0]
+
+    if not hasattr(part, 'function_call') or not part.function_call.name:
+        text = response_text(model_response)
+        if text:
+            return [{"type": "text", "content": text}]
+        return [{"type": "text", "content": "Error: Model returned an empty response without a function call."}]
+
+    # One pass from the protobuf args to validated blocks (see block_normalizer.py)
+    blocks, unsupported = normalize_function_call(part.function_call)
+    if blocks:
+        return [block.as_dict() for block in blocks]
+    return finish_blocks(blocks, unsupported, response_text(model_response))
+
+
+# --- Server-Sent Events ---
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_blocks(chunks: AsyncIterable[Any], started_at: float,
+                        on_complete: Optional[Callable[[List[dict]], None]] = None) -> AsyncIterator[str]:
+    # Turns a streamed model response into SSE events. Every function call is complete within the
+    # chunk that carries it, so its blocks are emitted as soon as that chunk arrives; the same
+    # validation and fallbacks as the JSON endpoint are applied.
+    # on_complete receives all emitted blocks once the stream has finished.
+    unsupported = 0
+    text_chunks: List[str] = []
+    saw_function_call = False
+    blocks: List[dict] = []
+    first_block_ms = None
+
+    def block_event(block: dict) -> str:
+        nonlocal first_block_ms
+        blocks.append(block)
+        if first_block_ms is None:
+            first_block_ms = round((time.perf_counter() - started_at) * 1000, 1)
+        return sse_event("block", block)
+
+    try:
+        async for chunk in chunks:
+            if not chunk.candidates:
+                continue
+            for part in chunk.candidates[0].content.parts:
+                function_call = getattr(part, 'function_call', None)
+                if function_call and function_call.name:
+                    saw_function_call = True
+                    new_blocks, new_unsupported = normalize_function_call(function_call)
+                    unsupported += new_unsupported
+                    for block in new_blocks:
+                        yield block_event(block.as_dict())
+                elif getattr(part, 'text', None):
+                    text_chunks.append(part.text)
+
+        if not blocks:
+            full_text = "".join(text_chunks)
+            if not saw_function_call:
+                # Plain text answer without a function call, same as the JSON endpoint
+                fallback = [{"type": "text", "content": full_text or "Error: Model returned an empty response without a function call."}]
+            else:
+                fallback = finish_blocks([], unsupported, full_text)
+            for block in fallback:
+                yield block_event(block)
+    except Exception as e:
+        error_content = f"CRITICAL: An error occurred during Gemini API call: {str(e)}"
+        print(error_content)
+        yield block_event({"type": "code", "language": "error", "content": error_content})
+
+    if on_complete:
+        on_complete(blocks)
+    yield sse_event("done", {
+        "blocks": len(blocks),
+        "time_to_first_block_ms": first_block_ms,
+        "total_ms": round((time.perf_counter() - started_at) * 1000, 1),
+    })
+
+
+async def replay_blocks(blocks: List[dict], started_at: float) -> AsyncIterator[str]:
+    # Same events as stream_blocks, for an answer that is already complete (e.g. from the response cache)
+    for block in blocks:
+        yield sse_event("block", block)
+    total_ms = round((time.perf_counter() - started_at) * 1000, 1)
+    yield sse_event("done", {"blocks": len(blocks), "time_to_first_block_ms": total_ms if blocks else None, "total_ms": total_ms})
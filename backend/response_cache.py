@@ -0,0 +1,99 @@
+import asyncio
+import hashlib
+import json
+import os
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from cache_store import CacheStore
+
+# --- Settings ---
+RESPONSE_CACHE_TTL = int(os.environ.get("RESPONSE_CACHE_TTL", "600"))
+UPLOAD_HASH_CHUNK = 1024 * 1024
+
+
+def upload_digest(upload_file: Any) -> str:
+    # Hashes a spooled upload without loading it into memory at once; the file is rewound for the reader
+    digest = hashlib.sha256()
+    upload_file.seek(0)
+    for chunk in iter(lambda: upload_file.read(UPLOAD_HASH_CHUNK), b''):
+        digest.update(chunk)
+    upload_file.seek(0)
+    return digest.hexdigest()
+
+
+def is_cacheable(blocks: Any) -> bool:
+    # Error blocks (quota, upstream failures) must not be replayed to the next identical request
+    return isinstance(blocks, list) and not any(
+        isinstance(block, dict) and block.get('language') == 'error' for block in blocks
+    )
+
+
+class ResponseCache:
+    # Finished /api/generate answers, keyed by a hash of everything that determines them and kept in the
+    # host-wide cache store, so a re-submit is a hit whichever worker nginx picks. Identical requests that
+    # arrive at a worker while the first one is still running wait for its answer instead of starting
+    # their own model call (single-flight; coalescing is per worker).
+
+    NAMESPACE = "response"
+
+    def __init__(self, store: CacheStore, ttl: int = RESPONSE_CACHE_TTL):
+        self.store = store
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._inflight: "dict[str, asyncio.Future]" = {}
+
+    @staticmethod
+    def make_key(api_key: str, model: str, refiner_model: str, prompt: str, system_prompt: str,
+                 sharded: bool, file_digests: List[Tuple[str, str]], compact: bool = False) -> str:
+        # Scoped to the API key: a cached answer must not let another key skip its own quota or auth check
+        payload = json.dumps([
+            hashlib.sha256(api_key.encode('utf-8')).hexdigest(), model, refiner_model, prompt,
+            hashlib.sha256(system_prompt.encode('utf-8')).hexdigest(), sharded, file_digests, compact,
+        ])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    async def get(self, key: str) -> Optional[List[dict]]:
+        blocks = await asyncio.to_thread(self.store.get_json, self.NAMESPACE, key)
+        if blocks is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return blocks
+
+    async def _put(self, key: str, blocks: List[dict]) -> None:
+        try:
+            await asyncio.to_thread(self.store.put_json, self.NAMESPACE, key, blocks, self.ttl)
+        except Exception as e:
+            print(f"Could not store response in cache: {e}")
+
+    def store_later(self, key: str, blocks: Any) -> None:
+        if is_cacheable(blocks):
+            asyncio.ensure_future(self._put(key, blocks))
+
+    def inflight(self, key: str) -> Optional[asyncio.Future]:
+        return self._inflight.get(key)
+
+    def _finish(self, key: str, task: asyncio.Future) -> None:
+        self._inflight.pop(key, None)
+        if not task.cancelled() and task.exception() is None:
+            self.store_later(key, task.result())
+
+    async def run(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Tuple[Any, str]:
+        # Returns (result, "miss" | "coalesced"). The call runs as its own task, so a client that
+        # disconnects does not cancel the answer other waiting clients are about to receive.
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task), "coalesced"
+        task = asyncio.ensure_future(compute())
+        self._inflight[key] = task
+        task.add_done_callback(lambda t: self._finish(key, t))
+        return await asyncio.shield(task), "miss"
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits, "misses": self.misses, "coalesced": self.coalesced,
+            "inflight": len(self._inflight), "ttl": self.ttl,
+        }
@@ -0,0 +1,161 @@
+import asyncio
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from context_packer import ContextSource, duplicate_reference, estimate_tokens
+from ingest import render_compact_section, render_file_section
+from response_blocks import response_text
+
+# --- Settings ---
+# 0 means "as large as the model's context budget allows"
+SHARD_MAX_TOKENS = int(os.environ.get("SHARD_MAX_TOKENS", "0"))
+SHARD_CONCURRENCY = int(os.environ.get("SHARD_CONCURRENCY", "4"))
+SHARD_TIMEOUT = float(os.environ.get("SHARD_TIMEOUT", "180"))
+# The reduce step still runs if up to this share of the shards failed or timed out
+SHARD_MAX_FAILED_RATIO = float(os.environ.get("SHARD_MAX_FAILED_RATIO", "0.5"))
+# Room in every shard for the map instructions and the user request
+SHARD_PROMPT_TOKENS = 4_000
+
+NO_RELEVANT_CONTENT = "NO RELEVANT CONTENT"
+
+MAP_PROMPT = """You are reviewing part {index} of {total} of a codebase that is too large to read at once.
+Another model will combine your notes with the notes on the other parts to answer the user's request, and it will not see this code.
+
+User request: {prompt}
+
+Write concise, factual notes about everything in this part that matters for the request: the relevant files and what they do, key functions and classes with their signatures, data flow between them, bugs or risks, and short code excerpts where the exact code matters. Always name the file paths.
+If nothing in this part is relevant to the request, answer exactly: """ + NO_RELEVANT_CONTENT
+
+
+class ShardingError(Exception):
+    pass
+
+
+class Shard:
+    def __init__(self, index: int, compact: bool = False):
+        self.index = index
+        self.compact = compact
+        self.sections: List[Tuple[str, str]] = []
+        self.tokens = 0
+
+    @property
+    def paths(self) -> List[str]:
+        return [path for path, _ in self.sections]
+
+    def render(self) -> str:
+        render_section = render_compact_section if self.compact else render_file_section
+        return "\n".join(render_section(path, content) for path, content in self.sections)
+
+
+class ShardResult:
+    def __init__(self, shards: List[Shard], notes: Dict[int, str], failures: Dict[int, str], elapsed: float):
+        self.shards = shards
+        self.notes = notes
+        self.failures = failures
+        self.elapsed = elapsed
+
+    def render(self) -> str:
+        total = len(self.shards)
+        lines = [f"--- Codebase Analysis Notes (collected from {total} parts of the attached context) ---"]
+        for shard in self.shards:
+            header = f"### Part {shard.index + 1}/{total} ({len(shard.sections)} files)"
+            if shard.index in self.failures:
+                lines.append(f"{header}\n[Not analysed: {self.failures[shard.index]}. Files: {', '.join(shard.paths)}]")
+            elif self.notes[shard.index].strip() != NO_RELEVANT_CONTENT:
+                lines.append(f"{header}\n{self.notes[shard.index].strip()}")
+        lines.append("--- End Codebase Analysis Notes ---")
+        return "\n\n".join(lines)
+
+    def headers(self) -> Dict[str, str]:
+        return {
+            "X-Context-Shards": str(len(self.shards)),
+            "X-Context-Shards-Failed": str(len(self.failures)),
+            "X-Context-Map-Ms": str(round(self.elapsed * 1000)),
+        }
+
+
+def _split_large_section(path: str, content: str, max_tokens: int) -> List[Tuple[str, str]]:
+    pieces, current, used = [], [], 0
+    for line in content.split('\n'):
+        cost = estimate_tokens(line) + 1
+        if current and used + cost > max_tokens:
+            pieces.append("\n".join(current))
+            current, used = [], 0
+        current.append(line)
+        used += cost
+    pieces.append("\n".join(current))
+    return [(f"{path} (part {i + 1}/{len(pieces)})", piece) for i, piece in enumerate(pieces)]
+
+
+def split_into_shards(sources: List[ContextSource], shard_tokens: int) -> List[Shard]:
+    # Splits the attachments on file boundaries into shards of at most shard_tokens; only a single
+    # file that is larger than a whole shard is cut (by lines) into several pieces
+    if SHARD_MAX_TOKENS:
+        shard_tokens = min(shard_tokens, SHARD_MAX_TOKENS)
+    shard_tokens = max(1_000, shard_tokens - SHARD_PROMPT_TOKENS)
+
+    compact = any(source.compact for source in sources)
+    shards = [Shard(0, compact)]
+    # Each map call only sees its own shard, so a duplicate reference is only kept in the shard that
+    # holds a whole copy of the content; elsewhere it is expanded again.
+    whole_copies: Dict[str, Tuple[int, str]] = {}  # first copy location -> (shard index, location of a whole copy)
+    for source in sources:
+        if source.binary:
+            continue
+        for f_index, (path, content) in enumerate(source.sections):
+            location = source.location(path)
+            duplicate = source.duplicates.get(f_index)
+            if duplicate is not None:
+                location, original = duplicate
+                shard_index, whole_copy = whole_copies.get(location, (None, ""))
+                if shard_index == shards[-1].index:
+                    reference = duplicate_reference(whole_copy)
+                    tokens = estimate_tokens(reference) + estimate_tokens(path) + 10
+                    if shards[-1].tokens + tokens <= shard_tokens:
+                        shards[-1].sections.append((path, reference))
+                        shards[-1].tokens += tokens
+                        continue
+                content = original
+            tokens = estimate_tokens(content) + estimate_tokens(path) + 10
+            pieces = _split_large_section(path, content, shard_tokens - 100) if tokens > shard_tokens else [(path, content)]
+            for piece_path, piece in pieces:
+                piece_tokens = estimate_tokens(piece) + estimate_tokens(piece_path) + 10
+                if shards[-1].sections and shards[-1].tokens + piece_tokens > shard_tokens:
+                    shards.append(Shard(len(shards), compact))
+                shards[-1].sections.append((piece_path, piece))
+                shards[-1].tokens += piece_tokens
+            if len(pieces) == 1:
+                whole_copies[location] = (shards[-1].index, source.location(path))
+    return [shard for shard in shards if shard.sections]
+
+
+async def run_map_phase(map_model: Any, prompt: str, shards: List[Shard],
+                        concurrency: int = SHARD_CONCURRENCY, timeout: float = SHARD_TIMEOUT) -> ShardResult:
+    # Runs one analysis call per shard with a bounded fan-out. Shards that fail or time out are reported
+    # to the reduce step instead of failing the request, unless too many of them are lost.
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    notes: Dict[int, str] = {}
+    failures: Dict[int, str] = {}
+    started_at = time.perf_counter()
+
+    async def analyse(shard: Shard) -> None:
+        async with semaphore:
+            instructions = MAP_PROMPT.format(index=shard.index + 1, total=len(shards), prompt=prompt)
+            try:
+                map_response = await asyncio.wait_for(
+                    map_model.generate_content_async([instructions, shard.render()]), timeout
+                )
+                notes[shard.index] = response_text(map_response) or NO_RELEVANT_CONTENT
+            except asyncio.TimeoutError:
+                failures[shard.index] = f"timed out after {timeout:g}s"
+            except Exception as e:
+                print(f"Shard {shard.index + 1}/{len(shards)} failed: {e}")
+                failures[shard.index] = f"{type(e).__name__}: {e}"
+
+    await asyncio.gather(*(analyse(shard) for shard in shards))
+
+    if len(failures) == len(shards) or len(failures) > len(shards) * SHARD_MAX_FAILED_RATIO:
+        first_error: Optional[str] = next(iter(failures.values()), None)
+        raise ShardingError(f"{len(failures)} of {len(shards)} parts of the context could not be analysed (e.g. {first_error}).")
+    return ShardResult(shards, notes, failures, time.perf_counter() - started_at)
@@ -0,0 +1,47 @@
+import time
+from typing import Any, Awaitable, Dict, Optional
+
+from metrics import STAGE_SECONDS
+
+
+class StageTimings:
+    # Wall-clock duration of each stage of a request, reported in a Server-Timing header so the
+    # overlap of concurrent stages is visible in the browser's network panel. Every stage is also
+    # recorded in the gateway_stage_duration_seconds histogram under `route`.
+
+    def __init__(self, route: str):
+        self.route = route
+        self.started_at = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self._current: Optional[tuple] = None
+
+    async def run(self, name: str, awaitable: Awaitable) -> Any:
+        stage_started_at = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.record(name, time.perf_counter() - stage_started_at)
+
+    def record(self, name: str, seconds: float) -> None:
+        self.stages[name] = seconds
+        STAGE_SECONDS.observe(seconds, route=self.route, stage=name)
+
+    def begin(self, name: Optional[str]) -> None:
+        # For stages reported one after another through a progress callback: ends the current one, if any
+        if self._current is not None:
+            current_name, current_started_at = self._current
+            self.record(current_name, time.perf_counter() - current_started_at)
+        self._current = (name, time.perf_counter()) if name else None
+
+    def header(self) -> str:
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        entries.append(f"total;dur={(time.perf_counter() - self.started_at) * 1000:.1f}")
+        return ", ".join(entries)
+
+    def as_dict(self) -> Dict[str, float]:
+        return {name: round(seconds * 1000, 1) for name, seconds in self.stages.items()}
+
+
+def server_timing(stages_ms: Dict[str, float]) -> str:
+    # Server-Timing header for durations that were recorded elsewhere (e.g. by a clone job)
+    return ", ".join(f"{name};dur={ms:.1f}" for name, ms in stages_ms.items())
@@ -0,0 +1,95 @@
+import asyncio
+import atexit
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# The backend is a flat set of modules that is run from its own directory
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+# Every on-disk state of the modules under test goes to a throwaway directory, never to the real /tmp paths
+STATE_DIR = tempfile.mkdtemp(prefix="gateway-tests-")
+for name, relative_path in (
+    ("CACHE_STORE_PATH", "cache.sqlite3"), ("REPO_MIRROR_DIR", "mirrors"), ("CLONE_JOB_DIR", "jobs"), ("METRICS_DIR", "metrics"),
+):
+    os.environ.setdefault(name, os.path.join(STATE_DIR, relative_path))
+atexit.register(shutil.rmtree, STATE_DIR, ignore_errors=True)
+
+GIT_ENV = {**os.environ, "GIT_AUTHOR_NAME": "test", "GIT_AUTHOR_EMAIL": "test@localhost",
+           "GIT_COMMITTER_NAME": "test", "GIT_COMMITTER_EMAIL": "test@localhost"}
+
+
+def git(*args: str, cwd=None) -> str:
+    return subprocess.run(["git", *args], cwd=cwd, env=GIT_ENV, check=True, capture_output=True, text=True).stdout.strip()
+
+
+class BareRepo:
+    # A bare repository served over file://, standing in for GitHub
+    def __init__(self, root: Path):
+        self.path = root / "origin.git"
+        self.work = root / "work"
+        git("init", "--bare", "--quiet", "--initial-branch", "main", str(self.path))
+        git("clone", "--quiet", str(self.path), str(self.work))
+        git("checkout", "--quiet", "-B", "main", cwd=self.work)
+
+    @property
+    def url(self) -> str:
+        return self.path.as_uri()
+
+    def commit(self, files: dict, message: str = "update") -> str:
+        for relative_path, content in files.items():
+            path = self.work / relative_path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(content)
+        git("add", "-A", cwd=self.work)
+        git("commit", "--quiet", "-m", message, cwd=self.work)
+        git("push", "--quiet", "origin", "main", cwd=self.work)
+        return git("rev-parse", "HEAD", cwd=self.work)
+
+
+@pytest.fixture
+def bare_repo(tmp_path):
+    return BareRepo(tmp_path / "remote")
+
+
+def model_response(*parts: dict):
+    # A GenerateContentResponse as the SDK returns it, e.g. model_response({"function_call": {"name": ..., "args": ...}})
+    from google.generativeai import protos
+    from google.generativeai.types import GenerateContentResponse
+
+    return GenerateContentResponse.from_response(protos.GenerateContentResponse(candidates=[{
+        "content": {"role": "model", "parts": list(parts)}, "finish_reason": 1,
+    }]))
+
+
+def function_call(name: str, **args) -> dict:
+    return {"function_call": {"name": name, "args": args}}
+
+
+class FakeModel:
+    # Stands in for a pooled GenerativeModel: records every call and answers with the scripted parts.
+    # Streams yield one chunk per part, chunk_delay apart; events logs when each chunk was produced.
+    def __init__(self, *parts: dict, chunk_delay: float = 0.0):
+        self.parts = parts
+        self.chunk_delay = chunk_delay
+        self.calls = []
+        self.events = []
+
+    async def generate_content_async(self, contents, stream: bool = False, **kwargs):
+        self.calls.append({"contents": contents, "stream": stream, **kwargs})
+        if not stream:
+            return model_response(*self.parts)
+        return self._chunks()
+
+    async def _chunks(self):
+        for index, part in enumerate(self.parts):
+            if index:
+                await asyncio.sleep(self.chunk_delay)
+            self.events.append(f"chunk {index}")
+            yield model_response(part)
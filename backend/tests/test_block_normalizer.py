@@ -0,0 +1,43 @@
+import pytest
+
+from block_normalizer import normalize_function_call
+from conftest import function_call, model_response
+from response_blocks import blocks_from_response
+
+
+def normalize(name: str, **args):
+    call = model_response(function_call(name, **args)).candidates[0].content.parts[0].function_call
+    blocks, unsupported = normalize_function_call(call)
+    return [block.as_dict() for block in blocks], unsupported
+
+
+@pytest.mark.parametrize("name, args", [
+    ("make_code", {"content": "print(1)"}),
+    ("make_code", {"content": "print(1)", "language": "python"}),
+    ("make_annotated_heading", {"content": "Setup"}),
+    ("make_annotated_heading", {"content": "Setup", "tag": "Step 1"}),
+    ("make_text", {"content": "Hello", "note": "kept as sent"}),
+    ("make_list", {"items": ["a", "b"]}),
+])
+def test_simple_tools_return_what_the_model_sent(name, args):
+    assert normalize(name, **args) == ([{"type": name.replace("make_", ""), **args}], 0)
+
+
+@pytest.mark.parametrize("name, args", [
+    ("make_code", {"language": "python"}),
+    ("make_text", {}),
+    ("make_list", {"items": "a, b"}),
+    ("make_list", {"content": "a, b"}),
+])
+def test_simple_tools_without_their_content_are_dropped(name, args):
+    assert normalize(name, **args) == ([], 0)
+
+
+def test_structured_response_keeps_supported_parts_in_order():
+    parts = [{"type": "heading", "content": "Title"}, {"type": "video", "content": "x"}, {"type": "code", "content": "x = 1"}]
+    assert normalize("generate_structured_response", parts=parts) == ([parts[0], parts[2]], 1)
+
+
+def test_unknown_functions_become_an_error_block():
+    blocks = blocks_from_response(model_response(function_call("make_video", content="x")))
+    assert blocks[0]["language"] == "error" and "AI called an unexpected function: make_video" in blocks[0]["content"]
@@ -0,0 +1,60 @@
+import asyncio
+import io
+import os
+import stat
+import time
+import zipfile
+
+from starlette.datastructures import UploadFile
+
+import cache_store
+import main
+from cache_store import MemoryCacheStore, SqliteCacheStore
+
+
+def mode(path) -> int:
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_sqlite_store_is_private_to_its_user(tmp_path):
+    old_umask = os.umask(0o022)
+    try:
+        store = SqliteCacheStore(str(tmp_path / "store" / "cache.sqlite3"))
+        store.put_text("zip", "key", "secret code" * 1_000)
+        assert store.get_text("zip", "key") == "secret code" * 1_000
+    finally:
+        os.umask(old_umask)
+
+    assert mode(tmp_path / "store") == 0o700
+    files = list((tmp_path / "store").iterdir())
+    assert {path.name for path in files} >= {"cache.sqlite3", "cache.sqlite3-wal", "cache.sqlite3-shm"}
+    assert {path.name: mode(path) for path in files} == {path.name: 0o600 for path in files}
+
+
+def test_an_existing_open_directory_is_closed(tmp_path):
+    (tmp_path / "store").mkdir(mode=0o755)
+    os.chmod(tmp_path / "store", 0o755)
+    SqliteCacheStore(str(tmp_path / "store" / "cache.sqlite3")).put_text("response", "key", "answer")
+    assert mode(tmp_path / "store") == 0o700
+
+
+def test_parsed_zip_uploads_expire(monkeypatch):
+    now = [time.time()]
+    monkeypatch.setattr(cache_store.time, "time", lambda: now[0])
+    store = MemoryCacheStore()
+    monkeypatch.setattr(main, "cache_store", store)
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("app.py", "print('hi')\n")
+
+    async def parse():
+        archive.seek(0)
+        return await main.zip_sections_cached(UploadFile(archive, filename="project.zip"), "digest")
+
+    sections = asyncio.run(parse())
+    assert [path for path, _ in sections] == ["app.py"]
+    key = next(key for namespace, key in store._entries if namespace == "zip")
+    assert store.get_json("zip", key) is not None
+
+    now[0] += main.ZIP_CACHE_TTL + 1
+    assert store.get_json("zip", key) is None
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import random
+import re
+
+import pytest
+
+import context_packer
+from context_assembly import assemble_context
+from context_packer import ContextSource, pack_context
+from sharding import split_into_shards
+
+REFERENCE = re.compile(r"\[Duplicate: same content as (.*?)\]")
+COLLAPSED_MARKER = "[Whitespace collapsed]\n"
+
+
+def source_file(rng: random.Random, name: str, lines: int) -> str:
+    body = "\n".join(f"    value_{rng.getrandbits(32):x} = compute('{name}', {i})" for i in range(lines))
+    return f"def {name}():\n{body}\n"
+
+
+def build_sources(files: int = 60, seed: int = 0) -> list:
+    # An uploaded project, a second repository that vendors a third of it, generated JSON, and a few
+    # project files that are also attached on their own
+    rng = random.Random(seed)
+    project = [(f"src/mod_{i}.py", source_file(rng, f"mod_{i}", rng.randint(10, 80))) for i in range(files)]
+    records = [{"id": i, "name": f"item_{i}", "tags": ["a", "b"]} for i in range(200)]
+    project.append(("fixtures/data.json", json.dumps(records, indent=4)))
+    other = [(f"lib/other_{i}.py", source_file(rng, f"other_{i}", 20)) for i in range(files // 2)]
+    other += [(f"vendor/project/{path}", content) for path, content in project if rng.random() < 0.33]
+    attached = rng.sample(project[:files], 3)
+    return [
+        ContextSource("project.zip", 'zip', project),
+        ContextSource("gh_repo:::example/other", 'repo', other),
+        *(ContextSource(path.rsplit('/', 1)[-1], 'file', [(path.rsplit('/', 1)[-1], content)]) for path, content in attached),
+    ]
+
+
+def verify(sources: list, assembled: list, report) -> list:
+    # Returns the problems found; an empty list means nothing unique was lost
+    problems = []
+    full_copies = {}  # location -> digest of the original content of a section that kept its content
+    originals = set()
+    references = []
+    for source, result in zip(sources, assembled):
+        if [path for path, _ in source.sections] != [path for path, _ in result.sections]:
+            problems.append(f"{source.name}: the list of paths changed")
+            continue
+        for (path, original), (_, content) in zip(source.sections, result.sections):
+            digest = hashlib.sha256(original.encode('utf-8')).hexdigest()
+            originals.add(digest)
+            location = source.location(path)
+            reference = REFERENCE.fullmatch(content)
+            if reference and content != original:
+                references.append((location, reference.group(1), digest))
+            elif content == original:
+                full_copies[location] = digest
+            elif content.startswith(COLLAPSED_MARKER) and "".join(original.split()) == "".join(content[len(COLLAPSED_MARKER):].split()):
+                full_copies[location] = digest
+            else:
+                problems.append(f"{location}: content changed beyond whitespace")
+    for location, target, digest in references:
+        if full_copies.get(target) != digest:
+            problems.append(f"{location}: refers to {target}, which does not hold the same content in full")
+    missing = originals - set(full_copies.values())
+    if missing:
+        problems.append(f"{len(missing)} distinct file contents are not present in full anywhere")
+
+    rendered_before = sum(len(source.render().encode('utf-8')) for source in sources)
+    rendered_after = sum(len(source.render().encode('utf-8')) for source in assembled)
+    if rendered_before - rendered_after != report.total_bytes_saved:
+        problems.append(f"reported savings {report.total_bytes_saved} differ from the rendered difference {rendered_before - rendered_after}")
+    return problems
+
+
+def unresolved_references(text: str, assembled: list) -> list:
+    # References in text whose first copy is not in the same text in full
+    contents = {source.location(path): content for source in assembled for path, content in source.sections}
+    return [target for target in REFERENCE.findall(text) if contents[target] not in text]
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_nothing_unique_is_lost(compact):
+    sources = build_sources()
+    assembled, report = assemble_context(sources, compact)
+    assert verify(sources, assembled, report) == []
+    assert report.duplicates > 10 and report.collapsed == 1
+    # Attached files keep their content; the copies in the archive point to them
+    assert all(not REFERENCE.fullmatch(result.sections[0][1]) for result in assembled[2:])
+
+
+def test_references_to_reduced_first_copies_are_expanded_by_the_packer(monkeypatch):
+    monkeypatch.setattr(context_packer, "CONTEXT_BUDGET_TOKENS", 100_000)
+    budget = context_packer.context_budget("gemini-test")
+    rng = random.Random(1)
+    big = source_file(rng, "big", budget // 12)  # more than a file may take in full
+    small = source_file(rng, "small", 20)
+    filler = [(f"filler_{i}.py", source_file(rng, f"filler_{i}", budget // 200)) for i in range(6)]
+    sources = [
+        ContextSource("a.zip", 'zip', [("big.py", big), ("small.py", small), *filler]),
+        ContextSource("gh_repo:::example/b", 'repo', [("vendor/big.py", big), ("vendor/small.py", small)]),
+    ]
+    assembled, report = assemble_context(sources)
+    assert report.duplicates == 2
+
+    packed = pack_context(assembled, "", "gemini-test")
+    text = "\n".join(packed.parts)
+    assert "[Duplicate: same content as small.py in a.zip]" in text and small in text
+    assert "same content as big.py in a.zip" not in text  # the first copy is only an outline
+    assert "Outlined (2): big.py, vendor/big.py" in packed.manifest
+    assert unresolved_references(text, assembled) == []
+
+
+def test_packed_context_has_no_dangling_references(monkeypatch):
+    monkeypatch.setattr(context_packer, "CONTEXT_BUDGET_TOKENS", 100_000)
+    sources = build_sources(files=600, seed=2)
+    assembled, report = assemble_context(sources)
+    packed = pack_context(assembled, "mod_5 mod_17", "gemini-test")
+    assert packed.manifest is not None and report.duplicates
+    assert unresolved_references("\n".join(packed.parts), assembled) == []
+
+
+def test_references_are_expanded_in_shards_without_their_first_copy():
+    sources = build_sources(files=200, seed=3)
+    assembled, report = assemble_context(sources)
+    shards = split_into_shards(assembled, 8_000)
+    assert len(shards) > 3
+    rendered = [shard.render() for shard in shards]
+    assert all(unresolved_references(text, assembled) == [] for text in rendered)
+    # References stay references when their first copy is already in the same shard; the archive's
+    # copies of the attached files come before them and are expanded
+    (whole,) = split_into_shards(assembled, 1_000_000)
+    attached = {source.name for source in assembled if source.kind == 'file'}
+    assert len(REFERENCE.findall(whole.render())) == report.duplicates - len(attached)
+    # Every file is still in exactly one shard
+    assert sorted(path for shard in shards for path in shard.paths) == sorted(
+        path for source in assembled for path, _ in source.sections
+    )
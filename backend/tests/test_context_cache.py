@@ -0,0 +1,144 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+import context_cache
+from context_cache import CONTEXT_CACHE_UNSUPPORTED_BACKOFF, ContextCacheRegistry
+from tools import STREAMING_TOOL_CONFIG, TOOL_CONFIG, response_tools
+
+CONTEXT = ["x" * 4_000]  # 1000 estimated tokens
+
+
+class FakeCacheBackend:
+    # Local stand-in for GeminiCacheBackend: records creations and deletions, optionally fails
+    def __init__(self, error: Exception = None):
+        self.error = error
+        self.attempts = []
+        self.created = []
+        self.deleted = []
+
+    async def create(self, api_key, model, system_instruction, contents, tools, tool_config, ttl):
+        self.attempts.append(model)
+        await asyncio.sleep(0.01)
+        if self.error:
+            raise self.error
+        self.created.append((model, tool_config, ttl))
+        return SimpleNamespace(name=f"cachedContents/{len(self.created)}")
+
+    async def delete(self, api_key, cached_content):
+        self.deleted.append(cached_content.name)
+
+    def model_for(self, api_key, cached_content):
+        return SimpleNamespace(cached_content=cached_content.name)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [time.time()]
+    monkeypatch.setattr(context_cache.time, "time", lambda: now[0])
+    return now
+
+
+def registry(backend, **options) -> ContextCacheRegistry:
+    return ContextCacheRegistry(backend, **{"ttl": 3600, "min_tokens": 500, "max_entries": 8, "enabled": True, **options})
+
+
+async def get(cache: ContextCacheRegistry, contents=CONTEXT, model="gemini-test", tool_config=TOOL_CONFIG, api_key="key"):
+    cached_model, _, status = await cache.get_model(api_key, model, "system", contents, response_tools, tool_config)
+    return (cached_model.cached_content if cached_model else None), status
+
+
+def test_created_then_hit_then_separate_per_tool_config():
+    backend = FakeCacheBackend()
+    cache = registry(backend)
+
+    async def scenario():
+        # Concurrent first requests share one creation
+        first, second = await asyncio.gather(get(cache), get(cache))
+        assert first == second == ("cachedContents/1", "created") and len(backend.created) == 1
+        assert await get(cache) == ("cachedContents/1", "hit")
+        assert await get(cache, tool_config=STREAMING_TOOL_CONFIG) == ("cachedContents/2", "created")
+        assert await get(cache, api_key="other") == ("cachedContents/3", "created")
+
+    asyncio.run(scenario())
+    assert cache.stats()["hits"] == 1 and cache.stats()["entries"] == 3
+
+
+@pytest.mark.parametrize("options, contents", [
+    ({"enabled": False}, CONTEXT),
+    ({}, []),
+    ({"min_tokens": 2_000}, CONTEXT),
+])
+def test_bypass_without_creating(options, contents):
+    backend = FakeCacheBackend()
+    assert asyncio.run(get(registry(backend, **options), contents=contents)) == (None, "bypass")
+    assert backend.created == []
+
+
+def test_entries_close_to_expiry_are_recreated(clock):
+    backend = FakeCacheBackend()
+    cache = registry(backend, ttl=600)
+
+    async def scenario():
+        assert await get(cache) == ("cachedContents/1", "created")
+        clock[0] += 600 - context_cache.CONTEXT_CACHE_EXPIRY_MARGIN - 1
+        assert await get(cache) == ("cachedContents/1", "hit")
+        clock[0] += 1
+        assert await get(cache) == ("cachedContents/2", "created")
+
+    asyncio.run(scenario())
+    assert backend.created[0][2] == 600
+    assert backend.deleted == []  # expired on the provider side, nothing to delete
+
+
+def test_least_recently_used_entry_is_evicted_and_deleted_remotely():
+    backend = FakeCacheBackend()
+    cache = registry(backend, max_entries=2)
+    a, b, c = (["a" * 4_000], ["b" * 4_000], ["c" * 4_000])
+
+    async def scenario():
+        await get(cache, contents=a)
+        await get(cache, contents=b)
+        assert await get(cache, contents=a) == ("cachedContents/1", "hit")
+        await get(cache, contents=c)
+        await asyncio.sleep(0)  # the remote delete runs as a background task
+        assert backend.deleted == ["cachedContents/2"]
+        assert await get(cache, contents=b) == ("cachedContents/4", "created")
+
+    asyncio.run(scenario())
+    assert cache.stats()["evictions"] == 2
+
+
+def test_unsupported_model_backs_off(clock):
+    backend = FakeCacheBackend(google_exceptions.InvalidArgument("caching not supported"))
+    cache = registry(backend)
+    attempts = backend.attempts
+
+    async def scenario():
+        assert await get(cache) == (None, "bypass")
+        assert await get(cache) == (None, "bypass")
+        assert attempts == ["gemini-test"]  # no second attempt during the backoff
+        assert await get(cache, model="gemini-other") == (None, "bypass")
+        assert attempts == ["gemini-test", "gemini-other"]  # the backoff is per model
+
+        clock[0] += CONTEXT_CACHE_UNSUPPORTED_BACKOFF + 1
+        backend.error = None
+        assert await get(cache) == ("cachedContents/1", "created")
+
+    asyncio.run(scenario())
+    assert cache.stats()["fallbacks"] == 3
+
+
+def test_transient_errors_do_not_back_off():
+    backend = FakeCacheBackend(google_exceptions.ServiceUnavailable("try again"))
+    cache = registry(backend)
+
+    async def scenario():
+        assert await get(cache) == (None, "bypass")
+        backend.error = None
+        assert await get(cache) == ("cachedContents/1", "created")
+
+    asyncio.run(scenario())
@@ -0,0 +1,43 @@
+import context_packer
+from context_packer import ContextSource, _head, _outline, _priority, _prompt_terms, _term_patterns, pack_context
+
+PYTHON_FILE = "import os\n\n\nclass Parser:\n    def parse(self):\n        return 1\n\n    @property\n    def name(self):\n        return 'p'\n"
+
+
+def test_outline_keeps_declarations_only():
+    outline = _outline(PYTHON_FILE, 1_000)
+    assert outline.splitlines() == [
+        "[Outline only: 4 of 11 lines shown]", "class Parser:", "    def parse(self):", "    @property", "    def name(self):",
+    ]
+    assert _outline("x = 1\n" * 10, 1_000) is None
+    # Gives up once the kept lines cannot fit, and does not even scan when the notice alone would not
+    assert _outline(PYTHON_FILE * 100, 50) is None
+    assert _outline(PYTHON_FILE, 8) is None
+
+
+def test_head_keeps_the_first_lines_that_fit():
+    content = "\n".join(f"line {i}" for i in range(1_000))
+    head = _head(content, 20)
+    assert head.splitlines()[0] == "[Truncated: first 6 of 1000 lines shown]"
+    assert head.splitlines()[1:] == [f"line {i}" for i in range(6)]
+    assert _head(content, 4) is None
+
+
+def test_prompt_terms_only_count_whole_identifiers():
+    terms = _term_patterns(_prompt_terms("fix the parser"))
+    source = ContextSource("repo.zip", "zip", [])
+    assert _priority(source, "notes.txt", "the parser is broken", terms) > _priority(source, "notes.txt", "the parsers are fine", terms)
+    assert _priority(source, "src/parser.py", "", terms) > _priority(source, "src/lexer.py", "", terms)
+
+
+def test_over_budget_keeps_relevant_files_and_lists_the_rest(monkeypatch):
+    monkeypatch.setattr(context_packer, "CONTEXT_BUDGET_TOKENS", 100_000)
+    budget = context_packer.context_budget("gemini-test")
+    big = ("def step():\n" + "    x = 1\n" * 20) * (budget // 40)  # larger than a file may take in full
+    source = ContextSource("repo.zip", "zip", [("src/parser.py", "def parse():\n    pass\n"), ("src/big.py", big), ("data.csv", "1,2\n" * budget)])
+
+    packed = pack_context([source], "fix the parser", "gemini-test")
+    assert packed.tokens_packed <= budget < packed.tokens_before
+    assert "def parse():\n    pass" in packed.parts[0]
+    assert "Outlined (1): src/big.py" in packed.manifest and "Truncated (1): data.csv" in packed.manifest
+    assert pack_context([ContextSource("a.py", "file", [("a.py", "a = 1")])], "", "gemini-test").manifest is None
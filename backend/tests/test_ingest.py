@@ -0,0 +1,79 @@
+import io
+import zipfile
+
+import pytest
+
+import ingest
+from ingest import BINARY_PLACEHOLDER, ZipLimitError, render_file_section, split_repository_dump, zip_file_sections
+
+
+def make_zip(members: dict) -> io.BytesIO:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+def test_sections_strip_the_common_root_and_apply_ignore_rules():
+    upload = make_zip({
+        "project/.gitignore": "*.tmp\n",
+        "project/src/b.py": "b = 2\n",
+        "project/src/a.py": "a = 1\n",
+        "project/node_modules/dep/index.js": "ignored\n",
+        "project/scratch.tmp": "ignored\n",
+        "project/logo.png": b"\x89PNG\0\0",
+    })
+    assert zip_file_sections(upload) == [
+        (".gitignore", "*.tmp\n"), ("logo.png", BINARY_PLACEHOLDER), ("src/a.py", "a = 1\n"), ("src/b.py", "b = 2\n"),
+    ]
+
+
+def test_small_highly_compressible_member_is_accepted():
+    # 200 KB of whitespace deflates to a few hundred bytes: far above the ratio limit, but harmless
+    upload = make_zip({"src/app.py": "x = 1\n", "docs/blank.txt": " " * 200_000})
+    sections = dict(zip_file_sections(upload))
+    assert sections["docs/blank.txt"] == " " * 200_000
+
+
+def test_large_member_with_suspicious_ratio_is_rejected():
+    upload = make_zip({"bomb.txt": "\0" * (2 * 1024 * 1024)})
+    with pytest.raises(ZipLimitError, match="compression ratio"):
+        zip_file_sections(upload)
+
+
+def test_many_small_members_with_a_suspicious_overall_ratio_are_rejected():
+    # Every member stays below the per-member threshold, the archive as a whole does not
+    upload = make_zip({f"part_{i}.txt": "\0" * (ingest.ZIP_RATIO_CHECK_MIN_BYTES - 1) for i in range(3)})
+    with pytest.raises(ZipLimitError, match="Archive has a suspicious compression ratio"):
+        zip_file_sections(upload)
+
+
+def test_binary_members_are_only_read_as_far_as_the_sniffed_head(monkeypatch):
+    reads = []
+    original_read = zipfile.ZipExtFile.read
+
+    def read(member, n=-1):
+        data = original_read(member, n)
+        reads.append((member.name, len(data)))
+        return data
+
+    monkeypatch.setattr(zipfile.ZipExtFile, "read", read)
+    upload = make_zip({"image.bin": b"\0" + bytes(range(256)) * 4_000, "app.py": "print(1)\n"})
+    assert zip_file_sections(upload) == [("app.py", "print(1)\n"), ("image.bin", BINARY_PLACEHOLDER)]
+    assert sum(size for name, size in reads if name == "image.bin") == ingest.BINARY_SNIFF_BYTES
+
+
+def test_total_uncompressed_size_is_limited(monkeypatch):
+    monkeypatch.setattr(ingest, "ZIP_MAX_TOTAL_UNCOMPRESSED", 1000)
+    upload = make_zip({"a.txt": "a" * 600, "b.txt": "b" * 600})
+    with pytest.raises(ZipLimitError, match="expands to more than"):
+        zip_file_sections(upload)
+
+
+def test_repository_dump_round_trip():
+    sections = [("README.md", "# Title\n\n```python\nprint(1)\n```"), ("src/app.py", "print('hi')\n")]
+    text = "\n".join(render_file_section(path, content) for path, content in sections)
+    assert split_repository_dump(text) == sections
+    assert split_repository_dump("just some text") == []
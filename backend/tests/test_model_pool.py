@@ -0,0 +1,80 @@
+import asyncio
+import random
+
+import pytest
+from google.ai import generativelanguage as glm
+from google.generativeai import client as genai_client
+from google.generativeai import protos
+
+from model_pool import ModelClientPool
+from tools import response_tools
+
+
+@pytest.fixture
+def echo_transport(monkeypatch):
+    # Real SDK clients, but generate_content answers with the API key its client was built with,
+    # so a request sent with the wrong key is visible in the answer
+    original_make_client = genai_client._ClientManager.make_client
+
+    def make_client(manager, name):
+        client = original_make_client(manager, name)
+        client.test_api_key = manager.client_config["client_options"].api_key
+        return client
+
+    async def generate_content(client, request, **kwargs):
+        await asyncio.sleep(random.random() / 1000)
+        return protos.GenerateContentResponse(candidates=[{
+            "content": {"role": "model", "parts": [{"text": client.test_api_key}]}, "finish_reason": 1,
+        }])
+
+    monkeypatch.setattr(genai_client._ClientManager, "make_client", make_client)
+    monkeypatch.setattr(glm.GenerativeServiceAsyncClient, "generate_content", generate_content)
+
+
+def test_concurrent_requests_never_use_another_keys_client(echo_transport):
+    pool = ModelClientPool()
+    keys = [f"test-key-{i:02d}" for i in range(20)]
+
+    async def request(api_key: str) -> str:
+        model = pool.model(api_key, "gemini-test", tools=[response_tools])
+        await asyncio.sleep(0)  # other requests build and use their models in between
+        return (await model.generate_content_async("ping")).text
+
+    async def scenario():
+        sent = [keys[i % len(keys)] for i in range(400)]
+        answered = await asyncio.gather(*(request(api_key) for api_key in sent))
+        assert [api_key for api_key, answer in zip(sent, answered) if api_key != answer] == []
+
+    asyncio.run(scenario())
+    # One model per key, reused by every later request with that key
+    assert pool.stats()["models_created"] == len(keys) and pool.stats()["models_reused"] == 400 - len(keys)
+
+
+def test_models_are_pooled_per_model_and_tool_set(echo_transport):
+    pool = ModelClientPool()
+
+    async def scenario():
+        # The async clients are created on the running event loop, as in a request
+        with_tools = pool.model("key", "gemini-test", tools=[response_tools])
+        assert pool.model("key", "gemini-test", tools=[response_tools]) is with_tools
+        assert pool.model("key", "gemini-test") is not with_tools
+        assert pool.model("key", "gemini-other", tools=[response_tools]) is not with_tools
+        assert pool.model("other-key", "gemini-test", tools=[response_tools]) is not with_tools
+
+    asyncio.run(scenario())
+
+
+def test_least_recently_used_keys_are_dropped(echo_transport):
+    pool = ModelClientPool(max_keys=2)
+
+    async def scenario():
+        first = pool.model("a", "gemini-test")
+        pool.model("b", "gemini-test")
+        assert pool.model("a", "gemini-test") is first
+        pool.model("c", "gemini-test")  # "b" is the least recently used key now
+        assert pool.stats()["pooled_keys"] == 2 and pool.stats()["evictions"] == 1
+        assert pool.model("a", "gemini-test") is first
+        # Rebuilt with a client of its own
+        assert (await pool.model("b", "gemini-test").generate_content_async("ping")).text == "b"
+
+    asyncio.run(scenario())
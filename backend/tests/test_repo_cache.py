@@ -0,0 +1,133 @@
+import asyncio
+import time
+
+import pytest
+
+import cache_store
+from cache_store import MemoryCacheStore, SqliteCacheStore
+from clone_jobs import CloneJobs
+from conftest import git
+from ingest import IGNORE_RULES_VERSION
+from repo_cache import RepoCache
+from repo_mirror import RepoMirror
+
+
+class CountingMirror(RepoMirror):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.refreshes = 0
+
+    async def refresh(self, *args, **kwargs):
+        self.refreshes += 1
+        return await super().refresh(*args, **kwargs)
+
+
+def make_jobs(tmp_path, store=None):
+    mirror = CountingMirror(str(tmp_path / "mirrors"))
+    cache = RepoCache(store or MemoryCacheStore())
+    return CloneJobs(mirror, cache, job_dir=str(tmp_path / "jobs")), mirror, cache
+
+
+async def clone(jobs: CloneJobs, url: str, branch=None):
+    job_id = jobs.submit("owner/repo", branch, url, "gh_repo:::owner---repo")
+    text = await jobs.wait(job_id)
+    return text, jobs.status(job_id)
+
+
+def test_hit_returns_the_stored_dump_without_cloning(tmp_path, bare_repo):
+    first_sha = bare_repo.commit({"README.md": "hello\n", "src/app.py": "print('hi')\n"})
+    jobs, mirror, cache = make_jobs(tmp_path)
+
+    async def scenario():
+        text, status = await clone(jobs, bare_repo.url)
+        assert status["status"] == "done" and status["commit"] == first_sha
+        assert "File: src/app.py" in text and mirror.refreshes == 1
+        assert cache.stats() == {"hits": 0, "misses": 1}
+
+        cached_text, cached_status = await clone(jobs, bare_repo.url)
+        assert cached_text == text
+        assert cached_status["commit"] == first_sha
+        assert mirror.refreshes == 1  # served from the cache: no fetch, no render
+        assert "cloning" not in cached_status["timings"]
+        assert cache.stats() == {"hits": 1, "misses": 1}
+
+    asyncio.run(scenario())
+
+
+def test_hits_do_not_wait_for_a_clone_slot(tmp_path, bare_repo):
+    bare_repo.commit({"a.py": "a = 1\n"})
+    jobs, mirror, _ = make_jobs(tmp_path)
+    jobs.concurrency = 1
+
+    async def scenario():
+        text, _ = await clone(jobs, bare_repo.url)
+        async with jobs._slot():  # a long fetch of another repository holds the only slot
+            cached_text, status = await asyncio.wait_for(clone(jobs, bare_repo.url), timeout=5)
+        assert cached_text == text and mirror.refreshes == 1
+        assert "slot_wait" not in status["timings"]
+
+    asyncio.run(scenario())
+
+
+def test_new_commit_is_a_miss(tmp_path, bare_repo):
+    bare_repo.commit({"a.py": "a = 1\n"})
+    jobs, mirror, cache = make_jobs(tmp_path)
+
+    async def scenario():
+        await clone(jobs, bare_repo.url)
+        second_sha = bare_repo.commit({"b.py": "b = 2\n"})
+        text, status = await clone(jobs, bare_repo.url)
+        assert status["commit"] == second_sha
+        assert "File: b.py" in text
+        assert mirror.refreshes == 2
+        assert cache.stats() == {"hits": 0, "misses": 2}
+        # Both commits stay cached under their own keys
+        assert cache.get(RepoCache.make_key("owner/repo", second_sha, IGNORE_RULES_VERSION)) == text
+
+    asyncio.run(scenario())
+
+
+def test_branches_are_resolved_and_cached_separately(tmp_path, bare_repo):
+    bare_repo.commit({"main.py": "main = 1\n"})
+    git("checkout", "--quiet", "-b", "feature", cwd=bare_repo.work)
+    feature_sha = bare_repo.commit({"feature.py": "feature = 1\n"})
+    git("push", "--quiet", "origin", "feature", cwd=bare_repo.work)
+    jobs, _, _ = make_jobs(tmp_path)
+
+    async def scenario():
+        main_text, _ = await clone(jobs, bare_repo.url)
+        feature_text, status = await clone(jobs, bare_repo.url, branch="feature")
+        assert status["commit"] == feature_sha
+        assert "File: feature.py" in feature_text and "File: feature.py" not in main_text
+
+    asyncio.run(scenario())
+
+
+def test_unknown_repository_fails_the_job(tmp_path):
+    jobs, _, _ = make_jobs(tmp_path)
+
+    async def scenario():
+        with pytest.raises(Exception):
+            await clone(jobs, (tmp_path / "missing.git").as_uri())
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_lru_eviction_by_size(tmp_path, monkeypatch, backend):
+    # Every read refreshes the LRU position, so the least recently *used* dump goes first
+    monkeypatch.setattr(cache_store, "CACHE_STORE_TOUCH_INTERVAL", 0)
+    options = {"max_bytes": 2500, "compress_min_bytes": 1 << 30}
+    store = MemoryCacheStore(**options) if backend == "memory" else SqliteCacheStore(str(tmp_path / "cache.sqlite3"), **options)
+    cache = RepoCache(store)
+
+    for name in ("old", "used", "new"):
+        if name == "new":
+            assert cache.get("used") is not None
+        cache.put(name, name[0] * 1000)
+        time.sleep(0.01)
+
+    assert cache.get("old") is None
+    assert cache.get("used") == "u" * 1000
+    assert cache.get("new") == "n" * 1000
+    assert store.stats()["evictions"] == 1
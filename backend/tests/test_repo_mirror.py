@@ -0,0 +1,53 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from repo_mirror import RepoMirror, RepoMirrorError
+
+
+def test_failed_first_fetch_leaves_no_mirror(tmp_path):
+    mirror = RepoMirror(str(tmp_path / "mirrors"))
+    with pytest.raises(RepoMirrorError):
+        asyncio.run(mirror.refresh((tmp_path / "missing.git").as_uri()))
+    assert list((tmp_path / "mirrors").glob("*.git")) == []
+
+
+def test_failed_refetch_keeps_the_existing_mirror(tmp_path, bare_repo):
+    bare_repo.commit({"a.py": "a = 1\n"})
+    mirror = RepoMirror(str(tmp_path / "mirrors"))
+    asyncio.run(mirror.refresh(bare_repo.url))
+    with pytest.raises(RepoMirrorError):
+        asyncio.run(mirror.refresh(bare_repo.url, "no-such-branch"))
+    assert len(list((tmp_path / "mirrors").glob("*.git"))) == 1
+
+
+def test_sweep_evicts_least_recently_used_mirrors(tmp_path, bare_repo):
+    bare_repo.commit({"a.py": "a = 1\n" * 100})
+    mirror = RepoMirror(str(tmp_path / "mirrors"), sweep_interval=3600)
+    urls = [bare_repo.url, f"file://{bare_repo.path}/", f"file://{bare_repo.path}/."]
+
+    async def scenario():
+        for url in urls:
+            await mirror.refresh(url)
+
+    asyncio.run(scenario())
+    git_dirs = {url: mirror._paths(url)[0] for url in urls}
+    # Oldest use first: urls[0], then urls[1]; urls[2] was used last
+    now = time.time()
+    for age, url in zip((300, 200, 100), urls):
+        os.utime(mirror._paths(url)[1], (now - age, now - age))
+    one_mirror = RepoMirror._disk_usage(git_dirs[urls[2]])
+
+    mirror.max_bytes = one_mirror * 2 + one_mirror // 2
+    assert mirror.sweep() == 1
+    assert not git_dirs[urls[0]].exists() and git_dirs[urls[1]].exists() and git_dirs[urls[2]].exists()
+    # The lock file stays: removing it would let a waiting worker and a new one lock two different files
+    assert mirror._paths(urls[0])[1].exists()
+
+    mirror.max_bytes, mirror.max_age = 0, 150
+    assert mirror.sweep(keep=git_dirs[urls[1]]) == 0  # the only expired mirror is the one in use
+    assert mirror.sweep() == 1
+    assert [path.name for path in (tmp_path / "mirrors").glob("*.git")] == [git_dirs[urls[2]].name]
+    assert mirror.stats()["mirrors_evicted"] == 2
@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import context_packer
+import main
+import sharding
+from conftest import FakeModel, function_call, model_response
+from context_packer import ContextSource, estimate_tokens
+from model_pool import model_pool
+from sharding import NO_RELEVANT_CONTENT, SHARD_PROMPT_TOKENS, ShardingError, run_map_phase, split_into_shards
+
+
+def numbered_lines(prefix: str, count: int) -> str:
+    return "\n".join(f"{prefix} line {i:05d}" for i in range(count))
+
+
+def test_shards_keep_files_whole_and_in_order():
+    sections = [(f"src/m{i}.py", numbered_lines(f"m{i}", 200)) for i in range(12)]
+    sources = [ContextSource("repo.zip", "zip", sections), ContextSource("logo.png", "file", [], binary=True)]
+    shards = split_into_shards(sources, 6_000)
+
+    assert len(shards) > 1 and [shard.index for shard in shards] == list(range(len(shards)))
+    assert [path for shard in shards for path in shard.paths] == [path for path, _ in sections]
+    assert all(shard.tokens <= 6_000 - SHARD_PROMPT_TOKENS for shard in shards)
+
+
+def test_a_file_larger_than_a_shard_is_cut_by_lines():
+    content = numbered_lines("big", 2_000)
+    shards = split_into_shards([ContextSource("big.py", "file", [("big.py", content)])], 1_000 + SHARD_PROMPT_TOKENS)
+
+    pieces = [section for shard in shards for section in shard.sections]
+    assert len(pieces) >= len(shards) > 1
+    assert all(shard.tokens <= 1_000 for shard in shards)
+    assert [path for path, _ in pieces] == [f"big.py (part {i + 1}/{len(pieces)})" for i in range(len(pieces))]
+    assert "\n".join(piece for _, piece in pieces) == content
+
+
+class ShardModel(FakeModel):
+    # Answers map calls by what the shard holds: SLOW never answers, BROKEN fails, EMPTY finds nothing
+    async def generate_content_async(self, contents, stream: bool = False, **kwargs):
+        self.calls.append({"contents": contents, "stream": stream, **kwargs})
+        shard_text = contents[-1]
+        if "SLOW" in shard_text:
+            await asyncio.sleep(60)
+        if "BROKEN" in shard_text:
+            raise RuntimeError("upstream exploded")
+        if "EMPTY" in shard_text:
+            return model_response({"text": NO_RELEVANT_CONTENT})
+        return model_response({"text": f"notes on {shard_text.split()[2]}"})
+
+
+def one_file_shards(*markers: str) -> list:
+    # Each file takes more than half a shard, so every shard holds one file
+    sections = [(f"{marker.lower()}_{i}.py", f"{marker} " + "x " * 1_300) for i, marker in enumerate(markers)]
+    shards = split_into_shards([ContextSource("repo.zip", "zip", sections)], 1_000 + SHARD_PROMPT_TOKENS)
+    assert len(shards) == len(markers)
+    return shards
+
+
+def test_map_phase_reports_a_timed_out_and_a_failed_shard():
+    shards = one_file_shards("OK", "SLOW", "BROKEN", "OK", "EMPTY")
+    result = asyncio.run(run_map_phase(ShardModel(), "explain", shards, concurrency=2, timeout=0.2))
+
+    assert set(result.notes) == {0, 3, 4}
+    assert result.failures[1] == "timed out after 0.2s"
+    assert result.failures[2] == "RuntimeError: upstream exploded"
+    rendered = result.render()
+    assert "### Part 1/5 (1 files)\nnotes on ok_0.py" in rendered and "notes on ok_3.py" in rendered
+    assert "[Not analysed: timed out after 0.2s. Files: slow_1.py]" in rendered
+    assert "[Not analysed: RuntimeError: upstream exploded. Files: broken_2.py]" in rendered
+    assert "Part 5/5" not in rendered  # nothing relevant in it
+    assert result.headers()["X-Context-Shards-Failed"] == "2"
+
+
+def test_map_phase_fails_when_too_many_shards_are_lost(monkeypatch):
+    monkeypatch.setattr(sharding, "SHARD_MAX_FAILED_RATIO", 0.5)
+    # Exactly half lost is still answered from the rest
+    result = asyncio.run(run_map_phase(ShardModel(), "explain", one_file_shards("OK", "BROKEN"), timeout=0.2))
+    assert list(result.failures) == [1]
+    with pytest.raises(ShardingError, match="2 of 3 parts"):
+        asyncio.run(run_map_phase(ShardModel(), "explain", one_file_shards("OK", "BROKEN", "SLOW"), timeout=0.2))
+    with pytest.raises(ShardingError, match="1 of 1 parts"):
+        asyncio.run(run_map_phase(ShardModel(), "explain", one_file_shards("BROKEN"), timeout=0.2))
+
+
+def test_generate_answers_oversized_context_from_shard_notes(monkeypatch):
+    monkeypatch.setattr(context_packer, "CONTEXT_BUDGET_TOKENS", 100_000)
+    map_model = ShardModel()
+    answer_model = FakeModel(function_call("make_text", content="Answer from the notes."))
+    monkeypatch.setattr(model_pool, "model", lambda api_key, name, tools=None: answer_model if tools else map_model)
+    content = numbered_lines("code", 12_000)
+    assert estimate_tokens(content) > context_packer.context_budget("gemini-test")
+
+    with TestClient(main.app) as client:
+        response = client.post("/api/generate", data={
+            "apiKey": "test-key", "prompt": "hi", "model": "gemini-test", "refinerModel": "gemini-test",
+            "sharded": "true", "noCache": "true",
+        }, files=[("files", ("big.py", content.encode(), "text/plain"))])
+
+    assert response.status_code == 200
+    assert response.json() == [{"type": "text", "content": "Answer from the notes."}]
+    shards = int(response.headers["X-Context-Shards"])
+    assert shards > 1 and len(map_model.calls) == shards and response.headers["X-Context-Shards-Failed"] == "0"
+    # The answer is generated from the notes, not from the attached code
+    final_prompt = "\n".join(answer_model.calls[0]["contents"])
+    assert "--- Codebase Analysis Notes (collected from" in final_prompt and "notes on big.py" in final_prompt
+    assert "code line 00001" not in final_prompt
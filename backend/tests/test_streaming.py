@@ -0,0 +1,86 @@
+import asyncio
+import json
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from conftest import FakeModel, function_call
+from model_pool import model_pool
+from response_blocks import stream_blocks
+from tools import STREAMING_INSTRUCTION, STREAMING_TOOL_CONFIG, TOOL_CONFIG
+
+BLOCK_CALLS = (
+    function_call("make_heading", content="Answer"),
+    function_call("make_text", content="First paragraph."),
+    function_call("make_code", language="python", content="print('hi')"),
+)
+
+
+def parse_events(body: str) -> list:
+    events = []
+    for raw in body.strip().split("\n\n"):
+        name, data = raw.split("\n", 1)
+        events.append((name[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+async def collect(model: FakeModel, log: list) -> list:
+    events = []
+    async for event in stream_blocks(await model.generate_content_async([], stream=True), time.perf_counter()):
+        events.append(event)
+        log.append(event.split("\n", 1)[0])
+    return parse_events("".join(events))
+
+
+def test_each_block_is_sent_before_the_next_chunk_arrives():
+    model = FakeModel(*BLOCK_CALLS, chunk_delay=0.05)
+    events = asyncio.run(collect(model, model.events))
+
+    assert model.events == ["chunk 0", "event: block", "chunk 1", "event: block", "chunk 2", "event: block", "event: done"]
+    assert [data["type"] for name, data in events if name == "block"] == ["heading", "text", "code"]
+    done = events[-1][1]
+    assert done["blocks"] == 3
+    # The first block is out after the first chunk, not once the whole answer has been generated
+    assert done["time_to_first_block_ms"] < 50 <= done["total_ms"] - done["time_to_first_block_ms"]
+
+
+@pytest.mark.parametrize("parts, expected", [
+    (({"text": "Plain "}, {"text": "answer"}), [{"type": "text", "content": "Plain answer"}]),
+    (
+        (function_call("generate_structured_response", parts=[{"type": "video", "content": "x"}]), {"text": "raw"}),
+        [{"type": "text", "content": "[Fallback Content]\nraw"}],
+    ),
+])
+def test_streams_without_blocks_fall_back_like_the_json_endpoint(parts, expected):
+    events = asyncio.run(collect(FakeModel(*parts), []))
+    assert [data for name, data in events if name == "block"] == expected
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    model = FakeModel(*BLOCK_CALLS)
+    monkeypatch.setattr(model_pool, "model", lambda api_key, name, tools=None: model)
+    return model
+
+
+def generate(client: TestClient, stream: bool):
+    return client.post("/api/generate", data={
+        "apiKey": "test-key", "prompt": "hi", "model": "gemini-test", "refinerModel": "gemini-test",
+        "stream": str(stream).lower(), "noCache": "true",
+    })
+
+
+def test_streams_only_allow_the_block_tools(fake_model):
+    with TestClient(main.app) as client:
+        streamed = generate(client, stream=True)
+        complete = generate(client, stream=False)
+
+    assert streamed.status_code == 200 and complete.status_code == 200
+    assert [name for name, _ in parse_events(streamed.text)] == ["block", "block", "block", "done"]
+    stream_call, complete_call = fake_model.calls
+    assert stream_call["stream"] and stream_call["tool_config"] == STREAMING_TOOL_CONFIG
+    assert any(STREAMING_INSTRUCTION in part for part in stream_call["contents"])
+    assert not complete_call["stream"] and complete_call["tool_config"] == TOOL_CONFIG
+    assert not any(STREAMING_INSTRUCTION in part for part in complete_call["contents"])
@@ -0,0 +1,137 @@
+import asyncio
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from upstream import UpstreamBusy, UpstreamScheduler
+
+
+class FakeUpstream:
+    # Scripted model calls: every call to a model takes the next (delay, outcome) of its script,
+    # the last one repeating. Outcomes that are exceptions are raised.
+    def __init__(self, scripts: dict):
+        self.scripts = {model: list(script) for model, script in scripts.items()}
+        self.calls = []
+        self.cancelled = []
+
+    async def __call__(self, model: str):
+        index = len(self.calls)
+        self.calls.append(model)
+        script = self.scripts[model]
+        delay, outcome = script.pop(0) if len(script) > 1 else script[0]
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled.append(index)
+            raise
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def scheduler(**options) -> UpstreamScheduler:
+    defaults = {"rate": 100, "burst": 10, "max_queue": 8, "max_wait": 5, "max_retries": 0, "backoff_base": 0.001,
+                "fallback_models": [], "hedge_after": 0}
+    return UpstreamScheduler(**{**defaults, **options})
+
+
+def test_calls_beyond_the_queue_limit_are_rejected_at_once():
+    upstream = scheduler(rate=0.5, burst=1, max_queue=2)
+    fake = FakeUpstream({"m": [(0, "ok")]})
+
+    async def scenario():
+        assert (await upstream.call("key", "m", fake))[0] == "ok"  # takes the only token
+        queued = [asyncio.ensure_future(upstream.call("key", "m", fake)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        with pytest.raises(UpstreamBusy, match="Too many requests are queued") as rejected:
+            await upstream.call("key", "m", fake)
+        assert rejected.value.retry_after == pytest.approx(4)
+        # Another key has a bucket of its own
+        assert (await upstream.call("other-key", "m", fake))[0] == "ok"
+        for task in queued:
+            task.cancel()
+        await asyncio.gather(*queued, return_exceptions=True)
+
+    asyncio.run(scenario())
+    assert fake.calls == ["m", "m"] and upstream.stats()["rejected"] == 1
+
+
+def test_calls_that_would_wait_too_long_are_rejected():
+    upstream = scheduler(rate=1, burst=1)
+    fake = FakeUpstream({"m": [(0, "ok")]})
+
+    async def scenario():
+        await upstream.call("key", "m", fake)
+        # The next token is a second away
+        with pytest.raises(UpstreamBusy, match="Timed out") as rejected:
+            await upstream.call("key", "m", fake, max_wait=0.1)
+        assert 0.9 < rejected.value.retry_after <= 1
+        # A call behind one that is already waiting for the token times out in the queue
+        waiting = asyncio.ensure_future(upstream.call("key", "m", fake, max_wait=5))
+        await asyncio.sleep(0.01)
+        with pytest.raises(UpstreamBusy, match="Timed out"):
+            await upstream.call("key", "m", fake, max_wait=0.1)
+        result, report = await waiting
+        assert result == "ok" and report["queued_ms"] > 500
+
+    asyncio.run(scenario())
+    assert upstream.stats()["rejected"] == 2
+
+
+def test_retries_then_falls_back_in_order():
+    upstream = scheduler(max_retries=1, fallback_models=["fallback-a", "fallback-b"])
+    fake = FakeUpstream({
+        "primary": [(0, google_exceptions.ServiceUnavailable("down"))],
+        "fallback-a": [(0, google_exceptions.ResourceExhausted("quota")), (0, "from fallback-a")],
+        "fallback-b": [(0, "from fallback-b")],
+    })
+
+    result, report = asyncio.run(upstream.call("key", "primary", fake))
+    assert result == "from fallback-a"
+    assert fake.calls == ["primary", "primary", "fallback-a", "fallback-a"]
+    assert report["model"] == "fallback-a" and report["attempts"] == 4
+    assert upstream.stats()["retries"] == 2 and upstream.stats()["fallbacks"] == 1
+
+
+def test_last_retryable_error_is_raised_and_others_are_not_retried():
+    upstream = scheduler(max_retries=1, fallback_models=["fallback"])
+    fake = FakeUpstream({
+        "primary": [(0, google_exceptions.ServiceUnavailable("down"))],
+        "fallback": [(0, google_exceptions.InternalServerError("broken"))],
+    })
+    with pytest.raises(google_exceptions.InternalServerError):
+        asyncio.run(upstream.call("key", "primary", fake))
+    assert fake.calls == ["primary", "primary", "fallback", "fallback"]
+
+    fake = FakeUpstream({"primary": [(0, google_exceptions.InvalidArgument("bad request"))], "fallback": [(0, "ok")]})
+    with pytest.raises(google_exceptions.InvalidArgument):
+        asyncio.run(upstream.call("key", "primary", fake))
+    assert fake.calls == ["primary"]
+
+
+def test_hedge_wins_and_cancels_the_slow_first_request():
+    upstream = scheduler(hedge_after=0.05)
+    fake = FakeUpstream({"m": [(5, "slow"), (0.01, "hedged")]})
+
+    result, report = asyncio.run(upstream.call("key", "m", fake))
+    assert result == "hedged" and report["attempts"] == 1
+    assert fake.calls == ["m", "m"] and fake.cancelled == [0]
+    assert upstream.stats()["hedges"] == 1 and upstream.stats()["hedge_wins"] == 1
+
+
+def test_first_request_winning_cancels_the_hedge():
+    upstream = scheduler(hedge_after=0.05)
+    fake = FakeUpstream({"m": [(0.1, "first"), (5, "hedged")]})
+
+    result, _ = asyncio.run(upstream.call("key", "m", fake))
+    assert result == "first" and fake.cancelled == [1]
+    assert upstream.stats()["hedges"] == 1 and upstream.stats()["hedge_wins"] == 0
+
+
+def test_no_hedge_without_a_spare_token():
+    upstream = scheduler(burst=1, rate=0.1, hedge_after=0.05)
+    fake = FakeUpstream({"m": [(0.2, "first")]})
+
+    result, _ = asyncio.run(upstream.call("key", "m", fake))
+    assert result == "first" and fake.calls == ["m"]
+    assert upstream.stats()["hedges"] == 0
@@ -152,6 +152,17 @@ ALL_TOOL_NAMES = [
     "make_quote_heading", "make_text", "make_code", "make_math", "make_list"
 ]
 
+# Every answer is a function call: generate_structured_response for the whole answer, or make_* tools
+TOOL_CONFIG = {"function_calling_config": "ANY"}
+# Streams only allow the make_* tools, one call per block. Each call is complete in the chunk that carries it,
+# so the first block is sent while the model still writes the rest; a generate_structured_response call
+# would only arrive once the whole answer is done.
+STREAMING_TOOL_CONFIG = {"function_calling_config": {"mode": "ANY", "allowed_function_names": ALL_TOOL_NAMES}}
+STREAMING_INSTRUCTION = (
+    "Streaming answer: 'generate_structured_response' is not available. Send the answer as a sequence of "
+    "make_* calls, one call per block, in reading order."
+)
+
 # Collect ALL tools into one set
 response_tools = genai.protos.Tool(
     function_declarations=[
@@ -0,0 +1,237 @@
+import asyncio
+import hashlib
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from google.api_core import exceptions as google_exceptions
+
+from metrics import UPSTREAM_ERRORS
+
+# --- Settings ---
+# Token bucket per API key: sustained requests per second and burst size
+UPSTREAM_RATE_PER_KEY = float(os.environ.get("UPSTREAM_RATE_PER_KEY", "2"))
+UPSTREAM_BURST = int(os.environ.get("UPSTREAM_BURST", "6"))
+# Calls waiting for a token per key, and how long one may wait before it is rejected
+UPSTREAM_QUEUE_MAX = int(os.environ.get("UPSTREAM_QUEUE_MAX", "32"))
+UPSTREAM_MAX_WAIT = float(os.environ.get("UPSTREAM_MAX_WAIT", "30"))
+UPSTREAM_MAX_RETRIES = int(os.environ.get("UPSTREAM_MAX_RETRIES", "3"))
+UPSTREAM_BACKOFF_BASE = float(os.environ.get("UPSTREAM_BACKOFF_BASE", "1"))
+UPSTREAM_BACKOFF_MAX = float(os.environ.get("UPSTREAM_BACKOFF_MAX", "20"))
+# Comma-separated models to try, in order, once the requested one keeps failing with retryable errors
+UPSTREAM_FALLBACK_MODELS = [m.strip() for m in os.environ.get("UPSTREAM_FALLBACK_MODELS", "").split(",") if m.strip()]
+# Send a second, identical request if the first has not answered after this many seconds (0 = off)
+UPSTREAM_HEDGE_AFTER = float(os.environ.get("UPSTREAM_HEDGE_AFTER", "0"))
+UPSTREAM_BUCKET_IDLE_SECONDS = 3600
+
+RETRYABLE_ERRORS = (
+    google_exceptions.ResourceExhausted,   # 429
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServiceUnavailable,  # 503
+    google_exceptions.InternalServerError,  # 500
+    google_exceptions.DeadlineExceeded,     # 504
+)
+
+
+class UpstreamBusy(Exception):
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.waiting = 0
+        self._lock = asyncio.Lock()  # FIFO: waiters are admitted in arrival order
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> bool:
+        self._refill()
+        if self.waiting or self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    async def acquire(self, max_wait: float, max_queue: int) -> float:
+        # Returns the time spent waiting; raises UpstreamBusy instead of queueing past the limits
+        if self.waiting >= max_queue:
+            raise UpstreamBusy("Too many requests are queued for this API key.", self.waiting / self.rate)
+        started_at = time.monotonic()
+        deadline = started_at + max_wait
+        self.waiting += 1
+        try:
+            if self._lock.locked():
+                try:
+                    await asyncio.wait_for(self._lock.acquire(), max(0.001, deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    raise UpstreamBusy("Timed out waiting for this API key's rate limit.", self.waiting / self.rate)
+            else:
+                await self._lock.acquire()
+            try:
+                self._refill()
+                if self.tokens < 1:
+                    wait = (1 - self.tokens) / self.rate
+                    if time.monotonic() + wait > deadline:
+                        raise UpstreamBusy("Timed out waiting for this API key's rate limit.", wait)
+                    await asyncio.sleep(wait)
+                    self._refill()
+                self.tokens -= 1
+            finally:
+                self._lock.release()
+        finally:
+            self.waiting -= 1
+        return time.monotonic() - started_at
+
+
+class UpstreamScheduler:
+    # Every Gemini call goes through here: per-key token-bucket admission with a bounded wait queue,
+    # jittered exponential retry of 429/5xx errors, then the fallback models, and optionally a hedged
+    # second request when the first one is slow. Buckets are per worker, so the effective host-wide
+    # rate is UPSTREAM_RATE_PER_KEY times the number of gunicorn workers.
+
+    def __init__(self, rate: float = UPSTREAM_RATE_PER_KEY, burst: int = UPSTREAM_BURST,
+                 max_queue: int = UPSTREAM_QUEUE_MAX, max_wait: float = UPSTREAM_MAX_WAIT,
+                 max_retries: int = UPSTREAM_MAX_RETRIES, backoff_base: float = UPSTREAM_BACKOFF_BASE,
+                 backoff_max: float = UPSTREAM_BACKOFF_MAX, fallback_models: Optional[List[str]] = None,
+                 hedge_after: float = UPSTREAM_HEDGE_AFTER):
+        self.rate = rate
+        self.burst = burst
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.fallback_models = UPSTREAM_FALLBACK_MODELS if fallback_models is None else fallback_models
+        self.hedge_after = hedge_after
+        self.calls = 0
+        self.rejected = 0
+        self.retries = 0
+        self.fallbacks = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def _bucket(self, api_key: str) -> TokenBucket:
+        digest = hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+        bucket = self._buckets.get(digest)
+        if bucket is None:
+            cutoff = time.monotonic() - UPSTREAM_BUCKET_IDLE_SECONDS
+            for old in [d for d, b in self._buckets.items() if b.updated < cutoff and not b.waiting]:
+                del self._buckets[old]
+            bucket = self._buckets[digest] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    def _backoff(self, attempt: int) -> float:
+        # "Equal jitter": half of the exponential delay is fixed, the other half random
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def _hedged(self, bucket: TokenBucket, call: Callable[[str], Awaitable[Any]], model_name: str, hedge_after: float) -> Any:
+        first = asyncio.ensure_future(call(model_name))
+        tasks = [first]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            # A hedge never waits in the queue: it only goes out if the bucket has a spare token
+            if done or not bucket.try_acquire():
+                return await first
+            self.hedges += 1
+            tasks.append(asyncio.ensure_future(call(model_name)))
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def call(self, api_key: str, model_name: str, call: Callable[[str], Awaitable[Any]],
+                   max_retries: Optional[int] = None, max_wait: Optional[float] = None,
+                   fallback_models: Optional[List[str]] = None, hedge_after: Optional[float] = None) -> Tuple[Any, dict]:
+        # Runs call(model) until it succeeds and returns (result, report). Non-retryable errors are raised
+        # at once; the last retryable error is raised when every model has used up its retries.
+        max_retries = self.max_retries if max_retries is None else max_retries
+        max_wait = self.max_wait if max_wait is None else max_wait
+        fallback_models = self.fallback_models if fallback_models is None else fallback_models
+        hedge_after = self.hedge_after if hedge_after is None else hedge_after
+        bucket = self._bucket(api_key)
+        models = [model_name] + [m for m in fallback_models if m != model_name]
+        report = {"model": model_name, "attempts": 0, "queued_ms": 0.0}
+        self.calls += 1
+
+        last_error: Optional[Exception] = None
+        for model_index, current_model in enumerate(models):
+            if model_index:
+                self.fallbacks += 1
+                report["model"] = current_model
+            for attempt in range(max_retries + 1):
+                try:
+                    report["queued_ms"] += round(await bucket.acquire(max_wait, self.max_queue) * 1000, 1)
+                except UpstreamBusy:
+                    self.rejected += 1
+                    UPSTREAM_ERRORS.inc(error="UpstreamBusy", action="reject")
+                    raise
+                report["attempts"] += 1
+                try:
+                    if hedge_after:
+                        return await self._hedged(bucket, call, current_model, hedge_after), report
+                    return await call(current_model), report
+                except RETRYABLE_ERRORS as e:
+                    last_error = e
+                    print(f"Retryable error from {current_model} (attempt {attempt + 1}): {e}")
+                    if attempt < max_retries:
+                        UPSTREAM_ERRORS.inc(error=type(e).__name__, action="retry")
+                        self.retries += 1
+                        await asyncio.sleep(self._backoff(attempt))
+                    else:
+                        UPSTREAM_ERRORS.inc(error=type(e).__name__, action="fallback" if model_index + 1 < len(models) else "raise")
+                except Exception as e:
+                    UPSTREAM_ERRORS.inc(error=type(e).__name__, action="raise")
+                    raise
+        raise last_error
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls, "rejected": self.rejected, "retries": self.retries, "fallbacks": self.fallbacks,
+            "hedges": self.hedges, "hedge_wins": self.hedge_wins, "api_keys": len(self._buckets),
+        }
+
+
+class ScheduledModel:
+    # Drop-in for a GenerativeModel whose generate_content_async goes through the scheduler
+    # (used for the shard map calls and the prompt refiner)
+
+    def __init__(self, scheduler: UpstreamScheduler, api_key: str, model_name: str,
+                 model_for: Callable[[str], Any], **call_options):
+        self.scheduler = scheduler
+        self.api_key = api_key
+        self.model_name = model_name
+        self.model_for = model_for
+        self.call_options = call_options
+
+    async def generate_content_async(self, contents: Any, **kwargs) -> Any:
+        result, _ = await self.scheduler.call(
+            self.api_key, self.model_name,
+            lambda name: self.model_for(name).generate_content_async(contents, **kwargs),
+            **self.call_options
+        )
+        return result
+
+
+upstream = UpstreamScheduler()